@@ -2,23 +2,45 @@ from flask import Flask
 from flask_migrate import Migrate
 from app.extensions import db, jwt
 from app.routes import main_bp
+from app.write_behind import write_behind
+from app.services.soil_classifier import soil_classifier
+from app.services.photo_derivatives import photo_derivatives
+from app.admission import admission
+from app.metrics import metrics_bp
+from app.profiler import profiler, profiler_bp
+from app.health import health_bp
+from app import timing
+from app import event_loops
+from app import deadline
+from app import db_pool
+from app import db_routing
 from models import *
 from app.services.auth_service import is_token_revoked
 from flask_cors import CORS
-from flask import send_from_directory
-import os
-
-# Always use the same uploads directory relative to this file
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'uploads')
+from werkzeug.middleware.proxy_fix import ProxyFix
+from app import uploads
+from app.storage import storage
+from app.cache import service_cache
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object("config.Config")
 
+    # Client address (request.remote_addr) from X-Forwarded-For, trusting only
+    # the configured number of reverse proxy hops
+    if app.config.get('PROXY_FIX_X_FOR', 0):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['PROXY_FIX_X_FOR'])
+
     # Initialize extensions
+    db_pool.configure(app)
     db.init_app(app)
+    db_pool.init_app(app)
+    db_routing.init_app(app)
     migrate = Migrate(app, db)
     jwt.init_app(app)
+    write_behind.init_app(app)
+    soil_classifier.init_app(app)
+    photo_derivatives.init_app(app)
 
     # Enable CORS
     CORS(app, supports_credentials=True)
@@ -27,12 +49,34 @@ def create_app():
     def check_if_token_revoked(jwt_header, jwt_payload):
         return is_token_revoked(jwt_payload)
     
-    # Serve uploaded files
-    @app.route('/uploads/<path:filename>')
-    def uploaded_file(filename):
-        return send_from_directory(UPLOAD_FOLDER, filename)
+    # Serve uploaded files (directly or through the reverse proxy, see app/uploads.py)
+    uploads.init_app(app)
+
+    # Retention sweeps of the uploads folder (flask storage ...)
+    storage.init_app(app)
+
+    # Upstream answers shared by the workers (flask cache ...)
+    service_cache.init_app(app)
     
+    # Server-Timing headers and per-request timing logs (before admission, so queueing counts)
+    timing.init_app(app)
+
+    # Per-request time budget for the upstream calls (before admission, so queueing spends it)
+    deadline.init_app(app)
+
+    # Admission control for upstream-bound endpoints
+    admission.init_app(app)
+
+    # Async views on a persistent loop per worker thread (before the profiler wraps it)
+    event_loops.init_app(app)
+
+    # Opt-in per-request sampling profiler
+    profiler.init_app(app)
+
     # Register blueprints
     app.register_blueprint(main_bp) 
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(profiler_bp)
+    app.register_blueprint(health_bp)
 
     return app
\ No newline at end of file
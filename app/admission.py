@@ -0,0 +1,175 @@
+import math
+import threading
+import time
+from flask import current_app, g, jsonify, request
+from flask_jwt_extended import decode_token
+from app.metrics import metrics
+from app.timing import record
+
+def request_user_key():
+    """``user:<id>`` from the bearer token, or ``ip:<client ip>``, before the view runs.
+
+    Only the signature is checked; the view's own jwt_required still enforces
+    expiry and the blocklist. The client IP is ``remote_addr``, which ProxyFix
+    takes from X-Forwarded-For only for the PROXY_FIX_X_FOR trusted proxy hops,
+    so a client cannot pick its own key by sending that header.
+    """
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        try:
+            claims = decode_token(auth[7:], allow_expired=True)
+            return f"user:{claims[current_app.config['JWT_IDENTITY_CLAIM']]}"
+        except Exception:
+            pass
+    return f"ip:{request.remote_addr or ''}"
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status, reason, message, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+        self.message = message
+        self.retry_after = retry_after
+
+
+class EndpointClass:
+    """Concurrency limit, bounded FIFO wait queue and per-user cap for one group of endpoints."""
+
+    def __init__(self, name, concurrency, queue_depth, queue_timeout, per_user):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self.per_user = per_user
+        self.active = 0
+        self.waiting = 0
+        self.users = {}
+        # Exponentially weighted mean service time, used to size Retry-After
+        self.avg_service_time = 1.0
+        self._cond = threading.Condition()
+
+    def retry_after(self):
+        backlog = self.waiting + self.active + 1
+        return max(1, math.ceil(self.avg_service_time * backlog / max(self.concurrency, 1)))
+
+    def acquire(self, user_key):
+        with self._cond:
+            if self.per_user and self.users.get(user_key, 0) >= self.per_user:
+                raise AdmissionRejected(429, 'per_user', "Too many requests in flight for this user.", self.retry_after())
+            if self.active >= self.concurrency:
+                if self.waiting >= self.queue_depth:
+                    raise AdmissionRejected(503, 'queue_full', "Server is busy, please retry later.", self.retry_after())
+                self.users[user_key] = self.users.get(user_key, 0) + 1
+                self.waiting += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self.active >= self.concurrency:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._forget(user_key)
+                            raise AdmissionRejected(503, 'queue_timeout', "Server is busy, please retry later.", self.retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            else:
+                self.users[user_key] = self.users.get(user_key, 0) + 1
+            self.active += 1
+
+    def release(self, user_key, elapsed):
+        with self._cond:
+            self.active -= 1
+            self._forget(user_key)
+            self.avg_service_time = 0.8 * self.avg_service_time + 0.2 * elapsed
+            self._cond.notify()
+
+    def _forget(self, user_key):
+        count = self.users.get(user_key, 0) - 1
+        if count > 0:
+            self.users[user_key] = count
+        else:
+            self.users.pop(user_key, None)
+
+
+class AdmissionController:
+    """Admission control for the upstream-bound endpoints.
+
+    Each configured class caps how many of its requests run at once per
+    process. Excess requests wait in a bounded queue, up to a timeout, and
+    each user has an in-flight cap. When a class is saturated the request is
+    answered immediately with 429/503 and a Retry-After header, so it never
+    holds a worker thread that login and the cheap read endpoints need.
+    """
+
+    def __init__(self, app=None):
+        self.classes = {}
+        self._by_endpoint = {}
+        self._admitted = metrics.counter('admission_admitted_total', 'Requests admitted', ['endpoint_class'])
+        self._rejected = metrics.counter('admission_rejected_total', 'Requests rejected by admission control', ['endpoint_class', 'reason'])
+        self._wait = metrics.counter('admission_queue_wait_seconds_total', 'Time admitted requests spent queued', ['endpoint_class'])
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('ADMISSION_ENABLED', True):
+            return
+        for name, spec in app.config.get('ADMISSION_CLASSES', {}).items():
+            endpoint_class = EndpointClass(
+                name,
+                concurrency=spec['concurrency'],
+                queue_depth=spec['queue_depth'],
+                queue_timeout=spec['queue_timeout'],
+                per_user=spec.get('per_user', 0)
+            )
+            self.classes[name] = endpoint_class
+            for endpoint in spec['endpoints']:
+                self._by_endpoint[endpoint] = endpoint_class
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        metrics.register_collector(self._collect)
+        app.extensions['admission'] = self
+
+    def _before_request(self):
+        endpoint_class = self._by_endpoint.get(request.endpoint)
+        if endpoint_class is None or request.method == 'OPTIONS':
+            return None
+        user_key = request_user_key()
+        started = time.monotonic()
+        try:
+            endpoint_class.acquire(user_key)
+        except AdmissionRejected as e:
+            self._rejected.inc(endpoint_class=endpoint_class.name, reason=e.reason)
+            response = jsonify({"error": e.message, "retry_after": e.retry_after})
+            response.status_code = e.status
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        admitted = time.monotonic()
+        self._admitted.inc(endpoint_class=endpoint_class.name)
+        self._wait.inc(admitted - started, endpoint_class=endpoint_class.name)
+        record('admission.queue', admitted - started)
+        g._admission = (endpoint_class, user_key, admitted)
+        return None
+
+    def _teardown_request(self, exc):
+        ticket = g.pop('_admission', None)
+        if ticket is not None:
+            endpoint_class, user_key, admitted = ticket
+            endpoint_class.release(user_key, time.monotonic() - admitted)
+
+    def _collect(self):
+        classes = list(self.classes.values())
+        yield ('admission_concurrency_limit', 'gauge', 'Concurrent requests allowed per endpoint class',
+               [({'endpoint_class': c.name}, c.concurrency) for c in classes])
+        yield ('admission_in_flight', 'gauge', 'Requests currently running per endpoint class',
+               [({'endpoint_class': c.name}, c.active) for c in classes])
+        yield ('admission_queue_depth_limit', 'gauge', 'Maximum queued requests per endpoint class',
+               [({'endpoint_class': c.name}, c.queue_depth) for c in classes])
+        yield ('admission_queue_waiting', 'gauge', 'Requests currently queued per endpoint class',
+               [({'endpoint_class': c.name}, c.waiting) for c in classes])
+        yield ('admission_queue_timeout_seconds', 'gauge', 'Maximum time a request may wait in the queue',
+               [({'endpoint_class': c.name}, c.queue_timeout) for c in classes])
+        yield ('admission_per_user_limit', 'gauge', 'In-flight requests allowed per user (0 = unlimited)',
+               [({'endpoint_class': c.name}, c.per_user) for c in classes])
+
+
+admission = AdmissionController()
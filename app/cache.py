@@ -0,0 +1,431 @@
+"""Cache for upstream answers shared by every worker process.
+
+``service_cache.get_or_compute(namespace, key, ttl, compute)`` returns the
+cached value of ``namespace:key`` or calls ``compute()`` and stores its
+result for ``ttl`` seconds. Only one caller computes a missing key at a time,
+across processes: the others wait for its value, up to CACHE_LOCK_WAIT_SECONDS
+(and the request deadline), then compute it themselves. Exceptions from
+``compute`` are not cached. Values must be JSON-serializable.
+
+Backends (CACHE_BACKEND):
+
+- ``sqlite`` (default): a SQLite file in WAL mode at CACHE_PATH, shared by
+  the workers of a host and kept across restarts and redeploys. Entries past
+  their TTL are never returned; every CACHE_EVICT_EVERY writes a process drops
+  them and, above CACHE_MAX_BYTES, the least recently read entries.
+- ``memory``: a per-process LRU of CACHE_MAX_BYTES, for tests and as the
+  per-worker baseline in the benchmark suite.
+- ``none``: no caching.
+
+A backend error never fails a request: it counts as a miss.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import click
+from flask import g, has_request_context
+from flask.cli import AppGroup
+
+from app import deadline
+from app.metrics import metrics
+
+MISSING = object()
+
+requests_total = metrics.counter('cache_requests_total', 'Service cache lookups by outcome', ['namespace', 'outcome'])
+
+
+class CacheBackend:
+    """Interface of the cache stores; this base class caches nothing.
+
+    Values are JSON text. ``try_lock`` returns a token when the caller got
+    the compute lock of ``key`` (held for at most ``ttl`` seconds), else None.
+    ``blocking`` backends do I/O that may wait (on a file lock); the async
+    path calls them from a worker thread.
+    """
+    name = 'none'
+    blocking = False
+
+    def get(self, key):
+        return MISSING
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def try_lock(self, key, ttl):
+        return uuid.uuid4().hex
+
+    def unlock(self, key, token):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"backend": self.name, "entries": 0, "bytes": 0}
+
+
+class MemoryCache(CacheBackend):
+    """Per-process LRU bounded by the size of the stored JSON."""
+    name = 'memory'
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._locks = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            value, expires_at = entry
+            if expires_at <= time.time():
+                self._pop(key)
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def _pop(self, key):
+        # Caller holds the lock
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def set(self, key, value, ttl):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (value, time.time() + ttl)
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+
+    def try_lock(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            held = self._locks.get(key)
+            if held is not None and held[1] > now:
+                return None
+            token = uuid.uuid4().hex
+            self._locks[key] = (token, now + ttl)
+            return token
+
+    def unlock(self, key, token):
+        with self._lock:
+            if self._locks.get(key, (None,))[0] == token:
+                del self._locks[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._locks.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"backend": self.name, "entries": len(self._entries), "bytes": self._bytes}
+
+
+class SQLiteCache(CacheBackend):
+    """Cache table in a SQLite file in WAL mode, shared by every process on the host.
+
+    Compute locks are rows of cache_locks with an expiry, so a process that
+    died while computing holds its key for at most the lock TTL.
+    """
+    name = 'sqlite'
+    blocking = True
+
+    # Reads refresh accessed_at (the eviction order) at most this often
+    TOUCH_SECONDS = 5
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, evict_every=200, busy_timeout=2.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        # A forked worker must not share its parent's connection
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache ('
+                         'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+                         'expires_at REAL NOT NULL, accessed_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_accessed_at ON cache (accessed_at)')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_locks ('
+                         'key TEXT PRIMARY KEY, token TEXT NOT NULL, expires_at REAL NOT NULL)')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute('SELECT value, expires_at, accessed_at FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return MISSING
+        value, expires_at, accessed_at = row
+        now = time.time()
+        if expires_at <= now:
+            return MISSING
+        if now - accessed_at > self.TOUCH_SECONDS:
+            conn.execute('UPDATE cache SET accessed_at = ? WHERE key = ?', (now, key))
+        return value
+
+    def set(self, key, value, ttl):
+        size = len(value.encode())
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        self._conn().execute('INSERT OR REPLACE INTO cache (key, value, size, expires_at, accessed_at) '
+                             'VALUES (?, ?, ?, ?, ?)', (key, value, size, now + ttl, now))
+        with self._writes_lock:
+            self._writes += 1
+            due = self._writes % self.evict_every == 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        """Drop expired entries and locks, then the least recently read entries down to 90% of max_bytes"""
+        conn = self._conn()
+        now = time.time()
+        conn.execute('DELETE FROM cache WHERE expires_at <= ?', (now,))
+        conn.execute('DELETE FROM cache_locks WHERE expires_at <= ?', (now,))
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache').fetchone()[0]
+        if total > self.max_bytes:
+            conn.execute('DELETE FROM cache WHERE key IN ('
+                         'SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC, key) AS kept FROM cache) '
+                         'WHERE kept > ?)', (int(self.max_bytes * 0.9),))
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def try_lock(self, key, ttl):
+        token = uuid.uuid4().hex
+        now = time.time()
+        # Takes the lock when it is free or its holder's lease ran out
+        taken = self._conn().execute(
+            'INSERT INTO cache_locks (key, token, expires_at) VALUES (?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET token = excluded.token, expires_at = excluded.expires_at '
+            'WHERE cache_locks.expires_at <= ?', (key, token, now + ttl, now)).rowcount
+        return token if taken == 1 else None
+
+    def unlock(self, key, token):
+        self._conn().execute('DELETE FROM cache_locks WHERE key = ? AND token = ?', (key, token))
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute('DELETE FROM cache')
+        conn.execute('DELETE FROM cache_locks')
+
+    def stats(self):
+        now = time.time()
+        entries, size, expired = self._conn().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(expires_at <= ?), 0) FROM cache', (now,)).fetchone()
+        return {"backend": self.name, "path": self.path, "entries": entries, "bytes": size, "expired": expired}
+
+
+def _count(namespace, outcome):
+    requests_total.inc(namespace=namespace, outcome=outcome)
+    if has_request_context():
+        name = '_cache_hits' if outcome in ('hit', 'coalesced') else '_cache_misses'
+        setattr(g, name, g.get(name, 0) + 1)
+
+
+class ServiceCache:
+    """Flask extension holding the configured backend and the get-or-compute logic."""
+
+    def __init__(self, app=None):
+        self.backend = CacheBackend()
+        self.lock_seconds = 30
+        self.lock_wait = 10
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        config = app.config
+        kind = config.get('CACHE_BACKEND', 'sqlite')
+        max_bytes = config.get('CACHE_MAX_BYTES', 256 * 1024 * 1024)
+        if kind == 'sqlite':
+            self.backend = SQLiteCache(config.get('CACHE_PATH') or os.path.join(os.getcwd(), 'cache', 'services.sqlite3'),
+                                       max_bytes=max_bytes, evict_every=config.get('CACHE_EVICT_EVERY', 200))
+        elif kind == 'memory':
+            self.backend = MemoryCache(max_bytes=max_bytes)
+        elif kind == 'none':
+            self.backend = CacheBackend()
+        else:
+            raise ValueError(f"Unknown CACHE_BACKEND {kind!r} (expected sqlite, memory or none)")
+        self.lock_seconds = config.get('CACHE_LOCK_SECONDS', 30)
+        self.lock_wait = config.get('CACHE_LOCK_WAIT_SECONDS', 10)
+        if config.get('QUERY_COUNT_HEADER', False):
+            app.after_request(self._add_headers)
+        metrics.register_collector(self._collect)
+        app.cli.add_command(cache_cli)
+        app.extensions['service_cache'] = self
+
+    def _add_headers(self, response):
+        response.headers['X-Cache-Hits'] = str(g.get('_cache_hits', 0))
+        response.headers['X-Cache-Misses'] = str(g.get('_cache_misses', 0))
+        return response
+
+    def _collect(self):
+        stats = self.backend.stats()
+        yield ('cache_entries', 'gauge', 'Entries in the service cache', [({'backend': stats['backend']}, stats['entries'])])
+        yield ('cache_bytes', 'gauge', 'Bytes of values in the service cache', [({'backend': stats['backend']}, stats['bytes'])])
+
+    # Backend calls; a failing store behaves like an empty one
+
+    def _get(self, key):
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            print(f"Cache get failed: {str(e)}")
+            return MISSING
+        return MISSING if value is MISSING else json.loads(value)
+
+    def _set(self, key, value, ttl):
+        try:
+            self.backend.set(key, json.dumps(value, separators=(',', ':')), ttl)
+        except Exception as e:
+            print(f"Cache set failed: {str(e)}")
+
+    def _lock(self, key):
+        try:
+            return self.backend.try_lock(key, self.lock_seconds)
+        except Exception as e:
+            print(f"Cache lock failed: {str(e)}")
+            return ''
+
+    def _unlock(self, key, token):
+        if not token:
+            return
+        try:
+            self.backend.unlock(key, token)
+        except Exception as e:
+            print(f"Cache unlock failed: {str(e)}")
+
+    def _attempt(self, namespace, key, waited):
+        """One look at the key: ('hit', value), ('own', token) or ('wait', None)"""
+        value = self._get(key)
+        if value is not MISSING:
+            _count(namespace, 'coalesced' if waited else 'hit')
+            return 'hit', value
+        token = self._lock(key)
+        if token is None:
+            return 'wait', None
+        # Stored by the previous holder between our read and our lock
+        value = self._get(key)
+        if value is not MISSING:
+            self._unlock(key, token)
+            _count(namespace, 'coalesced' if waited else 'hit')
+            return 'hit', value
+        _count(namespace, 'miss')
+        return 'own', token
+
+    async def _off_loop(self, func, *args):
+        """``func(*args)``, in a worker thread when the backend call may block"""
+        if self.backend.blocking:
+            return await asyncio.to_thread(func, *args)
+        return func(*args)
+
+    def _give_up_at(self):
+        left = deadline.remaining()
+        return time.monotonic() + (min(self.lock_wait, left) if left is not None else self.lock_wait)
+
+    def get_or_compute(self, namespace, key, ttl, compute):
+        """Cached value of ``namespace:key``, or ``compute()`` stored for ``ttl`` seconds"""
+        if not ttl or ttl <= 0:
+            return compute()
+        full_key = f"{namespace}:{key}"
+        give_up = self._give_up_at()
+        delay, waited = 0.02, False
+        while True:
+            outcome, found = self._attempt(namespace, full_key, waited)
+            if outcome == 'hit':
+                return found
+            if outcome == 'own':
+                break
+            if time.monotonic() >= give_up:
+                _count(namespace, 'lock_timeout')
+                return compute()
+            waited = True
+            time.sleep(delay)
+            delay = min(delay * 2, 0.25)
+        try:
+            value = compute()
+            self._set(full_key, value, ttl)
+            return value
+        finally:
+            self._unlock(full_key, found)
+
+    async def get_or_compute_async(self, namespace, key, ttl, compute):
+        """Same as get_or_compute, for a ``compute`` returning an awaitable.
+
+        The backend is never called on the event loop itself: a SQLite file
+        busy with another process's write would stall every task on it.
+        """
+        if not ttl or ttl <= 0:
+            return await compute()
+        full_key = f"{namespace}:{key}"
+        give_up = self._give_up_at()
+        delay, waited = 0.02, False
+        while True:
+            outcome, found = await self._off_loop(self._attempt, namespace, full_key, waited)
+            if outcome == 'hit':
+                return found
+            if outcome == 'own':
+                break
+            if time.monotonic() >= give_up:
+                _count(namespace, 'lock_timeout')
+                return await compute()
+            waited = True
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.25)
+        try:
+            value = await compute()
+            await self._off_loop(self._set, full_key, value, ttl)
+            return value
+        finally:
+            await self._off_loop(self._unlock, full_key, found)
+
+
+service_cache = ServiceCache()
+
+cache_cli = AppGroup('cache', help='Shared service cache: stats and clearing.')
+
+
+@cache_cli.command('stats')
+def stats_command():
+    """Print the backend, entry count and size of the service cache as JSON."""
+    click.echo(json.dumps(service_cache.backend.stats(), indent=2))
+
+
+@cache_cli.command('clear')
+def clear_command():
+    """Remove every entry and compute lock from the service cache."""
+    service_cache.backend.clear()
+    click.echo(json.dumps(service_cache.backend.stats(), indent=2))
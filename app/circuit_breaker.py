@@ -0,0 +1,134 @@
+"""Per-upstream circuit breakers.
+
+A breaker starts ``closed`` and counts consecutive failures of its upstream
+(timeouts, connection errors, 429 and 5xx answers). After
+CIRCUIT_BREAKER_FAILURES of them it opens: calls fail at once with
+CircuitOpen instead of waiting out their timeout. After
+CIRCUIT_BREAKER_RESET_SECONDS it lets CIRCUIT_BREAKER_HALF_OPEN_CALLS trial
+calls through (``half_open``); one success closes it again, one failure
+re-opens it for another reset period.
+
+State is per worker process. It is exported as the ``circuit_breaker_state``
+gauge (0 closed, 1 half-open, 2 open) with transition and rejection counters.
+"""
+import threading
+import time
+from flask import current_app
+from app.metrics import metrics
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+state_gauge = metrics.gauge('circuit_breaker_state', 'Circuit breaker state per upstream (0 closed, 1 half-open, 2 open)', ['upstream'])
+transitions = metrics.counter('circuit_breaker_transitions_total', 'Circuit breaker state changes', ['upstream', 'state'])
+rejected = metrics.counter('circuit_breaker_rejected_total', 'Calls refused while a circuit breaker was open', ['upstream'])
+failures = metrics.counter('circuit_breaker_failures_total', 'Upstream call failures counted by circuit breakers', ['upstream'])
+
+
+class CircuitOpen(Exception):
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"{upstream} is unavailable (circuit open, retry in {retry_after}s)")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+def counts_as_failure(error):
+    """Whether an exception from an upstream call says the upstream is unhealthy.
+
+    Other 4xx answers (bad key, bad parameters) are the caller's problem and
+    leave the breaker alone.
+    """
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status is None or status == 429 or status >= 500
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, half_open_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trials = 0
+        self._lock = threading.Lock()
+        state_gauge.set(STATE_VALUES[CLOSED], upstream=name)
+
+    def _transition(self, state):
+        # Caller holds the lock
+        self.state = state
+        state_gauge.set(STATE_VALUES[state], upstream=self.name)
+        transitions.inc(upstream=self.name, state=state)
+
+    def retry_after(self):
+        return max(1, round(self.opened_at + self.reset_timeout - time.monotonic()))
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call may go to the upstream now"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    rejected.inc(upstream=self.name)
+                    raise CircuitOpen(self.name, self.retry_after())
+                self._transition(HALF_OPEN)
+                self.trials = 0
+            if self.state == HALF_OPEN:
+                if self.trials >= self.half_open_calls:
+                    rejected.inc(upstream=self.name)
+                    raise CircuitOpen(self.name, 1)
+                self.trials += 1
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def record_failure(self):
+        failures.inc(upstream=self.name)
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                if self.state != OPEN:
+                    self._transition(OPEN)
+
+    def release(self):
+        """End a half-open trial that neither succeeded nor failed (e.g. a 4xx answer)"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.trials = max(0, self.trials - 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {"state": self.state, "failures": self.failures,
+                    "retry_after": self.retry_after() if self.state == OPEN else None}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name):
+    """The process-wide breaker of an upstream, created from the app config on first use"""
+    existing = _breakers.get(name)
+    if existing is not None:
+        return existing
+    config = current_app.config
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                failure_threshold=config.get('CIRCUIT_BREAKER_FAILURES', 5),
+                reset_timeout=config.get('CIRCUIT_BREAKER_RESET_SECONDS', 30),
+                half_open_calls=config.get('CIRCUIT_BREAKER_HALF_OPEN_CALLS', 1),
+            )
+        return _breakers[name]
+
+
+def states():
+    return {name: b.snapshot() for name, b in list(_breakers.items())}
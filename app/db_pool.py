@@ -0,0 +1,160 @@
+import time
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+from app.extensions import db
+from app.metrics import metrics
+from app.timing import record
+
+checkout_wait = metrics.summary('db_pool_checkout_wait_seconds',
+                                'Time spent getting a connection from the pool (includes connecting)', ['bind'])
+hold_time = metrics.summary('db_pool_hold_seconds', 'Time a connection stays checked out', ['bind'])
+checkouts = metrics.counter('db_pool_checkouts_total', 'Connections checked out of the pool', ['bind'])
+connects = metrics.counter('db_pool_connects_total', 'New DBAPI connections opened', ['bind'])
+invalidations = metrics.counter('db_pool_invalidations_total', 'Connections invalidated (hard or soft)', ['bind', 'kind'])
+timeouts = metrics.counter('db_pool_timeouts_total', 'Checkouts that gave up after pool_timeout', ['bind'])
+
+
+class _TimedCheckout:
+    """Times ``_do_get``, which is where a checkout waits for a free slot or a new connection."""
+    bind_label = 'default'
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timeouts.inc(bind=self.bind_label)
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            checkout_wait.observe(waited, bind=self.bind_label)
+            record('db.pool_wait', waited)
+
+    def recreate(self):
+        # engine.dispose() swaps in a recreated pool; keep its label
+        pool = super().recreate()
+        pool.bind_label = self.bind_label
+        return pool
+
+
+class InstrumentedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class InstrumentedNullPool(_TimedCheckout, NullPool):
+    pass
+
+
+def _disable_prepared_statements(url, connect_args):
+    # Transaction-mode poolers hand each transaction to any server connection,
+    # so named prepared statements from an earlier transaction may not exist.
+    if url.get_backend_name() != 'postgresql':
+        return
+    driver = url.get_driver_name()
+    if driver == 'psycopg':
+        connect_args['prepare_threshold'] = None
+    elif driver == 'asyncpg':
+        connect_args['statement_cache_size'] = 0
+    # psycopg2 and pg8000 only use unnamed statements: nothing to disable
+
+
+def engine_options(config, url, base=None):
+    """Engine options for ``url`` built from the DB_POOL_* settings.
+
+    ``base`` (normally SQLALCHEMY_ENGINE_OPTIONS) wins over anything derived
+    here, so explicit engine options are never overridden.
+    """
+    url = sa.engine.make_url(url)
+    options = dict(base or {})
+    connect_args = dict(options.get('connect_args', {}))
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        # Flask-SQLAlchemy forces a StaticPool for in-memory SQLite
+        return options
+
+    if config.get('DB_POOL_MODE', 'queue') == 'external':
+        options.setdefault('poolclass', InstrumentedNullPool)
+        _disable_prepared_statements(url, connect_args)
+    else:
+        options.setdefault('poolclass', InstrumentedQueuePool)
+        options.setdefault('pool_size', config.get('DB_POOL_SIZE', 5))
+        options.setdefault('max_overflow', config.get('DB_MAX_OVERFLOW', 10))
+        options.setdefault('pool_timeout', config.get('DB_POOL_TIMEOUT', 30))
+        options.setdefault('pool_recycle', config.get('DB_POOL_RECYCLE', 300))
+        options.setdefault('pool_use_lifo', config.get('DB_POOL_USE_LIFO', True))
+        options.setdefault('pool_pre_ping', config.get('DB_POOL_PRE_PING', False))
+    if connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+
+def configure(app):
+    """Apply the DB_POOL_* settings to the engine options; call before ``db.init_app``"""
+    base = app.config.get('SQLALCHEMY_ENGINE_OPTIONS')
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config, app.config['SQLALCHEMY_DATABASE_URI'], base)
+    # Flask-SQLAlchemy gives URL-only binds none of SQLALCHEMY_ENGINE_OPTIONS
+    binds = {}
+    for key, value in app.config.get('SQLALCHEMY_BINDS', {}).items():
+        if isinstance(value, dict):
+            binds[key] = value
+        else:
+            binds[key] = dict(engine_options(app.config, value, base), url=value)
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def init_app(app):
+    """Attach pool event listeners to every engine and export pool state as metrics"""
+    with app.app_context():
+        engines = dict(db.engines)
+    for bind, engine in engines.items():
+        _instrument(engine, bind or 'default')
+
+    def collect():
+        samples = {name: [] for name in ('size', 'checked_out', 'checked_in', 'overflow', 'max_overflow')}
+        for bind, engine in engines.items():
+            pool = engine.pool
+            labels = {'bind': bind or 'default'}
+            if isinstance(pool, QueuePool):
+                samples['size'].append((labels, pool.size()))
+                samples['checked_out'].append((labels, pool.checkedout()))
+                samples['checked_in'].append((labels, pool.checkedin()))
+                # overflow() starts at -pool_size and counts up as connections open
+                samples['overflow'].append((labels, max(0, pool.overflow())))
+                samples['max_overflow'].append((labels, pool._max_overflow))
+        yield ('db_pool_size', 'gauge', 'Configured pool size', samples['size'])
+        yield ('db_pool_checked_out', 'gauge', 'Connections currently checked out', samples['checked_out'])
+        yield ('db_pool_checked_in', 'gauge', 'Idle connections held by the pool', samples['checked_in'])
+        yield ('db_pool_overflow', 'gauge', 'Connections open beyond pool_size', samples['overflow'])
+        yield ('db_pool_max_overflow', 'gauge', 'Configured max_overflow', samples['max_overflow'])
+
+    metrics.register_collector(collect)
+
+
+def _instrument(engine, bind_label):
+    pool = engine.pool
+    if isinstance(pool, _TimedCheckout):
+        pool.bind_label = bind_label
+
+    @event.listens_for(pool, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        connects.inc(bind=bind_label)
+
+    @event.listens_for(pool, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info['checked_out_at'] = time.perf_counter()
+        checkouts.inc(bind=bind_label)
+
+    @event.listens_for(pool, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop('checked_out_at', None)
+        if started is not None:
+            hold_time.observe(time.perf_counter() - started, bind=bind_label)
+
+    @event.listens_for(pool, 'invalidate')
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        invalidations.inc(bind=bind_label, kind='hard')
+
+    @event.listens_for(pool, 'soft_invalidate')
+    def on_soft_invalidate(dbapi_connection, connection_record, exception):
+        invalidations.inc(bind=bind_label, kind='soft')
@@ -0,0 +1,119 @@
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from app.metrics import metrics
+
+REPLICA_BIND = 'replica'
+
+routed_statements = metrics.counter('db_routed_statements_total', 'SELECT statements by routing target', ['target'])
+
+
+class RoutingSession(Session):
+    """Sends SELECTs to the replica bind while replica reads are enabled.
+
+    Replica reads are enabled for the current request by ``@read_only`` or for
+    a block by ``replica_reads()``. Flushes and non-SELECT statements always go
+    to the primary, as does everything when no replica is configured.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and _replica_enabled() and getattr(clause, 'is_select', False):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                routed_statements.inc(target='replica')
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# Set by replica_reads(); a context variable so it also holds inside async views
+_replica_block = contextvars.ContextVar('replica_block', default=False)
+
+
+def _replica_enabled():
+    if _replica_block.get():
+        return True
+    return has_request_context() and g.get('_db_replica', False)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _note_write(session, flush_context):
+    if has_request_context():
+        g._db_wrote = True
+
+
+class RecentWrites:
+    """Users who committed a write recently, so their reads stay on the primary.
+
+    Process-local: with several workers, a read served by a worker other than
+    the one that handled the write can still see replica lag.
+    """
+
+    def __init__(self):
+        self._until = {}
+        self._lock = threading.Lock()
+
+    def mark(self, user, seconds):
+        now = time.monotonic()
+        with self._lock:
+            self._until[user] = now + seconds
+            if len(self._until) > 10000:
+                self._until = {k: v for k, v in self._until.items() if v > now}
+
+    def recent(self, user):
+        with self._lock:
+            until = self._until.get(user)
+        return until is not None and until > time.monotonic()
+
+
+recent_writes = RecentWrites()
+
+
+def _current_user():
+    try:
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+
+def read_only(view):
+    """Route the view's SELECTs to the replica, unless this user wrote recently.
+
+    Apply below ``@jwt_required()`` so the identity is known.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        user = _current_user()
+        if user is None or not recent_writes.recent(user):
+            g._db_replica = True
+        return current_app.ensure_sync(view)(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def replica_reads():
+    """Send SELECTs in this block to the replica (lag-tolerant lookups, reports)."""
+    token = _replica_block.set(True)
+    try:
+        yield
+    finally:
+        _replica_block.reset(token)
+
+
+def init_app(app):
+    """Remember which users just wrote, so their reads stay on the primary"""
+    if REPLICA_BIND not in app.config.get('SQLALCHEMY_BINDS', {}):
+        return
+    sticky_seconds = app.config.get('REPLICA_STICKY_SECONDS', 10)
+
+    @app.teardown_request
+    def _mark_writer(exc):
+        if g.get('_db_wrote'):
+            user = _current_user()
+            if user is not None:
+                recent_writes.mark(user, sticky_seconds)
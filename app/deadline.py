@@ -0,0 +1,93 @@
+"""Per-request time budget shared by every upstream call of a request.
+
+A request gets a deadline when it starts: REQUEST_DEADLINES[endpoint]
+seconds, shortened by the client's REQUEST_DEADLINE_HEADER (seconds it is
+still willing to wait). Admission queueing counts against it, since the
+client's clock is running too.
+
+WeatherService and ClaudeService ask ``timeout(default, stage)`` for each
+call instead of using their fixed timeouts, so a stage never waits longer
+than what is left; once less than DEADLINE_MIN_STAGE_SECONDS remains a stage
+is not started at all and DeadlineExceeded is raised, answered with 504.
+Optional stages (same-day history, soil tier escalation, Claude's shortlist
+elaboration) check ``allows(seconds, stage)`` first and are skipped when
+the budget is running low.
+"""
+import time
+from flask import current_app, g, has_request_context, jsonify, request
+from app.metrics import metrics
+
+exceeded = metrics.counter('deadline_exceeded_total', 'Stages not started because the request deadline had passed', ['stage'])
+skipped = metrics.counter('deadline_skipped_stages_total', 'Optional stages skipped for lack of time budget', ['stage'])
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage):
+        super().__init__(f"Request deadline exceeded before {stage}")
+        self.stage = stage
+
+
+def remaining():
+    """Seconds left for the current request, or None when it has no deadline"""
+    if not has_request_context():
+        return None
+    deadline = g.get('_deadline')
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired():
+    left = remaining()
+    return left is not None and left < current_app.config.get('DEADLINE_MIN_STAGE_SECONDS', 0.5)
+
+
+def timeout(default, stage):
+    """Timeout for a call in ``stage``: ``default`` capped to the remaining budget"""
+    left = remaining()
+    if left is None:
+        return default
+    if left < current_app.config.get('DEADLINE_MIN_STAGE_SECONDS', 0.5):
+        exceeded.inc(stage=stage)
+        raise DeadlineExceeded(stage)
+    return left if default is None else min(default, left)
+
+
+def allows(seconds, stage):
+    """Whether an optional stage needing about ``seconds`` still fits in the budget"""
+    left = remaining()
+    if left is None or left >= seconds:
+        return True
+    skipped.inc(stage=stage)
+    return False
+
+
+def _client_budget():
+    header = request.headers.get(current_app.config.get('REQUEST_DEADLINE_HEADER', 'X-Request-Timeout'))
+    if not header:
+        return None
+    try:
+        seconds = float(header)
+    except ValueError:
+        return None
+    return seconds if seconds > 0 else None
+
+
+def _start():
+    budget = current_app.config.get('REQUEST_DEADLINES', {}).get(request.endpoint)
+    client = _client_budget()
+    if client is not None:
+        budget = min(budget, client) if budget else min(client, current_app.config.get('REQUEST_DEADLINE_MAX_SECONDS', 60))
+    if budget:
+        g._deadline = time.monotonic() + budget
+
+
+def _exceeded(e):
+    return jsonify({"error": str(e), "stage": e.stage}), 504
+
+
+def init_app(app):
+    if not app.config.get('REQUEST_DEADLINES_ENABLED', True):
+        return
+    app.before_request(_start)
+    app.register_error_handler(DeadlineExceeded, _exceeded)
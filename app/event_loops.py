@@ -0,0 +1,96 @@
+"""Long-lived event loops and upstream clients for the async views.
+
+Flask runs an async view through asgiref, which starts a new event loop, in
+a new thread, for every request. Anything bound to a loop -- the httpx and
+Anthropic connection pools -- then has to be built again for each request,
+and so do its TLS handshakes. Instead, each worker thread keeps one event
+loop for its lifetime and runs its async views on it. The views stay on the
+request thread, so a blocking database call still holds up only its own
+request.
+
+``loop_local(key, factory)`` keeps one object (a client) per loop, so it
+is built once per worker thread and reused by every request that thread
+serves. The clients share the ``ssl_context()`` of the process.
+"""
+import asyncio
+import functools
+import os
+import threading
+import weakref
+
+_local = threading.local()
+_resources = weakref.WeakKeyDictionary()
+_resources_lock = threading.Lock()
+_ssl_context = None
+_ssl_context_lock = threading.Lock()
+
+
+def _thread_loop():
+    loop = getattr(_local, 'loop', None)
+    # A forked worker must not run its parent's loop
+    if loop is None or loop.is_closed() or _local.pid != os.getpid():
+        loop = asyncio.new_event_loop()
+        _local.loop, _local.pid = loop, os.getpid()
+        # Closed with its thread (or at exit)
+        weakref.finalize(threading.current_thread(), _close, loop)
+    return loop
+
+
+def _close(loop):
+    if not loop.is_running() and not loop.is_closed():
+        loop.close()
+
+
+def _cancel_leftovers(loop):
+    """Cancel what a view left running (as asyncio.run does), so it cannot spill into the next request"""
+    pending = [task for task in asyncio.all_tasks(loop) if not task.done()]
+    for task in pending:
+        task.cancel()
+    if pending:
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+
+
+def loop_local(key, factory):
+    """``factory()``, created once for the running event loop and cached under ``key``"""
+    loop = asyncio.get_running_loop()
+    with _resources_lock:
+        values = _resources.setdefault(loop, {})
+        if key not in values:
+            values[key] = factory()
+        return values[key]
+
+
+def ssl_context():
+    """One TLS context (CA bundle loaded once) for every async client of the process"""
+    global _ssl_context
+    if _ssl_context is None:
+        with _ssl_context_lock:
+            if _ssl_context is None:
+                import httpx
+                _ssl_context = httpx.create_ssl_context()
+    return _ssl_context
+
+
+def init_app(app):
+    """Run async views on the request thread's persistent loop.
+
+    Goes before anything else that wraps ``app.async_to_sync`` (the profiler).
+    """
+    fallback = app.async_to_sync
+
+    def async_to_sync(func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                loop = _thread_loop()
+                try:
+                    return loop.run_until_complete(func(*args, **kwargs))
+                finally:
+                    _cancel_leftovers(loop)
+            # Called from inside a running loop: leave it to asgiref
+            return fallback(func)(*args, **kwargs)
+        return run
+
+    app.async_to_sync = async_to_sync
@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
+from app.db_routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 jwt = JWTManager()
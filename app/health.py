@@ -0,0 +1,23 @@
+from flask import Blueprint, current_app, jsonify
+from sqlalchemy import text
+from app.extensions import db
+from app.warmup import retry_warm_up
+
+health_bp = Blueprint("health", __name__)
+
+@health_bp.route("/health/live", methods=["GET"])
+def liveness():
+    """The process is up and serving requests"""
+    return jsonify({"status": "alive"})
+
+@health_bp.route("/health/ready", methods=["GET"])
+def readiness():
+    """Warm-up has finished in this worker and the database answers"""
+    state = current_app.extensions.get('warmup', {})
+    if not state.get('ready') and not retry_warm_up(current_app._get_current_object()):
+        return jsonify({"status": "warming_up", "error": state.get('error')}), 503
+    try:
+        db.session.execute(text('SELECT 1'))
+    except Exception as e:
+        return jsonify({"status": "unavailable", "error": str(e)}), 503
+    return jsonify({"status": "ready", "warmup_ms": state.get('duration_ms')})
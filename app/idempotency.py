@@ -0,0 +1,226 @@
+"""Idempotency-Key support for the endpoints that write rows and pay for upstream calls.
+
+A client that retries a request after a timeout sends the same
+``Idempotency-Key`` header again. The first request with a key claims it in
+the idempotency_keys table (shared by every worker) together with a
+fingerprint of the request; its response is stored there when it finishes.
+
+- A retry of a completed request gets the stored response back, with an
+  ``Idempotent-Replayed: true`` header, and nothing is recomputed.
+- A retry that arrives while the first request is still running waits for it,
+  up to IDEMPOTENCY_WAIT_SECONDS (and the request deadline), then gets 409
+  with Retry-After.
+- The same key with a different body, path or query is refused with 422.
+- 5xx responses are not stored: the key is released so a retry runs again.
+
+An in-flight claim is leased for IDEMPOTENCY_LOCK_SECONDS, so a worker that
+died mid-request does not block its key forever. Keys expire after
+IDEMPOTENCY_TTL_HOURS and expired rows are purged by the workers.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from flask import Response, current_app, jsonify, request
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from app import deadline
+from app.admission import request_user_key
+from app.extensions import db
+from app.metrics import metrics
+from models.idempotency_keys import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+IN_FLIGHT = 'in_flight'
+COMPLETED = 'completed'
+
+requests_total = metrics.counter('idempotency_requests_total', 'Requests carrying an Idempotency-Key by outcome', ['endpoint', 'outcome'])
+
+_table = IdempotencyKey.__table__
+_last_purge = 0.0
+_purge_lock = threading.Lock()
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def fingerprint():
+    """sha256 of the method, path, query and body; form fields and files are hashed
+    by value, so a client rebuilding a multipart body with a new boundary still matches"""
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.path}?{request.query_string.decode()}\n".encode())
+    if request.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        for name, value in sorted(request.form.items(multi=True)):
+            digest.update(f"{name}={value}\n".encode())
+        # Files keep their order: it is the order of the photos
+        for name, file in sorted(request.files.items(multi=True), key=lambda item: item[0]):
+            digest.update(f"{name}:{file.filename}:".encode())
+            for chunk in iter(lambda: file.stream.read(64 * 1024), b''):
+                digest.update(chunk)
+            file.stream.seek(0)
+    else:
+        body = request.get_json(silent=True)
+        if body is not None:
+            digest.update(json.dumps(body, sort_keys=True, separators=(',', ':')).encode())
+        else:
+            digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+
+def _key_filter(scope, key):
+    return (_table.c.scope == scope) & (_table.c.key == key)
+
+
+def _claim_values(fp, now):
+    config = current_app.config
+    return {
+        "endpoint": request.endpoint,
+        "fingerprint": fp,
+        "state": IN_FLIGHT,
+        "response_status": None,
+        "response_mimetype": None,
+        "response_body": None,
+        "created_at": now,
+        "locked_until": now + timedelta(seconds=config.get('IDEMPOTENCY_LOCK_SECONDS', 120)),
+        "expires_at": now + timedelta(hours=config.get('IDEMPOTENCY_TTL_HOURS', 24)),
+    }
+
+
+def _claim(scope, key, fp):
+    """Insert the key as in flight; False when it already exists"""
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(insert(_table).values(scope=scope, key=key, **_claim_values(fp, _now())))
+        return True
+    except IntegrityError:
+        return False
+
+
+def _take_over(scope, key, fp):
+    """Reclaim an expired key or one whose owner's lease ran out; False if someone else did first"""
+    now = _now()
+    with db.engine.begin() as conn:
+        taken = conn.execute(update(_table).where(
+            _key_filter(scope, key),
+            or_(_table.c.expires_at <= now, (_table.c.state == IN_FLIGHT) & (_table.c.locked_until <= now))
+        ).values(**_claim_values(fp, now))).rowcount
+    return taken == 1
+
+
+def _load(scope, key):
+    with db.engine.connect() as conn:
+        return conn.execute(select(_table).where(_key_filter(scope, key))).first()
+
+
+def _release(scope, key):
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(delete(_table).where(_key_filter(scope, key), _table.c.state == IN_FLIGHT))
+    except Exception as e:
+        print(f"Idempotency key release failed: {str(e)}")
+
+
+def _complete(scope, key, response):
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(update(_table).where(_key_filter(scope, key)).values(
+                state=COMPLETED,
+                response_status=response.status_code,
+                response_mimetype=response.mimetype,
+                response_body=response.get_data(),
+                locked_until=None
+            ))
+    except Exception as e:
+        print(f"Idempotency key completion failed: {str(e)}")
+
+
+def _purge_expired():
+    global _last_purge
+    interval = current_app.config.get('IDEMPOTENCY_PURGE_INTERVAL', 300)
+    with _purge_lock:
+        if time.monotonic() - _last_purge < interval:
+            return
+        _last_purge = time.monotonic()
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(delete(_table).where(_table.c.expires_at <= _now()))
+    except Exception as e:
+        print(f"Idempotency key purge failed: {str(e)}")
+
+
+def _replay(row):
+    response = Response(row.response_body, status=row.response_status, mimetype=row.response_mimetype)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _attempt(scope, key, fp):
+    """One look at the key: ('own', None), ('wait', None) or ('respond', response)"""
+    if _claim(scope, key, fp):
+        return 'own', None
+    row = _load(scope, key)
+    if row is None:
+        # Released between the insert and the read
+        return 'wait', None
+    now = _now()
+    if row.expires_at <= now or (row.state == IN_FLIGHT and row.locked_until and row.locked_until <= now):
+        return ('own', None) if _take_over(scope, key, fp) else ('wait', None)
+    if row.fingerprint != fp:
+        requests_total.inc(endpoint=request.endpoint, outcome='mismatch')
+        return 'respond', (jsonify({"error": f"{HEADER} was already used for a different request"}), 422)
+    if row.state == COMPLETED:
+        requests_total.inc(endpoint=request.endpoint, outcome='replayed')
+        return 'respond', _replay(row)
+    return 'wait', None
+
+
+def idempotent(view):
+    """Honour the Idempotency-Key header on an async view.
+
+    Goes below ``jwt_required`` so replays are only served to an
+    authenticated caller; keys are scoped to the user (or the client IP).
+    """
+    @functools.wraps(view)
+    async def wrapper(*args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not current_app.config.get('IDEMPOTENCY_ENABLED', True):
+            return await view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"error": f"{HEADER} must be at most 255 characters"}), 400
+        _purge_expired()
+        scope = request_user_key()[:80]
+        fp = fingerprint()
+        wait = current_app.config.get('IDEMPOTENCY_WAIT_SECONDS', 30)
+        left = deadline.remaining()
+        give_up = time.monotonic() + (min(wait, left) if left is not None else wait)
+        delay, waited = 0.05, False
+        while True:
+            outcome, response = _attempt(scope, key, fp)
+            if outcome == 'respond':
+                return response
+            if outcome == 'own':
+                break
+            if time.monotonic() >= give_up:
+                requests_total.inc(endpoint=request.endpoint, outcome='in_progress')
+                response = jsonify({"error": f"A request with this {HEADER} is still in progress"})
+                response.headers['Retry-After'] = str(max(1, round(delay * 4)))
+                return response, 409
+            waited = True
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        requests_total.inc(endpoint=request.endpoint, outcome='after_wait' if waited else 'new')
+        try:
+            response = current_app.make_response(await view(*args, **kwargs))
+        except BaseException:
+            _release(scope, key)
+            raise
+        if response.status_code >= 500 or response.direct_passthrough or response.is_streamed:
+            _release(scope, key)
+        else:
+            _complete(scope, key, response)
+        return response
+    return wrapper
@@ -0,0 +1,174 @@
+import math
+import threading
+from collections import deque
+from flask import Blueprint, Response, current_app, jsonify, request
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Summary(_Metric):
+    """Count, sum and p50/p95/p99 over a sliding window of recent observations."""
+    type = 'summary'
+    quantiles = (0.5, 0.95, 0.99)
+
+    def __init__(self, name, help, labelnames=(), window=1024):
+        super().__init__(name, help, labelnames)
+        self.window = window
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [deque(maxlen=self.window), 0, 0.0]
+            state[0].append(value)
+            state[1] += 1
+            state[2] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(key, sorted(window), count, total) for key, (window, count, total) in self._values.items()]
+        for key, ordered, count, total in items:
+            labels = dict(zip(self.labelnames, key))
+            for q in self.quantiles:
+                value = ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)] if ordered else None
+                yield self.name, {**labels, 'quantile': str(q)}, value
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class MetricsRegistry:
+    """Process-local metrics rendered in the Prometheus text format.
+
+    Besides counters and gauges updated in place, callers can register
+    collectors: callables returning ``(name, type, help, samples)`` tuples,
+    where samples is a list of ``(labels, value)``. They are evaluated at
+    scrape time, which suits state that already lives elsewhere (pool
+    sizes, queue depths).
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help, labelnames):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames)
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def summary(self, name, help, labelnames=()):
+        return self._get_or_create(Summary, name, help, labelnames)
+
+    def register_collector(self, collector):
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                print(f"Metrics collector {collector!r} failed: {str(e)}")
+                continue
+            for name, type_, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {type_}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{k}="{v}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+metrics = MetricsRegistry()
+
+metrics_bp = Blueprint("metrics", __name__)
+
+@metrics_bp.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus scrape endpoint (per worker process)"""
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,248 @@
+import functools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from flask import Blueprint, g, has_request_context, jsonify, request, send_from_directory
+from flask_jwt_extended import get_jwt, jwt_required, verify_jwt_in_request
+from app.metrics import metrics
+
+profiles_captured = metrics.counter('profiles_captured_total', 'Request profiles written', ['endpoint', 'trigger'])
+
+
+class ProfileSession:
+    """Samples the stacks of the threads serving one request until stopped.
+
+    Samples are wall-clock: time spent waiting on the database or an upstream
+    shows up under the frame that is blocked, next to the CPU-bound frames.
+    """
+
+    def __init__(self, interval, thread_id):
+        self.interval = interval
+        self.thread_ids = {thread_id}
+        self.stacks = {}
+        self.samples = 0
+        self.started = time.perf_counter()
+        self.duration = None
+        self.meta = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_thread(self, thread_id):
+        self.thread_ids.add(thread_id)
+
+    def start(self, on_finish):
+        self._thread = threading.Thread(target=self._run, args=(on_finish,), name='request-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.duration = time.perf_counter() - self.started
+        self._stop.set()
+
+    def _run(self, on_finish):
+        while True:
+            self._sample()
+            if self._stop.wait(self.interval):
+                break
+        try:
+            on_finish(self)
+        except Exception as e:
+            print(f"Writing request profile failed: {str(e)}")
+
+    def _sample(self):
+        frames = sys._current_frames()
+        for thread_id in list(self.thread_ids):
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def folded(self):
+        """Stacks in the folded format read by flamegraph.pl, inferno and speedscope."""
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _short_path(filename):
+    if filename.startswith(_ROOT + os.sep):
+        return os.path.relpath(filename, _ROOT)
+    for marker in ('site-packages' + os.sep, 'lib' + os.sep):
+        index = filename.rfind(marker)
+        if index != -1:
+            return filename[index + len(marker):]
+    return filename
+
+
+class RequestProfiler:
+    """Opt-in sampling profiler for individual requests.
+
+    A request is profiled when an admin sends the ``X-Profile`` header, or at
+    random according to the per-endpoint rates in ``PROFILE_SAMPLE_RATES``.
+    Each profile is written to ``PROFILE_DIR`` as a ``.folded`` stack file with
+    a ``.json`` sidecar, and listed at ``/admin/profiles``. Requests that are
+    not profiled only pay for a header and a dict lookup.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PROFILING_ENABLED', True)
+        self.directory = app.config.get('PROFILE_DIR') or os.path.join(os.getcwd(), 'profiles')
+        self.interval = app.config.get('PROFILE_INTERVAL', 0.005)
+        self.header = app.config.get('PROFILE_HEADER', 'X-Profile')
+        self.sample_rates = app.config.get('PROFILE_SAMPLE_RATES', {})
+        self.max_files = app.config.get('PROFILE_MAX_FILES', 200)
+        app.extensions['profiler'] = self
+        if not self.enabled:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+        # Async views run on an event loop in another thread; sample that one too
+        original_async_to_sync = app.async_to_sync
+
+        def async_to_sync(func):
+            @functools.wraps(func)
+            async def register_loop_thread(*args, **kwargs):
+                session = g.get('_profile') if has_request_context() else None
+                if session is not None:
+                    session.add_thread(threading.get_ident())
+                return await func(*args, **kwargs)
+            return original_async_to_sync(register_loop_thread)
+
+        app.async_to_sync = async_to_sync
+
+    def _trigger(self):
+        if request.headers.get(self.header):
+            try:
+                verify_jwt_in_request(optional=True)
+                if get_jwt().get('is_admin', False):
+                    return 'header'
+            except Exception:
+                pass
+        rate = self.sample_rates.get(request.endpoint)
+        if rate and random.random() < rate:
+            return 'sampled'
+        return None
+
+    def _before_request(self):
+        trigger = self._trigger()
+        if trigger is None:
+            return
+        session = ProfileSession(self.interval, threading.get_ident())
+        session.meta = {
+            "id": f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}",
+            "trigger": trigger,
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "pid": os.getpid(),
+            "created_at": datetime.now(timezone.utc).isoformat()
+        }
+        g._profile = session
+        session.start(self._write)
+
+    def _after_request(self, response):
+        session = g.get('_profile')
+        if session is not None:
+            session.meta["status"] = response.status_code
+            response.headers['X-Profile-Id'] = session.meta["id"]
+        return response
+
+    def _teardown_request(self, exc):
+        session = g.pop('_profile', None)
+        if session is not None:
+            session.stop()
+
+    def _write(self, session):
+        os.makedirs(self.directory, exist_ok=True)
+        name = session.meta["id"]
+        with open(os.path.join(self.directory, f"{name}.folded"), 'w') as f:
+            f.write(session.folded())
+        meta = dict(session.meta, duration_ms=round(session.duration * 1000, 1), samples=session.samples,
+                    interval_ms=self.interval * 1000, file=f"{name}.folded")
+        with open(os.path.join(self.directory, f"{name}.json"), 'w') as f:
+            json.dump(meta, f)
+        profiles_captured.inc(endpoint=session.meta["endpoint"] or 'unmatched', trigger=session.meta["trigger"])
+        self._prune()
+
+    def _prune(self):
+        sidecars = sorted(name for name in os.listdir(self.directory) if name.endswith('.json'))
+        for name in sidecars[:max(0, len(sidecars) - self.max_files)]:
+            for path in (name, name[:-5] + '.folded'):
+                try:
+                    os.remove(os.path.join(self.directory, path))
+                except OSError:
+                    pass
+
+    def list_profiles(self, endpoint=None, limit=100):
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in sorted(os.listdir(self.directory), reverse=True):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if endpoint and meta.get('endpoint') != endpoint:
+                continue
+            profiles.append(meta)
+            if len(profiles) >= limit:
+                break
+        return profiles
+
+
+profiler = RequestProfiler()
+
+profiler_bp = Blueprint("profiler", __name__)
+
+_PROFILE_ID = re.compile(r'^[0-9T]+-[0-9a-f]{8}$')
+
+def _require_admin():
+    if not get_jwt().get("is_admin", False):
+        return jsonify({"error": "Admin privileges required."}), 403
+    return None
+
+@profiler_bp.route("/admin/profiles", methods=["GET"])
+@jwt_required()
+def list_profiles():
+    """List captured request profiles, newest first"""
+    denied = _require_admin()
+    if denied:
+        return denied
+    limit = request.args.get('limit', 100, type=int)
+    profiles = profiler.list_profiles(request.args.get('endpoint'), limit)
+    for meta in profiles:
+        meta["download_url"] = f"/admin/profiles/{meta['id']}"
+    return jsonify({"profiles": profiles})
+
+@profiler_bp.route("/admin/profiles/<profile_id>", methods=["GET"])
+@jwt_required()
+def download_profile(profile_id):
+    """Download one profile as a folded stack file (flamegraph.pl / speedscope input)"""
+    denied = _require_admin()
+    if denied:
+        return denied
+    if not _PROFILE_ID.match(profile_id):
+        return jsonify({"error": "Profile not found"}), 404
+    return send_from_directory(profiler.directory, f"{profile_id}.folded", mimetype='text/plain', as_attachment=True)
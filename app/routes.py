@@ -1,20 +1,29 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 from werkzeug.utils import secure_filename
+import asyncio
 import os
-from app.services.claude_service import ClaudeService
-from app.services.weather_service import WeatherService
-claude_service = ClaudeService()
-weather_service = WeatherService()
+from app.services.async_claude_service import AsyncClaudeService
+from app.services.async_weather_service import AsyncWeatherService
+from app.services import crop_shortlist, forecast_store, soil_vocabulary
+from app.services.soil_classifier import soil_classifier, decisions as soil_classifier_decisions
+from app.services.photo_derivatives import photo_derivatives
 from app.services.auth_service import login_user, register_user, refresh_access_token, logout_token, is_token_revoked
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from models.soil_type_reference import SoilTypeReference
 from app.extensions import db
+from app import uploads
+from app.write_behind import write_behind
+from app.timing import span
+from app import deadline
+from app.deadline import DeadlineExceeded
+from app.idempotency import idempotent
+from app.db_routing import read_only, replica_reads
 from models.soil_analyses import SoilAnalysis
 from models.weather_data import WeatherData
 from models.crop_predictions import CropPrediction
 from models.crop_recommendations import CropRecommendation
 from datetime import datetime, date
-import json
+import uuid
 
 main_bp = Blueprint("main", __name__)
 
@@ -24,7 +33,7 @@ def index():
 
 @main_bp.route("/claude/chat", methods=["POST"])
 @jwt_required()
-def claude_chat():
+async def claude_chat():
     data = request.get_json()
     
     if not data or 'message' not in data:
@@ -34,7 +43,8 @@ def claude_chat():
     model = data.get('model', 'claude-3-5-sonnet-20241022')
     max_tokens = data.get('max_tokens', 1000)
     
-    result = claude_service.chat(message, model, max_tokens)
+    async with AsyncClaudeService() as claude:
+        result = await claude.chat(message, model, max_tokens)
     
     if result['success']:
         return jsonify({
@@ -42,13 +52,14 @@ def claude_chat():
             "usage": result['usage']
         })
     else:
-        return jsonify({"error": result['error']}), 500
+        return _upstream_error(result['error'])
 
 @main_bp.route("/location/detect", methods=["GET"])
-def detect_location():
+async def detect_location():
     """Endpoint to test location detection"""
-    user_ip = weather_service.get_client_ip(request)
-    location_data = weather_service.get_user_location(user_ip)
+    async with AsyncWeatherService() as weather:
+        user_ip = weather.get_client_ip(request)
+        location_data = await weather.get_user_location(user_ip)
     
     return jsonify({
         "detected_ip": user_ip,
@@ -57,75 +68,117 @@ def detect_location():
 
 @main_bp.route("/soil/analyze", methods=["POST"])
 @jwt_required()
-def analyze_soil():
-    """Analyze soil image and return characteristics only (no DB save)"""
-    user_id = get_jwt_identity()
+async def analyze_soil():
+    """Analyze soil image(s) and return characteristics only (no DB save).
+
+    Several ``image`` files are photos of the same plot: they are analyzed
+    together in one vision call and get one classification plus a note each.
+    """
+    user_id = current_user_id()
     if not user_id:
         return jsonify({"error": "User authentication required."}), 401
-    if 'image' not in request.files:
+    files = request.files.getlist('image')
+    if not files:
         return jsonify({"error": "No image file provided"}), 400
-    file = request.files['image']
-    if file.filename == '':
+    if any(file.filename == '' for file in files):
         return jsonify({"error": "No image file selected"}), 400
+    max_images = current_app.config.get('SOIL_MAX_IMAGES', 5)
+    if len(files) > max_images:
+        return jsonify({"error": f"At most {max_images} images can be analyzed together"}), 400
     allowed_extensions = {'png', 'jpg', 'jpeg', 'webp'}
-    if not ('.' in file.filename and file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
-        return jsonify({"error": "Invalid file type. Allowed: PNG, JPG, JPEG, WEBP"}), 400
+    for file in files:
+        if not ('.' in file.filename and file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
+            return jsonify({"error": "Invalid file type. Allowed: PNG, JPG, JPEG, WEBP"}), 400
+    data = request.form.to_dict()
+    # No model means the SOIL_MODEL_TIERS policy
+    model = data.get('model')
     try:
-        upload_dir = os.path.join(os.getcwd(), 'uploads')
-        os.makedirs(upload_dir, exist_ok=True)
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(upload_dir, filename)
-        file.save(filepath)
-        data = request.form.to_dict()
-        model = data.get('model', 'claude-3-5-sonnet-20241022') 
-        max_tokens = int(data.get('max_tokens', 800))
-        result = claude_service.analyze_soil_image(filepath, model, max_tokens)
-        # Do NOT delete the file here; keep it for SoilPhoto
+        max_tokens = int(data.get('max_tokens', 800 + 200 * (len(files) - 1)))
+    except (TypeError, ValueError):
+        max_tokens = 0
+    if max_tokens <= 0:
+        return jsonify({"error": "max_tokens must be a positive integer"}), 400
+    saved = []
+    try:
+        for file in files:
+            saved.append(uploads.save(file))
+        filenames = [filename for filename, _ in saved]
+        filepaths = [uploads.path(filename) for filename in filenames]
+        # A confident local match skips the vision model entirely
+        local = _preclassify_soil(filepaths)
+        if soil_classifier.accept(local):
+            classified_by = 'local'
+            result = {
+                "success": True,
+                "soil_analysis": local['soil_analysis'],
+                "fields": soil_vocabulary.fields(local['soil_analysis']),
+                "usage": {"input_tokens": 0, "output_tokens": 0}
+            }
+        else:
+            classified_by = 'claude'
+            async with AsyncClaudeService() as claude:
+                result = await claude.analyze_soil_images(filepaths, model, max_tokens)
+        soil_classifier_decisions.inc(outcome=classified_by if local else 'unavailable')
+        # Do NOT delete the files here; keep them for SoilPhoto
         if not result['success']:
-            return jsonify({"error": result['error']}), 500
-        import re
-        allowed_soils = [
-            "Alluvial Soil", "Andosol Soil", "Regosol Soil", "Latosol Soil", "Podzolic Soil", "Grumosol Soil",
-            "Organosol Soil", "Lithosol Soil", "Mediterranean Soil", "Rendzina Soil", "Laterite Soil", "Gleysol Soil"
-        ]
-        def extract_field(field, text):
-            m = re.search(rf"{field}:\s*(.*)", text)
-            return m.group(1).strip() if m else None
-        detected_soil_type = extract_field("SOIL_TYPE", result['soil_analysis'])
+            return _upstream_error(result['error'])
+        fields = result['fields']
+        detected_soil_type = fields.get("SOIL_TYPE")
         if not detected_soil_type:
             return jsonify({"error": "Could not extract soil type from analysis."}), 400
-        matched_soil_type = None
-        for allowed in allowed_soils:
-            if detected_soil_type.lower() == allowed.lower():
-                matched_soil_type = allowed
-                break
+        matched_soil_type = soil_vocabulary.soil_type(detected_soil_type)
         if not matched_soil_type:
-            return jsonify({"error": f"Detected soil type '{detected_soil_type}' is not supported.", "supported_soil_types": allowed_soils}), 400
-        soil_type_ref = SoilTypeReference.query.filter_by(soil_type_name=matched_soil_type).first()
+            return jsonify({"error": f"Detected soil type '{detected_soil_type}' is not supported.", "supported_soil_types": soil_vocabulary.SOIL_TYPES}), 400
+        with replica_reads():
+            soil_type_ref = SoilTypeReference.query.filter_by(soil_type_name=matched_soil_type).first()
         soil_type_ref_dict = soil_type_ref.to_dict() if soil_type_ref else None
         # Parse other fields
-        soil_color = extract_field("SOIL_COLOR", result['soil_analysis'])
-        soil_texture = extract_field("SOIL_TEXTURE", result['soil_analysis'])
-        soil_drainage = extract_field("SOIL_DRAINAGE", result['soil_analysis'])
-        soil_location_type = extract_field("SOIL_LOCATION_TYPE", result['soil_analysis'])
-        soil_fertility = extract_field("SOIL_FERTILITY", result['soil_analysis'])
-        soil_moisture = extract_field("SOIL_MOISTURE", result['soil_analysis'])
-        classification_confidence = extract_field("CONFIDENCE", result['soil_analysis'])
-        classification_method = extract_field("CLASSIFICATION_METHOD", result['soil_analysis'])
-        # --- Create SoilPhoto object and keep the image ---
+        soil_color = fields.get("SOIL_COLOR")
+        soil_texture = fields.get("SOIL_TEXTURE")
+        soil_drainage = fields.get("SOIL_DRAINAGE")
+        soil_location_type = fields.get("SOIL_LOCATION_TYPE")
+        soil_fertility = fields.get("SOIL_FERTILITY")
+        soil_moisture = fields.get("SOIL_MOISTURE")
+        classification_confidence = fields.get("CONFIDENCE")
+        classification_method = fields.get("CLASSIFICATION_METHOD") or result.get('model')
+        # --- Create a SoilPhoto per image and keep the images ---
         from models.soil_photos import SoilPhoto
         from app.extensions import db
-        soil_photo = SoilPhoto(
-            soil_analysis_id=None,  # Not linked to a SoilAnalysis yet
-            photo_url=f"/uploads/{filename}",  # Store the web-accessible path
-            photo_filename=filename,
-            analysis_result=result['soil_analysis']
-        )
-        db.session.add(soil_photo)
-        db.session.commit()
+        soil_photos = [
+            SoilPhoto(
+                soil_analysis_id=None,  # Not linked to a SoilAnalysis yet
+                user_id=user_id,
+                photo_url=uploads.url(filename),  # Store the web-accessible path
+                photo_filename=filename,
+                analysis_result=result['soil_analysis']
+            )
+            for filename in filenames
+        ]
+        with span('db.soil_photo'):
+            db.session.add_all(soil_photos)
+            db.session.commit()
+        notes = result.get('images') or [{} for _ in filenames]
+        photos = []
+        for soil_photo, filepath, note in zip(soil_photos, filepaths, notes):
+            photo_derivatives.schedule(soil_photo)
+            if classified_by == 'claude' and note.get('usable') is not False:
+                soil_classifier.add(filepath, matched_soil_type, result['soil_analysis'])
+            photos.append({
+                "soil_photo_id": str(soil_photo.id),
+                "photo_url": soil_photo.photo_url,
+                "photo_filename": soil_photo.photo_filename,
+                **{key: value for key, value in note.items() if key != 'image'}
+            })
         return jsonify({
             "soil_analysis": result['soil_analysis'],
             "usage": result['usage'],
+            "model": result.get('model'),
+            "tiers": result.get('tiers', []),
+            "classifier": {
+                "classified_by": classified_by,
+                "local_soil_type": local['soil_type'] if local else None,
+                "local_confidence": local['confidence'] if local else None
+            },
             "detected_soil_type": matched_soil_type,
             "soil_type_reference": soil_type_ref_dict,
             "characteristics": {
@@ -139,20 +192,49 @@ def analyze_soil():
                 "classification_confidence": classification_confidence,
                 "classification_method": classification_method
             },
-            "soil_photo_id": str(soil_photo.id),
-            "photo_url": f"/uploads/{filename}",
-            "photo_filename": filename
+            # The first photo, as before multi-image analysis; "photos" has all of them
+            "soil_photo_id": photos[0]["soil_photo_id"],
+            "photo_url": photos[0]["photo_url"],
+            "photo_filename": photos[0]["photo_filename"],
+            "photos": photos
         })
     except Exception as e:
-        if 'filepath' in locals() and os.path.exists(filepath):
-            os.remove(filepath)
+        # A photo stored before under the same content hash belongs to another row
+        for filename, created in saved:
+            if created and os.path.exists(uploads.path(filename)):
+                os.remove(uploads.path(filename))
+        if isinstance(e, DeadlineExceeded):
+            raise
         return jsonify({"error": f"Processing error: {str(e)}"}), 500
 
+def _preclassify_soil(filepaths):
+    """soil_classifier result for the uploaded photos, or None if it cannot answer.
+
+    Photos of one plot only make a local match together: the least confident
+    photo's result is returned, with confidence 0 if the photos disagree.
+    """
+    results = []
+    try:
+        with span('soil_classifier'):
+            for filepath in filepaths:
+                result = soil_classifier.classify(filepath)
+                if result is None:
+                    return None
+                results.append(result)
+    except Exception as e:
+        print(f"Soil pre-classification failed: {str(e)}")
+        return None
+    weakest = min(results, key=lambda result: result['confidence'])
+    if len({result['soil_type'] for result in results}) > 1:
+        return dict(weakest, confidence=0.0)
+    return weakest
+
 @main_bp.route("/soil/submit", methods=["POST"])
 @jwt_required()
-def submit_soil_analysis():
+@idempotent
+async def submit_soil_analysis():
     """Save user-edited soil analysis to the database, retrieve weather data, and return crop recommendations"""
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     if not user_id:
         return jsonify({"error": "User authentication required."}), 401
 
@@ -174,17 +256,18 @@ def submit_soil_analysis():
     classification_method = data.get("classification_method")
 
     # Validate soil type
-    allowed_soils = [
-        "Alluvial Soil", "Andosol Soil", "Regosol Soil", "Latosol Soil", "Podzolic Soil", "Grumosol Soil",
-        "Organosol Soil", "Lithosol Soil", "Mediterranean Soil", "Rendzina Soil", "Laterite Soil", "Gleysol Soil"
-    ]
-    matched_soil_type = None
-    for allowed in allowed_soils:
-        if data["classified_soil_type"] and data["classified_soil_type"].lower() == allowed.lower():
-            matched_soil_type = allowed
-            break
+    matched_soil_type = soil_vocabulary.soil_type(data["classified_soil_type"])
     if not matched_soil_type:
-        return jsonify({"error": f"Soil type '{data['classified_soil_type']}' is not supported.", "supported_soil_types": allowed_soils}), 400
+        return jsonify({"error": f"Soil type '{data['classified_soil_type']}' is not supported.", "supported_soil_types": soil_vocabulary.SOIL_TYPES}), 400
+
+    mode, max_tokens, error = _crop_options(data)
+    if error:
+        return error
+
+    # The photos from /soil/analyze, by the soil_photo_id(s) it returned
+    soil_photos, error = _unlinked_soil_photos(data, user_id)
+    if error:
+        return error
 
     # Now it's safe to use matched_soil_type
     soil_analysis = (
@@ -208,35 +291,73 @@ def submit_soil_analysis():
             lon = float(lon)
         except (ValueError, TypeError):
             return jsonify({"error": "Invalid latitude or longitude format"}), 400
-    else:
-        user_ip = weather_service.get_client_ip(request)
-        location_data = weather_service.get_user_location(user_ip)
+
+    async with AsyncWeatherService() as weather, AsyncClaudeService() as claude:
+        return await _submit_soil_analysis(
+            weather, claude, data, user_id, lat, lon, matched_soil_type, soil_analysis,
+            classification_confidence, classification_method, mode, max_tokens, soil_photos
+        )
+
+async def _submit_location(weather, lat, lon):
+    """(lat, lon, None) as given, or detected from the client IP, or (None, None, error response)"""
+    if lat is None or lon is None:
+        user_ip = weather.get_client_ip(request)
+        location_data = await weather.get_user_location(user_ip)
         if location_data.get('success'):
             lat = location_data['lat']
             lon = location_data['lon']
         else:
-            return jsonify({
+            return None, None, (jsonify({
                 "error": "Cannot detect location automatically",
                 "details": {
                     "detected_ip": user_ip,
                     "ip_location_error": location_data.get('error', 'Unknown error'),
                     "suggestion": "Please provide coordinates manually in the request body"
                 }
-            }), 400
+            }), 400)
+    return lat, lon, None
 
-    # Validate soil type
-    allowed_soils = [
-        "Alluvial Soil", "Andosol Soil", "Regosol Soil", "Latosol Soil", "Podzolic Soil", "Grumosol Soil",
-        "Organosol Soil", "Lithosol Soil", "Mediterranean Soil", "Rendzina Soil", "Laterite Soil", "Gleysol Soil"
-    ]
-    matched_soil_type = None
-    for allowed in allowed_soils:
-        if data["classified_soil_type"] and data["classified_soil_type"].lower() == allowed.lower():
-            matched_soil_type = allowed
-            break
-    if not matched_soil_type:
-        return jsonify({"error": f"Soil type '{data['classified_soil_type']}' is not supported.", "supported_soil_types": allowed_soils}), 400
-    soil_type_ref = SoilTypeReference.query.filter_by(soil_type_name=matched_soil_type).first()
+def _unlinked_soil_photos(data, user_id):
+    """([SoilPhoto], None) for the photos of this user named in the request, or (None, error response).
+
+    A request names one photo with soil_photo_id or several (a multi-image
+    analysis) with soil_photo_ids; each must not be linked yet. Without
+    either (older clients) the user's most recent unlinked photo is used,
+    found through the partial index on unlinked photos.
+    """
+    from models.soil_photos import SoilPhoto
+    photo_ids = data.get("soil_photo_ids")
+    if photo_ids is None and data.get("soil_photo_id") is not None:
+        photo_ids = [data["soil_photo_id"]]
+    with span('db.photo_lookup'):
+        if photo_ids is None:
+            photo = SoilPhoto.query.filter_by(user_id=user_id, soil_analysis_id=None).order_by(
+                SoilPhoto.created_at.desc()).first()
+            return ([photo] if photo else []), None
+        if not isinstance(photo_ids, list) or not photo_ids:
+            return None, (jsonify({"error": "soil_photo_ids must be a non-empty list"}), 400)
+        try:
+            photo_ids = list(dict.fromkeys(uuid.UUID(str(photo_id)) for photo_id in photo_ids))
+        except ValueError:
+            return None, (jsonify({"error": "Invalid soil_photo_id"}), 400)
+        photos = [db.session.get(SoilPhoto, photo_id) for photo_id in photo_ids]
+    for photo in photos:
+        if photo is None or photo.user_id != user_id:
+            return None, (jsonify({"error": "Soil photo not found"}), 404)
+        if photo.soil_analysis_id is not None:
+            return None, (jsonify({"error": "Soil photo is already linked to a soil analysis",
+                                   "soil_photo_id": str(photo.id),
+                                   "soil_analysis_id": str(photo.soil_analysis_id)}), 409)
+    return photos, None
+
+async def _submit_soil_analysis(weather, claude, data, user_id, lat, lon, matched_soil_type, soil_analysis,
+                                classification_confidence, classification_method, mode, max_tokens, soil_photos=()):
+    lat, lon, error = await _submit_location(weather, lat, lon)
+    if error:
+        return error
+
+    with span('db.soil_type_lookup'), replica_reads():
+        soil_type_ref = SoilTypeReference.query.filter_by(soil_type_name=matched_soil_type).first()
     soil_type_ref_id = soil_type_ref.id if soil_type_ref else None
 
     # Step 1: Save soil analysis to DB
@@ -256,173 +377,119 @@ def submit_soil_analysis():
         longitude=lon,
         ip_address=request.remote_addr
     )
-    db.session.add(soil_analysis_obj)
-    db.session.commit()
-
-    # After committing soil_analysis_obj, link the most recent SoilPhoto for this user
-    from models.soil_photos import SoilPhoto
-    recent_photo = SoilPhoto.query.filter_by(soil_analysis_id=None).order_by(SoilPhoto.created_at.desc()).first()
-    if recent_photo:
-        recent_photo.soil_analysis_id = soil_analysis_obj.id
+    with span('db.soil_analysis'):
+        db.session.add(soil_analysis_obj)
         db.session.commit()
 
     # Step 2: Get weather data
-    weather_data = weather_service.get_weather_data(lat, lon)
+    weather_data = await weather.get_weather_data(lat, lon, _prompt_history_years())
     if not weather_data['success']:
-        return jsonify({"error": f"Weather data error: {weather_data['error']}"}), 500
+        return _weather_error(weather_data)
 
-    # Step 3: Save weather data to DB
+    # Step 3: Save weather data to DB (the degraded fallback points at the row it was read from)
     wd = weather_data['current']
-    season = claude_service._infer_indonesia_season(datetime.now().month)
-    weather_data_obj = WeatherData(
-        latitude=lat,
-        longitude=lon,
-        current_temperature=wd.get('temperature'),
-        current_humidity=wd.get('humidity'),
-        current_rainfall=wd.get('rain_1h', 0),
-        current_wind_speed=wd.get('wind_speed'),
-        current_pressure=wd.get('pressure'),
-        forecast_7days=weather_data.get('daily_forecast'),
-        season=season,
-        weather_warnings='; '.join([a['event'] for a in weather_data.get('alerts', [])]) if weather_data.get('alerts') else None,
-        data_source='OpenWeather',
-    )
-    db.session.add(weather_data_obj)
-    db.session.commit()
+    season = claude._infer_indonesia_season(datetime.now().month)
+    if weather_data.get('degraded'):
+        weather_data_obj = db.session.get(WeatherData, uuid.UUID(weather_data['weather_data_id']))
+    else:
+        weather_data_obj = None
+    if weather_data_obj is None:
+        with span('db.forecast_points'):
+            forecast_tile, forecast_issued = forecast_store.store(weather_data, lat, lon)
+        weather_data_obj = WeatherData(
+            latitude=lat,
+            longitude=lon,
+            current_temperature=wd.get('temperature'),
+            current_humidity=wd.get('humidity'),
+            current_rainfall=wd.get('rain_1h', 0),
+            current_wind_speed=wd.get('wind_speed'),
+            current_pressure=wd.get('pressure'),
+            forecast_tile_id=forecast_tile,
+            forecast_issued_at=forecast_issued,
+            season=season,
+            weather_warnings='; '.join([a['event'] for a in weather_data.get('alerts', [])]) if weather_data.get('alerts') else None,
+            data_source='OpenWeather',
+        )
+        with span('db.weather_data'):
+            db.session.add(weather_data_obj)
+            db.session.commit()
 
     # Step 3: Get crop recommendations
     model = data.get('model', 'claude-3-5-sonnet-20241022')
-    max_tokens = int(data.get('max_tokens', 1500))
-    crop_result = claude_service.get_crop_recommendations(
-        weather_data,
-        {"success": True, "soil_analysis": soil_analysis},
-        model,
-        max_tokens
+    crop_result = await _recommend_crops(
+        claude, weather_data, {"success": True, "soil_analysis": soil_analysis}, model, max_tokens, mode, soil_type_ref
     )
     if not crop_result['success']:
-        return jsonify({"error": crop_result['error']}), 500
+        return _upstream_error(crop_result['error'])
+    mode = crop_result.get('mode', mode)
+    write_behind.enqueue(SoilAnalysis, soil_analysis_obj.id, claude_api_calls=0 if mode == 'fast' else 1)
 
     # Step 4: Save crop prediction to DB
-    print("CropPrediction field types:", {
-        "soil_treatments": type(crop_result.get('soil_treatments')),
-        "risk_factors": type(crop_result.get('risk_factors')),
-    })
-    # If recommendations are structured, parse and save each
-    recs = crop_result.get('recommendations')
-    original_crop_result = crop_result.copy()
-    if isinstance(recs, str):
-        try:
-            recs_json = json.loads(recs)
-            if isinstance(recs_json, dict):
-                for k, v in recs_json.items():
-                    crop_result[k] = v
-                recs = recs_json.get('recommendations', [])
-            else:
-                recs = recs_json
-        except Exception as e:
-            recs = []
-    else:
-        recs = recs if recs is not None else []
-    # Restore any missing fields from the original crop_result
-    for key in ['soil_treatments', 'risk_factors']:
-        if key not in crop_result and key in original_crop_result:
-            crop_result[key] = original_crop_result[key]
-    print("Full parsed crop_result after update:", crop_result)
-
-    # --- NEW LOGIC: Extract from recommended_crops if missing ---
-    # Ensure recommended_crops is parsed
-    recommended_crops = crop_result.get('recommendations')
-    if isinstance(recommended_crops, str):
-        try:
-            recommended_crops_json = json.loads(recommended_crops)
-        except Exception:
-            recommended_crops_json = {}
-    else:
-        recommended_crops_json = recommended_crops if recommended_crops else {}
-
-    # Try to get soil_treatments and risk_factors from crop_result, fallback to recommended_crops_json
-    soil_treatments = crop_result.get('soil_treatments')
-    risk_factors = crop_result.get('risk_factors')
-    if soil_treatments is None and isinstance(recommended_crops_json, dict):
-        soil_treatments = recommended_crops_json.get('soil_treatments')
-    if risk_factors is None and isinstance(recommended_crops_json, dict):
-        risk_factors = recommended_crops_json.get('risk_factors')
-
+    plan = crop_result['structured']
     crop_prediction_obj = CropPrediction(
         soil_analysis_id=soil_analysis_obj.id,
         weather_data_id=weather_data_obj.id,
-        recommended_crops=recommended_crops_json,
-        seasonal_advice=crop_result.get('seasonal_advice'),
-        weather_warnings=crop_result.get('weather_warnings'),
-        soil_treatments=parse_json_field(soil_treatments),
-        risk_factors=parse_json_field(risk_factors),
-        success_probability=crop_result.get('success_probability'),
-        best_planting_date=parse_date(crop_result.get('best_planting_date')),
-        expected_harvest_date=parse_date(crop_result.get('expected_harvest_date')),
-        planting_window_start=parse_date(crop_result.get('planting_window_start')),
-        planting_window_end=parse_date(crop_result.get('planting_window_end'))
+        recommended_crops=plan,
+        seasonal_advice=plan.get('seasonal_advice'),
+        weather_warnings=plan.get('weather_warnings'),
+        soil_treatments=plan.get('soil_treatments'),
+        risk_factors=plan.get('risk_factors'),
+        success_probability=plan.get('success_probability'),
+        best_planting_date=parse_date(plan.get('best_planting_date')),
+        expected_harvest_date=parse_date(plan.get('expected_harvest_date')),
+        planting_window_start=parse_date(plan.get('planting_window_start')),
+        planting_window_end=parse_date(plan.get('planting_window_end'))
     )
-    db.session.add(crop_prediction_obj)
-    db.session.commit()
+    with span('db.crop_prediction'):
+        db.session.add(crop_prediction_obj)
+        if soil_photos:
+            # Link by primary key in the prediction's transaction, so a weather or
+            # Claude failure above leaves the photos free for the client's retry;
+            # the soil_analysis_id guard makes a concurrent submit of the same
+            # photo lose cleanly
+            from models.soil_photos import SoilPhoto
+            linked = SoilPhoto.query.filter(
+                SoilPhoto.id.in_([photo.id for photo in soil_photos]), SoilPhoto.soil_analysis_id.is_(None)
+            ).update({SoilPhoto.soil_analysis_id: soil_analysis_obj.id}, synchronize_session=False)
+            if linked != len(soil_photos):
+                db.session.rollback()
+                return jsonify({"error": "Soil photo is already linked to a soil analysis"}), 409
+        db.session.commit()
 
-    # Step 5: Save crop recommendations to DB (if Claude returns structured list)
+    # Step 5: Save crop recommendations to DB
     crop_recommendation_ids = []
-    # If recommendations are structured, parse and save each
-    recs = crop_result.get('recommendations')
-    original_crop_result = crop_result.copy()
-    if isinstance(recs, str):
-        try:
-            recs_json = json.loads(recs)
-            if isinstance(recs_json, dict):
-                for k, v in recs_json.items():
-                    crop_result[k] = v
-                recs = recs_json.get('recommendations', [])
-            else:
-                recs = recs_json
-        except Exception as e:
-            recs = []
-    else:
-        recs = recs if recs is not None else []
-    # Restore any missing fields from the original crop_result
-    for key in ['soil_treatments', 'risk_factors']:
-        if key not in crop_result and key in original_crop_result:
-            crop_result[key] = original_crop_result[key]
-    print("Full parsed crop_result after update:", crop_result)
-
-    if isinstance(recs, list):
-        for rec in recs:
-            crop_rec_obj = CropRecommendation(
-                crop_prediction_id=crop_prediction_obj.id,
-                crop_name=rec.get('crop_name'),
-                crop_category=rec.get('crop_category'),
-                suitability_score=rec.get('suitability_score'),
-                suitability_level=rec.get('suitability_level'),
-                planting_method=rec.get('planting_method'),
-                spacing_recommendation=rec.get('spacing_recommendation'),
-                seed_variety_suggestions=rec.get('seed_variety_suggestions'),
-                expected_yield_per_hectare=extract_numeric(rec.get('expected_yield_per_hectare')),
-                fertilizer_schedule=rec.get('fertilizer_schedule'),
-                watering_schedule=rec.get('watering_schedule'),
-                pest_control_measures=rec.get('pest_control_measures'),
-                harvesting_indicators=rec.get('harvesting_indicators'),
-                estimated_cost_per_hectare=extract_numeric(rec.get('estimated_cost_per_hectare')),
-                estimated_revenue_per_hectare=extract_numeric(rec.get('estimated_revenue_per_hectare')),
-                market_demand_level=rec.get('market_demand_level')
-            )
+    for rec in plan['recommendations']:
+        crop_rec_obj = CropRecommendation(
+            crop_prediction_id=crop_prediction_obj.id,
+            crop_name=rec.get('crop_name'),
+            crop_category=rec.get('crop_category'),
+            suitability_score=rec.get('suitability_score'),
+            suitability_level=rec.get('suitability_level'),
+            planting_method=rec.get('planting_method'),
+            spacing_recommendation=rec.get('spacing_recommendation'),
+            seed_variety_suggestions=rec.get('seed_variety_suggestions'),
+            expected_yield_per_hectare=rec.get('expected_yield_per_hectare'),
+            fertilizer_schedule=rec.get('fertilizer_schedule'),
+            watering_schedule=rec.get('watering_schedule'),
+            pest_control_measures=rec.get('pest_control_measures'),
+            harvesting_indicators=rec.get('harvesting_indicators'),
+            estimated_cost_per_hectare=rec.get('estimated_cost_per_hectare'),
+            estimated_revenue_per_hectare=rec.get('estimated_revenue_per_hectare'),
+            market_demand_level=rec.get('market_demand_level')
+        )
+        with span('db.crop_recommendation'):
             db.session.add(crop_rec_obj)
             db.session.commit()
-            crop_recommendation_ids.append(str(crop_rec_obj.id))
+        crop_recommendation_ids.append(str(crop_rec_obj.id))
 
-    # Get soil photo information
-    from models.soil_photos import SoilPhoto
-    soil_photo = SoilPhoto.query.filter_by(soil_analysis_id=soil_analysis_obj.id).first()
-    soil_photo_info = None
-    if soil_photo:
-        soil_photo_info = {
-            "id": str(soil_photo.id),
-            "filename": soil_photo.photo_filename,
-            "url": f"/uploads/{soil_photo.photo_filename}" if soil_photo.photo_filename else None
+    soil_photos_info = [
+        {
+            "id": str(photo.id),
+            "filename": photo.photo_filename,
+            "url": uploads.url(photo.photo_filename)
         }
+        for photo in soil_photos
+    ]
 
     return jsonify({
         "soil_analysis_record": {
@@ -435,11 +502,15 @@ def submit_soil_analysis():
         "crop_prediction_id": str(crop_prediction_obj.id),
         "crop_recommendation_ids": crop_recommendation_ids,
         "soil_analysis_summary": soil_analysis,
-        "soil_photo": soil_photo_info,
+        "soil_photo": soil_photos_info[0] if soil_photos_info else None,
+        "soil_photos": soil_photos_info,
         "recommendations": crop_result['recommendations'],
+        "structured": crop_result.get('structured'),
         "location": crop_result['location'],
         "weather_summary": crop_result['weather_summary'],
+        "weather_status": _weather_status(weather_data),
         "usage": crop_result['usage'],
+        "mode": mode,
         "coordinates_used": {
             "lat": lat,
             "lon": lon,
@@ -448,11 +519,20 @@ def submit_soil_analysis():
     })
 
 @main_bp.route("/crops/recommend", methods=["POST", "GET"])
-def get_crop_recommendations():
+@idempotent
+async def get_crop_recommendations():
+    async with AsyncWeatherService() as weather, AsyncClaudeService() as claude:
+        return await _get_crop_recommendations(weather, claude)
+
+async def _get_crop_recommendations(weather, claude):
     # Get data from request
     data = request.get_json() if request.method == "POST" else {}
     if not data:
         data = {}
+
+    mode, max_tokens, error = _crop_options(data)
+    if error:
+        return error
     
     lat = None
     lon = None
@@ -467,8 +547,8 @@ def get_crop_recommendations():
     
     # Priority 2: Try to get location from IP if no coordinates provided
     if lat is None or lon is None:
-        user_ip = weather_service.get_client_ip(request)
-        location_data = weather_service.get_user_location(user_ip)
+        user_ip = weather.get_client_ip(request)
+        location_data = await weather.get_user_location(user_ip)
         
         if location_data.get('success'):
             lat = location_data['lat']
@@ -493,10 +573,10 @@ def get_crop_recommendations():
             }), 400
     
     # Get weather data
-    weather_data = weather_service.get_weather_data(lat, lon)
+    weather_data = await weather.get_weather_data(lat, lon, _prompt_history_years())
     
     if not weather_data['success']:
-        return jsonify({"error": f"Weather data error: {weather_data['error']}"}), 500
+        return _weather_error(weather_data)
     
     # Check if soil analysis is provided
     soil_data = None
@@ -505,16 +585,17 @@ def get_crop_recommendations():
     
     # Get crop recommendations from Claude
     model = data.get('model', 'claude-3-5-sonnet-20241022')
-    max_tokens = data.get('max_tokens', 1500)
-    
-    result = claude_service.get_crop_recommendations(weather_data, soil_data, model, max_tokens)
+    result = await _recommend_crops(claude, weather_data, soil_data, model, max_tokens, mode)
     
     if result['success']:
         response_data = {
             "recommendations": result['recommendations'],
+            "structured": result.get('structured'),
             "location": result['location'],
             "weather_summary": result['weather_summary'],
+            "weather_status": _weather_status(weather_data),
             "usage": result['usage'],
+            "mode": result.get('mode', mode),
             "coordinates_used": {
                 "lat": lat,
                 "lon": lon,
@@ -527,10 +608,11 @@ def get_crop_recommendations():
             
         return jsonify(response_data)
     else:
-        return jsonify({"error": result['error']}), 500
+        return _upstream_error(result['error'])
 
 @main_bp.route("/crops/recommend-with-soil", methods=["POST"])
-def get_crop_recommendations_with_soil():
+@idempotent
+async def get_crop_recommendations_with_soil():
     """Complete workflow: analyze soil image + get crop recommendations"""
     if 'image' not in request.files:
         return jsonify({"error": "No soil image file provided"}), 400
@@ -543,10 +625,14 @@ def get_crop_recommendations_with_soil():
     allowed_extensions = {'png', 'jpg', 'jpeg', 'webp'}
     if not ('.' in file.filename and file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
         return jsonify({"error": "Invalid file type. Allowed: PNG, JPG, JPEG, WEBP"}), 400
+
+    mode, max_tokens, error = _crop_options(request.form)
+    if error:
+        return error
     
     try:
         # Create uploads directory if it doesn't exist
-        upload_dir = os.path.join(os.getcwd(), 'uploads')
+        upload_dir = uploads.folder()
         os.makedirs(upload_dir, exist_ok=True)
         
         # Save uploaded file
@@ -569,74 +655,84 @@ def get_crop_recommendations_with_soil():
                 os.remove(filepath)
                 return jsonify({"error": "Invalid latitude or longitude format"}), 400
         
-        # Try to get location from IP if no coordinates provided
-        if lat is None or lon is None:
-            user_ip = weather_service.get_client_ip(request)
-            location_data = weather_service.get_user_location(user_ip)
-            
-            if location_data.get('success'):
-                lat = location_data['lat']
-                lon = location_data['lon']
-            else:
-                os.remove(filepath)
-                return jsonify({
-                    "error": "Cannot detect location automatically",
-                    "details": {
-                        "detected_ip": user_ip,
-                        "ip_location_error": location_data.get('error', 'Unknown error'),
-                        "suggestion": "Please provide coordinates manually in form data"
-                    }
-                }), 400
-        
-        # Get optional parameters
-        model = form_data.get('model', 'claude-3-5-sonnet-20241022')
-        max_tokens = int(form_data.get('max_tokens', 1500))
-        
-        # Step 1: Analyze soil image
-        soil_result = claude_service.analyze_soil_image(filepath, model, 800)
-        
-        # Clean up uploaded file
-        os.remove(filepath)
-        
-        if not soil_result['success']:
-            return jsonify({"error": f"Soil analysis failed: {soil_result['error']}"}), 500
-        
-        # Step 2: Get weather data
-        weather_data = weather_service.get_weather_data(lat, lon)
-        
-        if not weather_data['success']:
-            return jsonify({"error": f"Weather data error: {weather_data['error']}"}), 500
-        
-        # Step 3: Get crop recommendations with soil data
-        crop_result = claude_service.get_crop_recommendations(weather_data, soil_result, model, max_tokens)
-        
-        if crop_result['success']:
-            return jsonify({
-                "recommendations": crop_result['recommendations'],
-                "location": crop_result['location'],
-                "weather_summary": crop_result['weather_summary'],
-                "soil_analysis": crop_result['soil_analysis'],
-                "usage": {
-                    "soil_analysis_tokens": soil_result['usage'],
-                    "recommendations_tokens": crop_result['usage']
-                },
-                "coordinates_used": {
-                    "lat": lat,
-                    "lon": lon,
-                    "source": "manual" if ('lat' in form_data and 'lon' in form_data) else "ip_detection"
-                }
-            })
-        else:
-            return jsonify({"error": crop_result['error']}), 500
+        async with AsyncWeatherService() as weather, AsyncClaudeService() as claude:
+            return await _recommend_with_soil_upload(weather, claude, filepath, form_data, lat, lon, mode, max_tokens)
             
     except Exception as e:
         # Clean up file if it exists
         if 'filepath' in locals() and os.path.exists(filepath):
             os.remove(filepath)
+        if isinstance(e, DeadlineExceeded):
+            raise
         return jsonify({"error": f"Processing error: {str(e)}"}), 500
 
+async def _recommend_with_soil_upload(weather, claude, filepath, form_data, lat, lon, mode, max_tokens):
+    """Steps after the upload is saved; errors propagate to the caller's cleanup"""
+    # Try to get location from IP if no coordinates provided
+    if lat is None or lon is None:
+        user_ip = weather.get_client_ip(request)
+        location_data = await weather.get_user_location(user_ip)
+
+        if location_data.get('success'):
+            lat = location_data['lat']
+            lon = location_data['lon']
+        else:
+            os.remove(filepath)
+            return jsonify({
+                "error": "Cannot detect location automatically",
+                "details": {
+                    "detected_ip": user_ip,
+                    "ip_location_error": location_data.get('error', 'Unknown error'),
+                    "suggestion": "Please provide coordinates manually in form data"
+                }
+            }), 400
+
+    # Get optional parameters
+    model = form_data.get('model', 'claude-3-5-sonnet-20241022')
+
+    # Steps 1 and 2: Analyze soil image and get weather data concurrently
+    soil_result, weather_data = await asyncio.gather(
+        claude.analyze_soil_image(filepath, form_data.get('model'), 800),
+        weather.get_weather_data(lat, lon, _prompt_history_years())
+    )
+
+    # Clean up uploaded file
+    os.remove(filepath)
+
+    if not soil_result['success']:
+        return _upstream_error(f"Soil analysis failed: {soil_result['error']}")
+
+    if not weather_data['success']:
+        return _weather_error(weather_data)
+
+    # Step 3: Get crop recommendations with soil data
+    crop_result = await _recommend_crops(claude, weather_data, soil_result, model, max_tokens, mode)
+
+    if crop_result['success']:
+        return jsonify({
+            "recommendations": crop_result['recommendations'],
+            "structured": crop_result.get('structured'),
+            "location": crop_result['location'],
+            "weather_summary": crop_result['weather_summary'],
+            "weather_status": _weather_status(weather_data),
+            "soil_analysis": crop_result['soil_analysis'],
+            "usage": {
+                "soil_analysis_tokens": soil_result['usage'],
+                "recommendations_tokens": crop_result['usage']
+            },
+            "mode": crop_result.get('mode', mode),
+            "coordinates_used": {
+                "lat": lat,
+                "lon": lon,
+                "source": "manual" if ('lat' in form_data and 'lon' in form_data) else "ip_detection"
+            }
+        })
+    else:
+        return _upstream_error(crop_result['error'])
+
 @main_bp.route("/crops/recommend-with-soil-file", methods=["POST"])
-def get_crop_recommendations_with_soil_file():
+@idempotent
+async def get_crop_recommendations_with_soil_file():
     """
     Use a soil image already stored on the server (in the image/ directory) for crop recommendation.
     Expects JSON: { "filename": "sawah-kering-di-manggeng-raya.jpg", "lat": ..., "lon": ... }
@@ -650,13 +746,21 @@ def get_crop_recommendations_with_soil_file():
     if not os.path.exists(image_path):
         return jsonify({"error": f"File not found: {filename}"}), 404
 
+    mode, max_tokens, error = _crop_options(data)
+    if error:
+        return error
+
+    async with AsyncWeatherService() as weather, AsyncClaudeService() as claude:
+        return await _recommend_with_soil_file(weather, claude, data, image_path, mode, max_tokens)
+
+async def _recommend_with_soil_file(weather, claude, data, image_path, mode, max_tokens):
     # Get coordinates
     lat = data.get("lat")
     lon = data.get("lon")
     if lat is None or lon is None:
         # Try to get from IP (reuse your existing logic)
-        user_ip = weather_service.get_client_ip(request)
-        location_data = weather_service.get_user_location(user_ip)
+        user_ip = weather.get_client_ip(request)
+        location_data = await weather.get_user_location(user_ip)
         if location_data.get('success'):
             lat = location_data['lat']
             lon = location_data['lon']
@@ -665,30 +769,33 @@ def get_crop_recommendations_with_soil_file():
 
     # Get optional parameters
     model = data.get('model', 'claude-3-5-sonnet-20241022')
-    max_tokens = int(data.get('max_tokens', 1500))
 
-    # Step 1: Analyze soil image
-    soil_result = claude_service.analyze_soil_image(image_path, model, 800)
+    # Steps 1 and 2: Analyze soil image and get weather data concurrently
+    soil_result, weather_data = await asyncio.gather(
+        claude.analyze_soil_image(image_path, data.get('model'), 800),
+        weather.get_weather_data(lat, lon, _prompt_history_years())
+    )
     if not soil_result['success']:
-        return jsonify({"error": f"Soil analysis failed: {soil_result['error']}"}), 500
+        return _upstream_error(f"Soil analysis failed: {soil_result['error']}")
 
-    # Step 2: Get weather data
-    weather_data = weather_service.get_weather_data(lat, lon)
     if not weather_data['success']:
-        return jsonify({"error": f"Weather data error: {weather_data['error']}"}), 500
+        return _weather_error(weather_data)
 
     # Step 3: Get crop recommendations with soil data
-    crop_result = claude_service.get_crop_recommendations(weather_data, soil_result, model, max_tokens)
+    crop_result = await _recommend_crops(claude, weather_data, soil_result, model, max_tokens, mode)
     if crop_result['success']:
         return jsonify({
             "recommendations": crop_result['recommendations'],
+            "structured": crop_result.get('structured'),
             "location": crop_result['location'],
             "weather_summary": crop_result['weather_summary'],
+            "weather_status": _weather_status(weather_data),
             "soil_analysis": crop_result['soil_analysis'],
             "usage": {
                 "soil_analysis_tokens": soil_result['usage'],
                 "recommendations_tokens": crop_result['usage']
             },
+            "mode": crop_result.get('mode', mode),
             "coordinates_used": {
                 "lat": lat,
                 "lon": lon,
@@ -696,7 +803,7 @@ def get_crop_recommendations_with_soil_file():
             }
         })
     else:
-        return jsonify({"error": crop_result['error']}), 500
+        return _upstream_error(crop_result['error'])
     
 @main_bp.route('/authentication/login', methods=['POST'])
 def login_user_route():
@@ -774,7 +881,7 @@ def add_soil_type_reference():
         return jsonify({"error": str(e)}), 500
 
 @main_bp.route("/weather/current", methods=["POST", "GET"])
-def get_current_weather():
+async def get_current_weather():
     if request.method == "POST":
         data = request.get_json() or {}
     else:
@@ -788,29 +895,48 @@ def get_current_weather():
         lon = float(lon)
     except (ValueError, TypeError):
         return jsonify({"error": "Invalid latitude or longitude format."}), 400
-    weather_data = weather_service.get_weather_data(lat, lon)
+    async with AsyncWeatherService() as weather:
+        weather_data = await weather.get_weather_data(lat, lon)
     if not weather_data.get('success'):
-        return jsonify({"error": weather_data.get('error', 'Weather data unavailable')}), 500
+        return _weather_error(weather_data, prefix="")
     from datetime import datetime
     now = datetime.now().isoformat()
     return jsonify({
         "location": weather_data.get('location'),
         "current_weather": weather_data.get('current'),
+        "weather_status": _weather_status(weather_data),
         "current_date": now
     })
 
 @main_bp.route("/user/soil-analyses", methods=["GET"])
 @jwt_required()
+@read_only
 def get_user_soil_analyses():
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     from models.soil_analyses import SoilAnalysis
+    from models.soil_photos import SoilPhoto
     analyses = SoilAnalysis.query.filter_by(user_id=user_id).all()
-    return jsonify([a.to_dict() for a in analyses])
+    photos = {}
+    if analyses:
+        for photo in SoilPhoto.query.filter(SoilPhoto.soil_analysis_id.in_([a.id for a in analyses])):
+            photos.setdefault(photo.soil_analysis_id, photo)
+    return jsonify([
+        dict(a.to_dict(), soil_photo=_photo_dict(photos[a.id]) if a.id in photos else None) for a in analyses
+    ])
+
+def _photo_dict(photo):
+    """SoilPhoto as returned by the history endpoints, with its derivative URLs"""
+    return {
+        "photo_url": photo.photo_url,
+        "photo_filename": photo.photo_filename,
+        **photo_derivatives.urls(photo)
+    }
 
 @main_bp.route("/user/crop-predictions", methods=["GET"])
 @jwt_required()
+@read_only
 def get_user_crop_predictions():
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     from models.crop_predictions import CropPrediction
     from models.soil_analyses import SoilAnalysis
     predictions = CropPrediction.query.join(SoilAnalysis).filter(SoilAnalysis.user_id == user_id).all()
@@ -818,8 +944,9 @@ def get_user_crop_predictions():
 
 @main_bp.route("/user/crop-recommendations", methods=["GET"])
 @jwt_required()
+@read_only
 def get_user_crop_recommendations():
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     from models.crop_recommendations import CropRecommendation
     from models.crop_predictions import CropPrediction
     from models.soil_analyses import SoilAnalysis
@@ -833,7 +960,7 @@ def get_user_crop_recommendations():
         if soil_analysis:
             photo_obj = SoilPhoto.query.filter_by(soil_analysis_id=soil_analysis.id).first()
             if photo_obj:
-                soil_photo = {"photo_url": photo_obj.photo_url, "photo_filename": photo_obj.photo_filename}
+                soil_photo = _photo_dict(photo_obj)
         # Try to get weather_summary and soil_analysis_summary from prediction if available
         weather_summary = None
         soil_analysis_summary = None
@@ -852,10 +979,11 @@ def get_user_crop_recommendations():
         })
     return jsonify(enriched)
 
-@main_bp.route("/user/crop-recommendations/<rec_id>", methods=["GET"])
+@main_bp.route("/user/crop-recommendations/<uuid:rec_id>", methods=["GET"])
 @jwt_required()
+@read_only
 def get_user_crop_recommendation_detail(rec_id):
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     from models.crop_recommendations import CropRecommendation
     from models.crop_predictions import CropPrediction
     from models.soil_analyses import SoilAnalysis
@@ -869,7 +997,7 @@ def get_user_crop_recommendation_detail(rec_id):
     if soil_analysis:
         photo_obj = SoilPhoto.query.filter_by(soil_analysis_id=soil_analysis.id).first()
         if photo_obj:
-            soil_photo = {"photo_url": photo_obj.photo_url, "photo_filename": photo_obj.photo_filename}
+            soil_photo = _photo_dict(photo_obj)
     weather_summary = None
     soil_analysis_summary = None
     if prediction:
@@ -888,23 +1016,149 @@ def get_user_crop_recommendation_detail(rec_id):
 
 @main_bp.route("/user/weather-data", methods=["GET"])
 @jwt_required()
+@read_only
 def get_user_weather_data():
-    user_id = get_jwt_identity()
+    user_id = current_user_id()
     from models.weather_data import WeatherData
     from models.soil_analyses import SoilAnalysis
     # Join with SoilAnalysis to filter by user_id (assuming lat/lon match)
     weather = WeatherData.query.join(SoilAnalysis, (WeatherData.latitude == SoilAnalysis.latitude) & (WeatherData.longitude == SoilAnalysis.longitude)).filter(SoilAnalysis.user_id == user_id).all()
-    return jsonify([w.to_dict() for w in weather])
+    forecasts = forecast_store.daily_forecasts((w.forecast_tile_id, w.forecast_issued_at) for w in weather)
+    return jsonify([w.to_dict(forecasts.get((w.forecast_tile_id, w.forecast_issued_at))) for w in weather])
 
-def extract_numeric(value):
-    if isinstance(value, (int, float)):
-        return value
-    if isinstance(value, str):
-        import re
-        match = re.search(r'\d+(\.\d+)?', value.replace(',', ''))
-        if match:
-            return float(match.group())
-    return None
+@main_bp.route("/user/forecast/rain", methods=["GET"])
+@jwt_required()
+@read_only
+def get_user_rain_outlook():
+    """Forecast rain over the next ``days`` days (default 7, max 8) for each of the user's plots"""
+    user_id = current_user_id()
+    days = min(max(request.args.get('days', 7, type=int), 1), 8)
+    plots = db.session.query(SoilAnalysis.latitude, SoilAnalysis.longitude).filter(
+        SoilAnalysis.user_id == user_id,
+        SoilAnalysis.latitude.isnot(None),
+        SoilAnalysis.longitude.isnot(None)
+    ).distinct().all()
+    plot_tiles = [(lat, lon, forecast_store.tile_id(lat, lon)) for lat, lon in plots]
+    outlook = forecast_store.rain_outlook([tile for _, _, tile in plot_tiles], days=days)
+    return jsonify({
+        "days": days,
+        "plots": [
+            {"latitude": float(lat), "longitude": float(lon), "tile_id": tile, "forecast": outlook.get(tile)}
+            for lat, lon, tile in plot_tiles
+        ]
+    })
+
+@main_bp.route("/user/forecast/features", methods=["GET"])
+@jwt_required()
+@read_only
+def get_user_forecast_features():
+    """Agro-climate indicators (GDD, rain, dry spell, heat stress, ET0) for each of the user's plots"""
+    from app.services import agro_features
+    user_id = current_user_id()
+    plots = db.session.query(SoilAnalysis.latitude, SoilAnalysis.longitude).filter(
+        SoilAnalysis.user_id == user_id,
+        SoilAnalysis.latitude.isnot(None),
+        SoilAnalysis.longitude.isnot(None)
+    ).distinct().all()
+    plot_tiles = [(lat, lon, forecast_store.tile_id(lat, lon)) for lat, lon in plots]
+    features = agro_features.tile_features([tile for _, _, tile in plot_tiles])
+    return jsonify({
+        "plots": [
+            {"latitude": float(lat), "longitude": float(lon), "tile_id": tile, "features": features.get(tile)}
+            for lat, lon, tile in plot_tiles
+        ]
+    })
+
+CROP_MODES = ('fast', 'shortlist', 'open')
+
+def _crop_mode(data):
+    """Recommendation mode from the body/form or query string, None when unknown"""
+    mode = data.get('mode') or request.args.get('mode') or current_app.config.get('CROP_RECOMMEND_MODE', 'shortlist')
+    if not isinstance(mode, str):
+        return None
+    mode = mode.lower()
+    return mode if mode in CROP_MODES else None
+
+def _crop_options(data):
+    """(mode, max_tokens, None) from the request, or (None, None, error response).
+
+    Views check these before any DB write or upstream call.
+    """
+    mode = _crop_mode(data)
+    if mode is None:
+        return None, None, (jsonify({"error": "Invalid mode", "supported_modes": list(CROP_MODES)}), 400)
+    try:
+        max_tokens = int(data.get('max_tokens', 1500))
+    except (TypeError, ValueError):
+        max_tokens = 0
+    if max_tokens <= 0:
+        return None, None, (jsonify({"error": "max_tokens must be a positive integer"}), 400)
+    return mode, max_tokens, None
+
+def _soil_reference(soil_text):
+    soil_type = crop_shortlist.parse_soil_fields(soil_text).get('type')
+    if not soil_type:
+        return None
+    with span('db.soil_type_lookup'), replica_reads():
+        return SoilTypeReference.query.filter(db.func.lower(SoilTypeReference.soil_type_name) == soil_type).first()
+
+async def _recommend_crops(claude, weather_data, soil_data, model, max_tokens, mode, soil_reference=None):
+    """Crop recommendations by mode.
+
+    'fast' returns the local ranking without calling Claude, 'shortlist' asks
+    Claude to elaborate on the top CROP_SHORTLIST_SIZE local picks and 'open'
+    lets Claude choose freely. 'shortlist' answers as 'fast' when less than
+    DEADLINE_SHORTLIST_MIN_SECONDS of the request deadline is left.
+    """
+    if mode == 'open':
+        return await claude.get_crop_recommendations(weather_data, soil_data, model, max_tokens)
+    from app.services import agro_features
+    soil_text = soil_data['soil_analysis'] if soil_data and soil_data.get('success') else None
+    if soil_reference is None and soil_text:
+        soil_reference = _soil_reference(soil_text)
+    with span('crop_shortlist'):
+        weather_data['agro_features'] = agro_features.from_weather(weather_data)
+        season = claude._infer_indonesia_season(datetime.now().month)
+        shortlist = crop_shortlist.rank(soil_text, weather_data['agro_features'], season, soil_reference,
+                                        limit=current_app.config.get('CROP_SHORTLIST_SIZE', 3))
+    if mode == 'fast' or not deadline.allows(current_app.config.get('DEADLINE_SHORTLIST_MIN_SECONDS', 8), 'claude.crop'):
+        return crop_shortlist.fast_result(weather_data, shortlist, soil_data)
+    return await claude.get_crop_recommendations(weather_data, soil_data, model, max_tokens, shortlist=shortlist)
+
+def _upstream_error(message):
+    """500 for a failed upstream stage, 504 when it failed because the request deadline ran out"""
+    if deadline.expired():
+        return jsonify({"error": message, "deadline_exceeded": True}), 504
+    return jsonify({"error": message}), 500
+
+def _weather_error(weather_data, prefix="Weather data error: "):
+    """Error response for a failed get_weather_data(): 503 with Retry-After while its circuit is open"""
+    message = f"{prefix}{weather_data.get('error', 'Weather data unavailable')}"
+    if not weather_data.get('retry_after'):
+        return _upstream_error(message)
+    response = jsonify({"error": message})
+    response.headers['Retry-After'] = str(weather_data['retry_after'])
+    return response, 503
+
+def _weather_status(weather_data):
+    """Whether a response is built on live weather or on the last known values (see weather_fallback)"""
+    if not weather_data.get('degraded'):
+        return {"degraded": False}
+    return {
+        "degraded": True,
+        "reason": weather_data.get('degraded_reason'),
+        "as_of": weather_data.get('weather_as_of'),
+        "age_seconds": weather_data.get('weather_age_seconds')
+    }
+
+def _prompt_history_years():
+    """Years of same-day history to fetch with the weather for the crop prompt (0 = none)"""
+    return current_app.config.get('CROP_PROMPT_HISTORY_YEARS', 0)
+
+def current_user_id():
+    """JWT identity as a UUID, matching the UUID(as_uuid=True) columns"""
+    identity = get_jwt_identity()
+    return uuid.UUID(identity) if identity else None
 
 def parse_date(value):
     if not value:
@@ -915,16 +1169,3 @@ def parse_date(value):
         return datetime.strptime(value, "%Y-%m-%d").date()
     except Exception:
         return None
-
-def parse_json_field(value):
-    if isinstance(value, (list, dict)):
-        return value
-    if isinstance(value, str):
-        try:
-            import json
-            return json.loads(value)
-        except Exception:
-            # Wrap string in a list for JSON columns
-            return [value]
-    return value
-
@@ -0,0 +1,204 @@
+"""Vectorized agro-climate indicators over forecast and history series.
+
+Service dicts are converted to columnar NumPy arrays once (``daily_columns``,
+``hourly_columns``, ``history_columns``). Several tiles are stacked into
+``(tiles, time)`` arrays padded with NaN (``stack``), and every indicator
+reduces over the last axis, so one call covers one tile or thousands.
+"""
+import numpy as np
+
+# Growing degree days, FAO/USDA "method 2" with a base and an upper cap
+GDD_BASE_C = 10.0
+GDD_CAP_C = 30.0
+# A day with less rain than this counts as dry
+DRY_DAY_MM = 1.0
+# Rice and maize spikelet sterility starts around 35 C at anthesis
+HEAT_STRESS_C = 35.0
+HEAVY_RAIN_MM_H = 1.0
+
+
+def _column(rows, key, default=np.nan):
+    return np.array([default if row.get(key) is None else row.get(key) for row in rows], dtype=float)
+
+
+def daily_columns(daily_forecast):
+    """``get_weather_data()['daily_forecast']`` as arrays"""
+    temperature = [day.get('temperature', {}) for day in daily_forecast]
+    return {
+        'time': _column(daily_forecast, 'date'),
+        'tmin': _column(temperature, 'min'),
+        'tmax': _column(temperature, 'max'),
+        'humidity': _column(daily_forecast, 'humidity'),
+        'wind_speed': _column(daily_forecast, 'wind_speed'),
+        'pop': _column(daily_forecast, 'pop'),
+        'rain': _column(daily_forecast, 'rain', 0.0),
+    }
+
+
+def hourly_columns(hourly_forecast):
+    """``get_weather_data()['hourly_forecast']`` as arrays"""
+    return {
+        'time': _column(hourly_forecast, 'datetime'),
+        'temperature': _column(hourly_forecast, 'temperature'),
+        'humidity': _column(hourly_forecast, 'humidity'),
+        'wind_speed': _column(hourly_forecast, 'wind_speed'),
+        'pop': _column(hourly_forecast, 'pop'),
+        'rain': _column(hourly_forecast, 'rain_1h', 0.0),
+    }
+
+
+def history_columns(history):
+    """``get_historical_weather()`` summaries as arrays; failed years are left out"""
+    rows = [entry for entry in history or [] if 'error' not in entry]
+    return {
+        'year': _column(rows, 'year'),
+        'temp': _column(rows, 'temp'),
+        'rain': _column(rows, 'rain', 0.0),
+    }
+
+
+def stack(columns_list):
+    """Per-tile column dicts as ``{name: (tiles, time)}`` arrays, padded with NaN"""
+    if not columns_list:
+        return {}
+    length = max((len(next(iter(columns.values()), [])) for columns in columns_list), default=0)
+    stacked = {}
+    for name in columns_list[0]:
+        array = np.full((len(columns_list), length), np.nan)
+        for i, columns in enumerate(columns_list):
+            values = columns[name]
+            array[i, :len(values)] = values
+        stacked[name] = array
+    return stacked
+
+
+def growing_degree_days(tmin, tmax, base=GDD_BASE_C, cap=GDD_CAP_C):
+    tmax = np.minimum(tmax, cap)
+    tmin = np.clip(tmin, base, cap)
+    return np.nansum(np.maximum((tmax + tmin) / 2.0 - base, 0.0), axis=-1)
+
+
+def cumulative_rain(rain):
+    """Running rainfall total along the series"""
+    return np.nancumsum(rain, axis=-1)
+
+
+def longest_dry_spell(rain, threshold=DRY_DAY_MM):
+    """Longest run of consecutive dry steps; NaN padding ends a run"""
+    dry = rain < threshold
+    if dry.shape[-1] == 0:
+        return np.zeros(dry.shape[:-1])
+    index = np.broadcast_to(np.arange(dry.shape[-1]), dry.shape)
+    # Position of the latest non-dry step at or before each step
+    last_break = np.maximum.accumulate(np.where(dry, -1, index), axis=-1)
+    return np.max(np.where(dry, index - last_break, 0), axis=-1)
+
+
+def heat_stress_hours(temperature, threshold=HEAT_STRESS_C):
+    return np.sum(temperature >= threshold, axis=-1)
+
+
+def _day_of_year(epoch):
+    days = np.nan_to_num(epoch).astype('int64').astype('datetime64[s]').astype('datetime64[D]')
+    return (days - days.astype('datetime64[Y]')).astype(int) + 1
+
+
+def extraterrestrial_radiation(lat, day_of_year):
+    """Ra in MJ m-2 day-1 (FAO-56 eq. 21); ``lat`` in degrees, broadcast against ``day_of_year``"""
+    phi = np.radians(lat)
+    angle = 2.0 * np.pi * day_of_year / 365.0
+    dr = 1.0 + 0.033 * np.cos(angle)
+    delta = 0.409 * np.sin(angle - 1.39)
+    omega = np.arccos(np.clip(-np.tan(phi) * np.tan(delta), -1.0, 1.0))
+    return (24.0 * 60.0 / np.pi) * 0.0820 * dr * (
+        omega * np.sin(phi) * np.sin(delta) + np.cos(phi) * np.cos(delta) * np.sin(omega)
+    )
+
+
+def et0_hargreaves(tmin, tmax, lat, day_of_year):
+    """Daily reference evapotranspiration (mm) from temperature alone (Hargreaves-Samani).
+
+    A rough estimate: no humidity, wind or measured radiation, so expect
+    +-20% against Penman-Monteith in the humid tropics.
+    """
+    ra_mm = 0.408 * extraterrestrial_radiation(lat, day_of_year)
+    tmean = (tmax + tmin) / 2.0
+    return 0.0023 * ra_mm * (tmean + 17.8) * np.sqrt(np.maximum(tmax - tmin, 0.0))
+
+
+def compute_batch(daily, lat, hourly=None, history=None, days=7):
+    """Indicators for stacked tiles.
+
+    ``daily``/``hourly``/``history`` are ``stack()`` outputs and ``lat`` has one
+    latitude per tile. Returns ``{feature: array of shape (tiles,)}``.
+    """
+    lat = np.asarray(lat, dtype=float).reshape(-1, 1)
+    tmin, tmax, rain = daily['tmin'][:, :days], daily['tmax'][:, :days], daily['rain'][:, :days]
+    et0 = et0_hargreaves(tmin, tmax, lat, _day_of_year(daily['time'][:, :days]))
+    rain_total = cumulative_rain(rain)[:, -1] if rain.shape[-1] else np.zeros(len(lat))
+    features = {
+        'gdd': growing_degree_days(tmin, tmax),
+        'temp_mean': _nanmean((tmin + tmax) / 2.0),
+        'rain_total_mm': rain_total,
+        'rain_days': np.sum(rain >= DRY_DAY_MM, axis=-1),
+        'longest_dry_spell_days': longest_dry_spell(np.where(np.isnan(tmax), np.nan, rain)),
+        'et0_mm': np.nansum(et0, axis=-1),
+    }
+    features['water_balance_mm'] = features['rain_total_mm'] - features['et0_mm']
+    if hourly:
+        temperature = hourly['temperature'][:, :48]
+        features['heat_stress_hours'] = heat_stress_hours(temperature)
+        features['rain_48h_mm'] = np.nansum(hourly['rain'][:, :48], axis=-1)
+        # fmin/fmax skip NaN padding and give NaN (not a warning) for an empty tile
+        features['temp_min_48h'] = np.fmin.reduce(temperature, axis=-1)
+        features['temp_max_48h'] = np.fmax.reduce(temperature, axis=-1)
+        features['wind_max_48h'] = np.fmax.reduce(hourly['wind_speed'][:, :48], axis=-1)
+    if history and history['temp'].shape[-1]:
+        features['history_rain_mm'] = _nanmean(history['rain'])
+        features['history_temp'] = _nanmean(history['temp'])
+    return features
+
+
+def _nanmean(values):
+    count = np.sum(~np.isnan(values), axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count > 0, np.nansum(values, axis=-1) / count, np.nan)
+
+
+def _plain(value):
+    value = float(value)
+    if not np.isfinite(value):
+        return None
+    return round(value, 2)
+
+
+def from_weather(weather_data):
+    """Indicators for one ``get_weather_data()`` result (plus ``history`` when present)"""
+    daily = stack([daily_columns(weather_data.get('daily_forecast', []))])
+    hourly = stack([hourly_columns(weather_data.get('hourly_forecast', []))]) if weather_data.get('hourly_forecast') else None
+    history = stack([history_columns(weather_data.get('history'))]) if isinstance(weather_data.get('history'), list) else None
+    features = compute_batch(daily, [weather_data['location']['lat']], hourly, history)
+    return {name: _plain(values[0]) for name, values in features.items()}
+
+
+def heavy_rain_times(hourly, threshold=HEAVY_RAIN_MM_H):
+    """Epoch times of the hours in the next 48h with more than ``threshold`` mm of rain"""
+    columns = hourly_columns(hourly[:48])
+    return columns['time'][columns['rain'] > threshold]
+
+
+def tile_features(tile_ids):
+    """Indicators for many forecast tiles from their latest stored issue, in one query"""
+    from app.services import forecast_store
+    series = forecast_store.latest_series(tile_ids)
+    tiles = [tile for tile in tile_ids if tile in series]
+    if not tiles:
+        return {}
+    daily = stack([daily_columns(series[tile]['daily']) for tile in tiles])
+    hourly = stack([hourly_columns(series[tile]['hourly']) for tile in tiles])
+    lat = [float(tile.split(':')[0]) for tile in tiles]
+    features = compute_batch(daily, lat, hourly)
+    return {
+        tile: dict({name: _plain(values[i]) for name, values in features.items()}, issued_at=series[tile]['issued_at'])
+        for i, tile in enumerate(tiles)
+    }
@@ -0,0 +1,126 @@
+import time
+from flask import current_app
+from app.event_loops import loop_local, ssl_context
+from app.services import claude_tools
+from app.services.claude_service import ClaudeService
+from app.timing import span
+
+class AsyncClaudeService(ClaudeService):
+    """Non-blocking ClaudeService built on anthropic.AsyncAnthropic.
+
+    Use one instance per request (``async with AsyncClaudeService() as claude``).
+    The AsyncAnthropic client belongs to the running event loop (see
+    app/event_loops.py) and keeps its connections across requests.
+    """
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    def _get_client(self):
+        if not self.client:
+            import anthropic
+            api_key = current_app.config.get('CLAUDE_API_KEY')
+            if not api_key:
+                raise ValueError("CLAUDE_API_KEY not configured")
+            base_url = current_app.config.get('CLAUDE_API_BASE_URL')
+            self.client = loop_local(('anthropic', api_key, base_url), lambda: anthropic.AsyncAnthropic(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=anthropic.DefaultAsyncHttpxClient(verify=ssl_context())
+            ))
+        return self.client
+
+    async def chat(self, message, model="claude-3-5-sonnet-20241022", max_tokens=1000):
+        try:
+            client = self._get_client()
+            with span('claude.chat'):
+                response = await self._budgeted(client, 'claude.chat').messages.create(
+                    model=model,
+                    max_tokens=max_tokens,
+                    messages=[
+                        {"role": "user", "content": message}
+                    ]
+                )
+            return {
+                "success": True,
+                "response": response.content[0].text,
+                "usage": self._usage(response)
+            }
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
+
+    async def analyze_soil_image(self, image_path, model=None, max_tokens=800):
+        """Soil fields of an image, from ``model`` or the SOIL_MODEL_TIERS models cheapest first.
+
+        A tier's answer is passed on to the next tier when a field is
+        missing, out of vocabulary or the model's CONFIDENCE is low, and
+        enough of the request deadline is left for another call.
+        """
+        return await self.analyze_soil_images([image_path], model, max_tokens)
+
+    async def analyze_soil_images(self, image_paths, model=None, max_tokens=800):
+        """``analyze_soil_image`` for up to SOIL_MAX_IMAGES photos of one plot in a single call.
+
+        The photos go in one request as separate image blocks, so the prompt
+        and tool schema are paid for once; the result is one consolidated
+        classification plus ``images``, a note per photo, when there are several.
+        """
+        try:
+            images = self._load_images(image_paths)
+            client = self._get_client()
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
+        tiers = self._soil_tiers(model)
+        attempts = []
+        for i, tier_model in enumerate(tiers):
+            if attempts and not self._may_escalate():
+                break
+            last = i == len(tiers) - 1
+            started = time.perf_counter()
+            try:
+                with span('claude.soil_image'):
+                    response = await self._budgeted(client, 'claude.soil_image').messages.create(
+                        model=tier_model,
+                        max_tokens=max_tokens,
+                        messages=self._soil_image_messages(images),
+                        **self._tool_choice(claude_tools.soil_tool(len(images)))
+                    )
+                attempt = self._soil_tier_attempt(tier_model, time.perf_counter() - started, response, last=last,
+                                                  image_count=len(images))
+            except Exception as e:
+                attempt = self._soil_tier_attempt(tier_model, time.perf_counter() - started, error=e, last=last)
+            attempts.append(attempt)
+            if attempt['outcome'] in ('accepted', 'unvalidated'):
+                break
+        return self._soil_tier_result(attempts)
+
+    async def get_crop_recommendations(self, weather_data, soil_data=None, model="claude-3-5-sonnet-20241022", max_tokens=2000, encoding=None, shortlist=None):
+        try:
+            if not weather_data["success"]:
+                return {"success": False, "error": "Weather data unavailable"}
+            prompt = self._crop_prompt(weather_data, soil_data, encoding, shortlist)
+            client = self._get_client()
+            with span('claude.crop'):
+                response = await self._budgeted(client, 'claude.crop').messages.create(
+                    model=model,
+                    max_tokens=max_tokens,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    **self._tool_choice(claude_tools.crop_tool(shortlist))
+                )
+            return self._crop_result(response, weather_data, soil_data, self._prompt_stats(prompt, encoding, response), shortlist)
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e)
+            }
@@ -0,0 +1,133 @@
+import asyncio
+from flask import current_app
+from app import deadline
+from app.event_loops import loop_local, ssl_context
+from app.cache import service_cache
+from app.deadline import DeadlineExceeded
+from app.services import forecast_store
+from app.services.weather_service import WeatherService
+from app.timing import span
+
+def _http_client():
+    import httpx
+    return httpx.AsyncClient(verify=ssl_context(), limits=httpx.Limits(max_keepalive_connections=8))
+
+
+class AsyncWeatherService(WeatherService):
+    """Non-blocking WeatherService built on httpx.AsyncClient.
+
+    Use one instance per request (``async with AsyncWeatherService() as ws``).
+    Without a ``client`` it uses the httpx client of the running event loop
+    (see app/event_loops.py), which keeps its connections across requests.
+    """
+
+    def __init__(self, client=None):
+        self._client = client
+
+    async def __aenter__(self):
+        if self._client is None:
+            self._client = loop_local('httpx', _http_client)
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def _get_json(self, url, params=None, timeout=10, stage='http', upstream=None, cache_key=None, cache_ttl=None):
+        """GET a JSON document, raising on HTTP errors (CircuitOpen while ``upstream`` is down).
+
+        ``timeout`` is capped to the request's remaining deadline. With a
+        ``cache_key`` the answer is shared through the service cache (under
+        the ``stage`` namespace) for ``cache_ttl`` seconds.
+        """
+        if cache_key is not None:
+            return await service_cache.get_or_compute_async(stage, cache_key, cache_ttl,
+                                                            lambda: self._fetch_json(url, params, timeout, stage, upstream))
+        return await self._fetch_json(url, params, timeout, stage, upstream)
+
+    async def _fetch_json(self, url, params, timeout, stage, upstream):
+        limit = deadline.timeout(timeout, stage)
+        guard = self._breaker(upstream)
+        try:
+            with span(stage):
+                response = await self._client.get(url, params=params, timeout=limit)
+                response.raise_for_status()
+                data = response.json()
+        except Exception as e:
+            self._call_failed(guard, e, shortened=limit < timeout)
+            raise
+        except BaseException:
+            # Cancelled mid-call: says nothing about the upstream, but a half-open trial must end
+            if guard is not None:
+                guard.release()
+            raise
+        if guard is not None:
+            guard.record_success()
+        return data
+
+    async def get_user_location(self, user_ip=None):
+        """Get user location with multiple fallback services"""
+        for service in self.ip_services:
+            try:
+                url, params = self._ip_service_request(service, user_ip)
+                data = await self._get_json(url, params=params, timeout=5, stage='ip_geo', upstream=self._ip_upstream(service),
+                                            cache_key=self._ip_cache_key(service, user_ip), cache_ttl=current_app.config.get('IP_GEO_CACHE_TTL', 3600))
+                result = service['parser'](data)
+                if result:
+                    return result
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                print(f"IP service {service['url']} failed: {str(e)}")
+                continue
+        return self._location_unavailable()
+
+    async def _get_location_name(self, lat, lon):
+        """Get location name using OpenWeather Geocoding API"""
+        try:
+            data = await self._get_json(f"{self.base_url}/geo/1.0/reverse", params=self._geocode_params(lat, lon), timeout=5, stage='geocode', upstream='openweather_geocode',
+                                        cache_key=self._geocode_cache_key(lat, lon), cache_ttl=current_app.config.get('GEOCODE_CACHE_TTL', 604800))
+            return self._parse_location_name(data, lat, lon)
+        except Exception as e:
+            print(f"Geocoding failed: {str(e)}")
+        return self._unknown_location(lat, lon)
+
+    async def get_weather_data(self, lat, lon, history_years=0):
+        """Get weather data; reverse geocoding and One Call run concurrently.
+
+        With ``history_years`` the same-day history is fetched alongside and
+        returned under ``history`` (see get_historical_weather), unless less
+        than DEADLINE_HISTORY_MIN_SECONDS of the request's budget is left.
+        """
+        try:
+            calls = [
+                self._get_location_name(lat, lon),
+                self._get_json(f"{self.base_url}/data/3.0/onecall", params=self._onecall_params(lat, lon), timeout=10, stage='onecall', upstream='openweather',
+                               cache_key=forecast_store.tile_id(lat, lon), cache_ttl=current_app.config.get('WEATHER_CACHE_TTL', 600))
+            ]
+            if history_years and deadline.allows(current_app.config.get('DEADLINE_HISTORY_MIN_SECONDS', 15), 'timemachine'):
+                calls.append(self.get_historical_weather(lat, lon, history_years))
+            location_info, weather_data, *history = await asyncio.gather(*calls)
+            result = self._build_weather_result(weather_data, location_info, lat, lon)
+            if history:
+                result['history'] = history[0]
+            return result
+        except Exception as e:
+            return self._weather_unavailable(lat, lon, e)
+
+    async def get_historical_weather(self, lat, lon, years=3):
+        """Same as WeatherService.get_historical_weather, with the yearly calls in parallel"""
+        base_url = f"{self.base_url}/data/3.0/onecall/timemachine"
+
+        async def fetch(year, params):
+            try:
+                data = await self._get_json(base_url, params=params, timeout=10, stage='timemachine', upstream='openweather',
+                                            cache_key=self._history_cache_key(params), cache_ttl=current_app.config.get('HISTORY_CACHE_TTL', 604800))
+                return self._parse_historical(year, data)
+            except Exception as e:
+                return {'year': year, 'error': str(e)}
+
+        return list(await asyncio.gather(*[fetch(year, params) for year, params in self._historical_requests(lat, lon, years)]))
+
+    async def get_historical_weather_summary(self, lat, lon, years=3):
+        """Same as WeatherService.get_historical_weather_summary, with the yearly calls in parallel"""
+        return self._format_historical(await self.get_historical_weather(lat, lon, years))
@@ -1,3 +1,4 @@
+import uuid
 from datetime import datetime, timezone
 from app.extensions import db
 from models.users import User
@@ -6,6 +7,7 @@ from flask_jwt_extended import create_access_token, create_refresh_token, get_jw
 from flask_jwt_extended import jwt_required
 from flask import current_app
 from models.blacklisted_token import BlacklistedToken
+from app.write_behind import write_behind
 
 # In-memory blacklist for demonstration (use persistent storage in production)
 JWT_BLACKLIST = set()
@@ -19,7 +21,7 @@ def create_tokens(user):
     return access_token, refresh_token
 
 def refresh_access_token(identity):
-    user = User.query.get(identity)
+    user = db.session.get(User, uuid.UUID(identity))
     if not user:
         return None
     access_token = create_access_token(
@@ -61,8 +63,9 @@ def login_user(data):
     if not user.is_active:
         return {'message': 'Account is inactive.', 'status': 403}
 
-    user.last_login_at = datetime.now(timezone.utc)
-    db.session.commit()
+    # Not worth a synchronous write transaction before issuing the token
+    last_login_at = datetime.now(timezone.utc)
+    write_behind.enqueue(User, user.id, last_login_at=last_login_at)
 
     # Create JWT token with is_admin claim
     access_token = create_access_token(
@@ -78,7 +81,7 @@ def login_user(data):
         'full_name': user.full_name,
         'province': user.province,
         'city': user.city,
-        'last_login_at': user.last_login_at.isoformat(),
+        'last_login_at': last_login_at.isoformat(),
         'is_admin': user.is_admin
     }
 
@@ -1,6 +1,16 @@
-import anthropic
 import base64
+import json
 from flask import current_app
+from app import deadline
+from app.metrics import metrics
+from app.services import claude_tools, prompt_encoder, soil_vocabulary
+from app.timing import span
+
+prompt_tokens = metrics.summary('claude_crop_prompt_tokens', 'Crop prompt input tokens, estimated and reported', ['encoding', 'kind'])
+soil_tier_calls = metrics.counter('claude_soil_tier_calls_total', 'Soil image calls by model tier and outcome', ['model', 'outcome'])
+soil_tier_escalations = metrics.counter('claude_soil_tier_escalations_total', 'Soil analyses passed on to the next tier', ['model', 'reason'])
+soil_tier_seconds = metrics.summary('claude_soil_tier_seconds', 'Soil image call latency by model tier', ['model'])
+soil_tier_tokens = metrics.counter('claude_soil_tier_tokens_total', 'Soil image tokens by model tier', ['model', 'kind'])
 
 class ClaudeService:
     def __init__(self):
@@ -8,31 +18,38 @@ class ClaudeService:
     
     def _get_client(self):
         if not self.client:
+            # Imported on first use: the SDK is the heaviest import in the app
+            import anthropic
             api_key = current_app.config.get('CLAUDE_API_KEY')
             if not api_key:
                 raise ValueError("CLAUDE_API_KEY not configured")
             self.client = anthropic.Anthropic(
-                api_key=api_key
+                api_key=api_key,
+                base_url=current_app.config.get('CLAUDE_API_BASE_URL')
             )
         return self.client
     
+    def _budgeted(self, client, stage):
+        """``client`` limited to what is left of the request deadline; retries would not fit in it"""
+        if deadline.remaining() is None:
+            return client
+        return client.with_options(timeout=deadline.timeout(None, stage), max_retries=0)
+
     def chat(self, message, model="claude-3-5-sonnet-20241022", max_tokens=1000):
         try:
             client = self._get_client()
-            response = client.messages.create(
-                model=model,
-                max_tokens=max_tokens,
-                messages=[
-                    {"role": "user", "content": message}
-                ]
-            )
+            with span('claude.chat'):
+                response = self._budgeted(client, 'claude.chat').messages.create(
+                    model=model,
+                    max_tokens=max_tokens,
+                    messages=[
+                        {"role": "user", "content": message}
+                    ]
+                )
             return {
                 "success": True,
                 "response": response.content[0].text,
-                "usage": {
-                    "input_tokens": response.usage.input_tokens,
-                    "output_tokens": response.usage.output_tokens
-                }
+                "usage": self._usage(response)
             }
         except Exception as e:
             return {
@@ -40,153 +57,145 @@ class ClaudeService:
                 "error": str(e)
             }
     
-    def analyze_soil_image(self, image_path, model="claude-3-5-sonnet-20241022", max_tokens=800):
-        try:
-            with open(image_path, "rb") as image_file:
-                image_data = base64.b64encode(image_file.read()).decode()
-            
-            # Determine image format
-            image_format = "image/jpeg"
-            if image_path.lower().endswith('.png'):
-                image_format = "image/png"
-            elif image_path.lower().endswith('.webp'):
-                image_format = "image/webp"
-            
-            allowed_soil_types = """
-            Only choose the SOIL_TYPE from this list (do not invent new types):
-            - Alluvial Soil
-            - Andosol Soil
-            - Regosol Soil
-            - Latosol Soil
-            - Podzolic Soil
-            - Grumusol Soil
-            - Organosol Soil
-            - Lithosol Soil
-            - Mediterranean Soil
-            - Rendzina Soil
-            - Laterite Soil
-            - Gleysol Soil
-            """
-            allowed_soil_color = """
-            SOIL_COLOR (choose only from):
-            - Brown
-            - Dark Brown
-            - Reddish
-            - Yellowish
-            - Black
-            - Gray
-            """
-            allowed_soil_texture = """
-            SOIL_TEXTURE (choose only from):
-            - Sandy
-            - Silty
-            - Clayey
-            - Loamy
-            - Peaty
-            - Gravelly
-            """
-            allowed_soil_drainage = """
-            SOIL_DRAINAGE (choose only from):
-            - Well-drained
-            - Poorly-drained
-            - Moderately-drained
-            - Excessively-drained
-            - Waterlogged
-            """
-            allowed_soil_location_type = """
-            SOIL_LOCATION_TYPE (choose only from):
-            - Valley
-            - Slope
-            - Plain
-            - Hill
-            - Riverbank
-            - Coastal
-            - Plateau
-            """
-            allowed_soil_fertility = """
-            SOIL_FERTILITY (choose only from):
-            - High
-            - Medium
-            - Low
-            - Very Low
-            """
-            allowed_soil_moisture = """
-            SOIL_MOISTURE (choose only from):
-            - Wet
-            - Moist
-            - Dry
-            - Very Dry
-            - Waterlogged
-            """
-            
-            prompt = f"""
-            Analyze this soil image and identify the soil type.\n\n{allowed_soil_types}\n\nFor each field below, choose ONLY from the provided options (or 'Unknown' if you cannot infer):\n{allowed_soil_color}\n{allowed_soil_texture}\n{allowed_soil_drainage}\n{allowed_soil_location_type}\n{allowed_soil_fertility}\n{allowed_soil_moisture}\n\nFormat your response as:\nSOIL_TYPE: [choose only from the list above]\nSOIL_COLOR: [choose only from the SOIL_COLOR list]\nSOIL_TEXTURE: [choose only from the SOIL_TEXTURE list]\nSOIL_DRAINAGE: [choose only from the SOIL_DRAINAGE list]\nSOIL_LOCATION_TYPE: [choose only from the SOIL_LOCATION_TYPE list]\nSOIL_FERTILITY: [choose only from the SOIL_FERTILITY list]\nSOIL_MOISTURE: [choose only from the SOIL_MOISTURE list]\n"""
-            
-            client = self._get_client()
-            response = client.messages.create(
-                model=model,
-                max_tokens=max_tokens,
-                messages=[
-                    {
-                        "role": "user", 
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt
-                            },
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": image_format,
-                                    "data": image_data
-                                }
-                            }
-                        ]
-                    }
-                ]
-            )
-            
-            return {
-                "success": True,
-                "soil_analysis": response.content[0].text,
-                "usage": {
-                    "input_tokens": response.usage.input_tokens,
-                    "output_tokens": response.usage.output_tokens
-                }
-            }
-        except Exception as e:
-            return {
-                "success": False,
-                "error": str(e)
+    def _usage(self, response):
+        return {
+            "input_tokens": response.usage.input_tokens,
+            "output_tokens": response.usage.output_tokens
+        }
+
+    def _load_image(self, image_path):
+        """Return (media_type, base64 data) for an image on disk"""
+        with open(image_path, "rb") as image_file:
+            image_data = base64.b64encode(image_file.read()).decode()
+        
+        # Determine image format
+        image_format = "image/jpeg"
+        if image_path.lower().endswith('.png'):
+            image_format = "image/png"
+        elif image_path.lower().endswith('.webp'):
+            image_format = "image/webp"
+        return image_format, image_data
+
+    def _soil_prompt(self, image_count=1):
+        # The allowed values are the enums of the tool schema
+        if image_count > 1:
+            subject = (f"These {image_count} photos show the same plot from different angles. Analyze them "
+                       f"together and record one classification of the plot with the {claude_tools.SOIL_TOOL} "
+                       "tool, plus a note for each photo. ")
+        else:
+            subject = f"Analyze this soil image and record its characteristics with the {claude_tools.SOIL_TOOL} tool. "
+        return (
+            subject +
+            "Choose every value from the tool's options and do not invent new soil types; use "
+            f"{soil_vocabulary.UNKNOWN} for a field you cannot infer from the image."
+        )
+
+    def _soil_image_messages(self, images):
+        """User message with the prompt and one image block per ``(media_type, data)``"""
+        content = [
+            {
+                "type": "text",
+                "text": self._soil_prompt(len(images))
             }
+        ]
+        for i, (image_format, image_data) in enumerate(images):
+            if len(images) > 1:
+                content.append({"type": "text", "text": f"Image {i + 1}:"})
+            content.append({
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": image_format,
+                    "data": image_data
+                }
+            })
+        return [{"role": "user", "content": content}]
+
+    def _load_images(self, image_paths):
+        max_images = current_app.config.get('SOIL_MAX_IMAGES', 5)
+        if not image_paths:
+            raise ValueError("No soil image given")
+        if len(image_paths) > max_images:
+            raise ValueError(f"At most {max_images} soil images can be analyzed together")
+        return [self._load_image(image_path) for image_path in image_paths]
+
+    def _tool_choice(self, tool):
+        """messages.create arguments that make the model answer through ``tool``"""
+        return {"tools": [tool], "tool_choice": {"type": "tool", "name": tool["name"]}}
 
-    def _summarize_hourly_forecast(self, hourly_forecast):
-        """Summarize next 48h for key weather events (rain, temp extremes, wind)."""
-        if not hourly_forecast:
-            return "No hourly forecast available."
-        import datetime
-        rain_events = []
-        high_temp = float('-inf')
-        low_temp = float('inf')
-        high_wind = float('-inf')
-        for h in hourly_forecast[:48]:
-            dt = datetime.datetime.fromtimestamp(h['datetime']).strftime('%Y-%m-%d %H:%M')
-            temp = h['temperature']
-            wind = h['wind_speed']
-            rain = h.get('rain_1h', 0)
-            if rain and rain > 1:
-                rain_events.append(f"{dt}: Heavy rain ({rain}mm/h)")
-            if temp > high_temp:
-                high_temp = temp
-            if temp < low_temp:
-                low_temp = temp
-            if wind > high_wind:
-                high_wind = wind
-        summary = f"Next 48h: Temp {low_temp:.1f}°C to {high_temp:.1f}°C, max wind {high_wind:.1f} m/s."
-        if rain_events:
-            summary += "\nRain events: " + "; ".join(rain_events[:3])
-        return summary
+    def _soil_tiers(self, model=None):
+        """Models to ask in order: the one requested, or the SOIL_MODEL_TIERS policy"""
+        if model:
+            return [model]
+        return current_app.config.get('SOIL_MODEL_TIERS') or ["claude-3-5-sonnet-20241022"]
+
+    def _soil_answer(self, response, image_count=1):
+        """(analysis fields, problems, per-photo notes) of a soil tool call"""
+        values = claude_tools.tool_input(response, claude_tools.SOIL_TOOL)
+        if values is None:
+            # No tool call at all: try the KEY: value text the prompt used to ask for
+            found = soil_vocabulary.fields(claude_tools.response_text(response))
+        else:
+            found = claude_tools.soil_fields(values)
+        fields, problems = soil_vocabulary.review_fields(found, current_app.config.get('SOIL_TIER_LOW_CONFIDENCE', ["Low"]))
+        notes = claude_tools.image_notes(values, image_count) if image_count > 1 else None
+        return fields, problems, notes
+
+    def _soil_tier_attempt(self, model, seconds, response=None, error=None, last=True, image_count=1):
+        """Review and record one tier's answer.
+
+        The outcome is 'accepted' (every field in vocabulary, confidence not
+        low), 'escalated' (ask the next tier), 'unvalidated' (the last tier
+        answered with problems) or 'error'.
+        """
+        attempt = {"model": model, "latency_ms": round(seconds * 1000, 1)}
+        soil_tier_seconds.observe(seconds, model=model)
+        if error is not None:
+            attempt.update(outcome='error', error=str(error))
+            reasons = {'error'}
+        else:
+            usage = self._usage(response)
+            soil_tier_tokens.inc(usage['input_tokens'], model=model, kind='input')
+            soil_tier_tokens.inc(usage['output_tokens'], model=model, kind='output')
+            fields, problems, notes = self._soil_answer(response, image_count)
+            reasons = {reason for _, reason in problems}
+            attempt.update(
+                outcome='accepted' if not problems else ('unvalidated' if last else 'escalated'),
+                usage=usage,
+                problems=[f"{key}:{reason}" for key, reason in problems],
+                fields=fields
+            )
+            if notes is not None:
+                attempt['images'] = notes
+        if not last and attempt['outcome'] != 'accepted':
+            for reason in sorted(reasons):
+                soil_tier_escalations.inc(model=model, reason=reason)
+        soil_tier_calls.inc(model=model, outcome=attempt['outcome'])
+        return attempt
+
+    def _may_escalate(self):
+        # A stronger tier is only worth asking when it can still answer in time
+        return deadline.allows(current_app.config.get('DEADLINE_ESCALATION_MIN_SECONDS', 10), 'soil_escalation')
+
+    def _soil_tier_result(self, attempts):
+        """analyze_soil_image result: the last answer given, with tokens summed over the tiers"""
+        answered = [attempt for attempt in attempts if 'fields' in attempt]
+        if not answered:
+            return {"success": False, "error": attempts[-1]['error'] if attempts else "No soil model configured"}
+        result = {
+            "success": True,
+            "soil_analysis": soil_vocabulary.render(answered[-1]['fields']),
+            "fields": answered[-1]['fields'],
+            "model": answered[-1]['model'],
+            "usage": {
+                "input_tokens": sum(attempt['usage']['input_tokens'] for attempt in answered),
+                "output_tokens": sum(attempt['usage']['output_tokens'] for attempt in answered)
+            },
+            "tiers": [{key: value for key, value in attempt.items() if key not in ('fields', 'images')} for attempt in attempts]
+        }
+        if 'images' in answered[-1]:
+            result["images"] = answered[-1]['images']
+        return result
 
     def _infer_indonesia_season(self, month):
         """Return 'Rainy Season' for Nov-Apr, 'Dry Season' for May-Oct."""
@@ -195,83 +204,115 @@ class ClaudeService:
         else:
             return "Dry Season"
 
-    def get_crop_recommendations(self, weather_data, soil_data=None, model="claude-3-5-sonnet-20241022", max_tokens=2000):
+    def _crop_instructions(self, today_str, shortlist=None):
+        return (
+            f"Today is: {today_str}\n"  # Explicitly tell the LLM the current date
+            + self._shortlist_instructions(shortlist) +
+            "Given the following data for a location in Indonesia, recommend crops and record them with the "
+            f"{claude_tools.CROP_TOOL} tool, filling in every field. All dates must be in ISO 8601 format (YYYY-MM-DD).\n"
+        )
+
+    def _shortlist_instructions(self, shortlist):
+        if not shortlist:
+            return ""
+        crops = ', '.join(f"{crop['crop_name']} ({crop['suitability_score']})" for crop in shortlist)
+        return (
+            f"A local model shortlisted these crops with suitability scores: {crops}. "
+            "Recommend ONLY these crops, in this order, and keep each suitability_score within 10 points of the given one.\n"
+        )
+
+    def _crop_prompt(self, weather_data, soil_data=None, encoding=None, shortlist=None):
+        """Crop recommendation prompt; ``encoding`` is 'compact' (default) or 'legacy'"""
+        encoding = encoding or current_app.config.get('CROP_PROMPT_ENCODING', 'compact')
+        if encoding == 'legacy':
+            return self._legacy_crop_prompt(weather_data, soil_data, shortlist)
+        import datetime as dt
+        now = dt.datetime.now()
+        soil_text = soil_data['soil_analysis'] if soil_data and soil_data.get('success', True) else None
+        return self._crop_instructions(now.strftime("%Y-%m-%d"), shortlist) + prompt_encoder.encode_crop_context(
+            weather_data, soil_text, season=self._infer_indonesia_season(now.month)
+        )
+
+    def _legacy_crop_prompt(self, weather_data, soil_data=None, shortlist=None):
+        """The original prompt with Python reprs of the weather dicts, kept for A/B runs"""
+        # --- Add season info ---
+        import datetime as dt
+        now = dt.datetime.now()
+        today_str = now.strftime("%Y-%m-%d")
+        season = self._infer_indonesia_season(now.month)
+        return (
+            self._crop_instructions(today_str, shortlist) +
+            f"Location: {weather_data['location']['name']}, {weather_data['location']['country']}\n"
+            f"Coordinates: {weather_data['location']['lat']}, {weather_data['location']['lon']}\n"
+            f"Timezone: {weather_data.get('timezone', 'UTC')}\n"
+            f"Season: {season}\n"
+            f"Current Weather: {weather_data['current']}\n"
+            f"7-Day Forecast: {weather_data.get('daily_forecast', [])}\n"
+            f"Soil Analysis: {soil_data['soil_analysis'] if soil_data else ''}"
+        )
+
+    def _prompt_stats(self, prompt, encoding, response):
+        """Estimated vs reported input tokens, per encoding"""
+        encoding = encoding or current_app.config.get('CROP_PROMPT_ENCODING', 'compact')
+        estimated = prompt_encoder.estimate_tokens(prompt)
+        prompt_tokens.observe(estimated, encoding=encoding, kind='estimated')
+        prompt_tokens.observe(response.usage.input_tokens, encoding=encoding, kind='actual')
+        return {"encoding": encoding, "estimated_tokens": estimated, "chars": len(prompt)}
+
+    def _crop_plan(self, response, shortlist=None):
+        """Validated crop tool input of a response (see claude_tools.crop_plan)"""
+        values = claude_tools.tool_input(response, claude_tools.CROP_TOOL)
+        if values is None:
+            # No tool call at all: the reply may still be the bare JSON object
+            try:
+                values = json.loads(claude_tools.response_text(response))
+            except ValueError:
+                return None, ["no tool call"]
+        return claude_tools.crop_plan(values, shortlist)
+
+    def _crop_result(self, response, weather_data, soil_data=None, prompt_stats=None, shortlist=None):
+        plan, problems = self._crop_plan(response, shortlist)
+        if plan is None:
+            raise ValueError(f"Claude returned no usable crop recommendations ({', '.join(problems)})")
+        result = {
+            "success": True,
+            # JSON text, as the endpoints have always returned it; "structured" is the same object
+            "recommendations": json.dumps(plan),
+            "structured": plan,
+            "validation_problems": problems,
+            "location": weather_data['location'],
+            "weather_summary": weather_data['current'],
+            "forecast_summary": weather_data.get('daily_forecast', [])[:3],  # Include 3-day forecast in response
+            "alerts": weather_data.get('alerts', []),
+            "usage": self._usage(response)
+        }
+        if prompt_stats:
+            result["prompt"] = prompt_stats
+        if soil_data and soil_data.get("success"):
+            result["soil_analysis"] = soil_data['soil_analysis']
+        return result
+
+    def get_crop_recommendations(self, weather_data, soil_data=None, model="claude-3-5-sonnet-20241022", max_tokens=2000, encoding=None, shortlist=None):
+        """Crop recommendations from Claude.
+
+        Same-week history is used when ``weather_data['history']`` is set; with
+        a ``shortlist`` (crop_shortlist.rank) Claude only elaborates on those crops.
+        """
         try:
             if not weather_data["success"]:
                 return {"success": False, "error": "Weather data unavailable"}
-            soil_section = ""
-            if soil_data and soil_data.get("success"):
-                soil_section = f"""
-            \nSoil Analysis:\n{soil_data['soil_analysis']}\n"""
-            # Format forecast data for the prompt
-            forecast_section = ""
-            if weather_data.get('daily_forecast') and len(weather_data['daily_forecast']) > 0:
-                forecast_section = "\n\n7-Day Weather Forecast:\n"
-                for i, day in enumerate(weather_data['daily_forecast'][:7]):
-                    from datetime import datetime
-                    date_str = datetime.fromtimestamp(day['date']).strftime('%Y-%m-%d')
-                    forecast_section += f"Day {i+1} ({date_str}): {day['temperature']['min']:.1f}°C - {day['temperature']['max']:.1f}°C, {day['weather']}, Rain prob: {day['pop']:.0f}%\n"
-            # Format hourly summary
-            hourly_section = ""
-            if weather_data.get('hourly_forecast'):
-                hourly_section = "\n\nNext 48h Hourly Highlights:\n" + self._summarize_hourly_forecast(weather_data['hourly_forecast'])
-            # Format alerts if any
-            alerts_section = ""
-            if weather_data.get('alerts') and len(weather_data['alerts']) > 0:
-                alerts_section = "\n\nWeather Alerts:\n"
-                for alert in weather_data['alerts']:
-                    alerts_section += f"- {alert['event']}: {alert['description'][:100]}...\n"
-            # Historical weather summary
-            historical_section = ""
-            if weather_data.get('location'):
-                from app.services.weather_service import WeatherService
-                lat = weather_data['location']['lat']
-                lon = weather_data['location']['lon']
-                weather_service_instance = WeatherService()
-                historical_section = "\n\nHistorical Weather (same week, past 3 years):\n" + weather_service_instance.get_historical_weather_summary(lat, lon, years=3)
-            # --- Add season info ---
-            import datetime as dt
-            now = dt.datetime.now()
-            today_str = now.strftime("%Y-%m-%d")
-            season = self._infer_indonesia_season(now.month)
-            concise_json_prompt = (
-                f"Today is: {today_str}\n"  # Explicitly tell the LLM the current date
-                "Given the following data for a location in Indonesia, return ONLY a single JSON object with these keys: "
-                "'recommendations' (array of objects, each with: crop_name, crop_category, suitability_score, suitability_level, planting_method, spacing_recommendation, seed_variety_suggestions, expected_yield_per_hectare, fertilizer_schedule, watering_schedule, pest_control_measures, harvesting_indicators, estimated_cost_per_hectare, estimated_revenue_per_hectare, market_demand_level, best_planting_date, expected_harvest_date, planting_window_start, planting_window_end), "
-                "'seasonal_advice', 'weather_warnings', 'soil_treatments', 'risk_factors', 'success_probability', 'best_planting_date', 'expected_harvest_date', 'planting_window_start', 'planting_window_end'. "
-                "All dates must be in ISO 8601 format (YYYY-MM-DD). Do NOT include any explanation, markdown, or text outside the JSON object.\n"
-                f"Location: {weather_data['location']['name']}, {weather_data['location']['country']}\n"
-                f"Coordinates: {weather_data['location']['lat']}, {weather_data['location']['lon']}\n"
-                f"Timezone: {weather_data.get('timezone', 'UTC')}\n"
-                f"Season: {season}\n"
-                f"Current Weather: {weather_data['current']}\n"
-                f"7-Day Forecast: {weather_data.get('daily_forecast', [])}\n"
-                f"Soil Analysis: {soil_data['soil_analysis'] if soil_data else ''}"
-            )
-            prompt = concise_json_prompt
+            prompt = self._crop_prompt(weather_data, soil_data, encoding, shortlist)
             client = self._get_client()
-            response = client.messages.create(
-                model=model,
-                max_tokens=max_tokens,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            result = {
-                "success": True,
-                "recommendations": response.content[0].text,
-                "location": weather_data['location'],
-                "weather_summary": weather_data['current'],
-                "forecast_summary": weather_data.get('daily_forecast', [])[:3],  # Include 3-day forecast in response
-                "alerts": weather_data.get('alerts', []),
-                "usage": {
-                    "input_tokens": response.usage.input_tokens,
-                    "output_tokens": response.usage.output_tokens
-                }
-            }
-            if soil_data and soil_data.get("success"):
-                result["soil_analysis"] = soil_data['soil_analysis']
-            return result
+            with span('claude.crop'):
+                response = self._budgeted(client, 'claude.crop').messages.create(
+                    model=model,
+                    max_tokens=max_tokens,
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ],
+                    **self._tool_choice(claude_tools.crop_tool(shortlist))
+                )
+            return self._crop_result(response, weather_data, soil_data, self._prompt_stats(prompt, encoding, response), shortlist)
         except Exception as e:
             return {
                 "success": False,
@@ -0,0 +1,248 @@
+"""Tools that make Claude answer with one schema-shaped object.
+
+Both calls force their tool with ``tool_choice``, so the answer arrives as the
+tool_use block's already-parsed input instead of text to scrape. The soil
+schema comes from soil_vocabulary and the crop schema from the
+CropPrediction and CropRecommendation columns, so a new vocabulary value or
+column changes what the model is asked for. The model can still stray from
+a schema, so every answer goes through ``soil_fields`` / ``crop_plan`` before
+it is used.
+"""
+import json
+import re
+from datetime import date
+from functools import lru_cache
+
+import sqlalchemy as sa
+
+from app.services import soil_vocabulary
+
+SOIL_TOOL = "record_soil_analysis"
+CROP_TOOL = "record_crop_recommendations"
+
+# Analysis line key -> soil tool property
+SOIL_PROPERTIES = {key: key.lower() for key in soil_vocabulary.FIELDS}
+SOIL_PROPERTIES["CONFIDENCE"] = "confidence"
+
+LEVELS = ["High", "Medium", "Low"]
+
+# Per-crop dates the prompt has always asked for; CropRecommendation has no columns for them
+RECOMMENDATION_DATES = ["best_planting_date", "expected_harvest_date", "planting_window_start", "planting_window_end"]
+
+_SKIP_COLUMNS = {"id", "created_at", "crop_prediction_id", "soil_analysis_id", "weather_data_id", "recommended_crops"}
+
+_DESCRIPTIONS = {
+    "suitability_score": "0-100",
+    "success_probability": "Percent, 0-100",
+    "expected_yield_per_hectare": "Tonnes per hectare",
+    "estimated_cost_per_hectare": "IDR",
+    "estimated_revenue_per_hectare": "IDR",
+    "fertilizer_schedule": "One entry per application: timing, product and rate",
+    "pest_control_measures": "One entry per measure",
+    "soil_treatments": "One entry per treatment",
+    "risk_factors": "One entry per risk",
+}
+
+_ENUMS = {"suitability_level": LEVELS, "market_demand_level": LEVELS}
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def _column_schema(column):
+    if isinstance(column.type, sa.Integer):
+        schema = {"type": "integer"}
+    elif isinstance(column.type, sa.Numeric):
+        schema = {"type": "number"}
+    elif isinstance(column.type, sa.Date):
+        schema = {"type": "string", "format": "date", "description": "YYYY-MM-DD"}
+    elif isinstance(column.type, sa.JSON):
+        schema = {"type": "array", "items": {"type": "string"}}
+    else:
+        schema = {"type": "string"}
+    if column.name in _ENUMS:
+        schema["enum"] = _ENUMS[column.name]
+    if column.name in _DESCRIPTIONS:
+        schema["description"] = _DESCRIPTIONS[column.name]
+    return schema
+
+
+def _columns(model):
+    return {column.name: _column_schema(column) for column in model.__table__.columns if column.name not in _SKIP_COLUMNS}
+
+
+@lru_cache(maxsize=8)
+def soil_tool(image_count=1):
+    """Soil tool definition; for several photos of one plot it also asks for a note per photo"""
+    properties = {
+        SOIL_PROPERTIES[key]: {"type": "string", "enum": options + [soil_vocabulary.UNKNOWN]}
+        for key, options in soil_vocabulary.FIELDS.items()
+    }
+    properties["confidence"] = {"type": "string", "enum": soil_vocabulary.CONFIDENCE_LEVELS,
+                                "description": "How sure you are of soil_type"}
+    description = "Record the soil characteristics seen in the photo. Use Unknown for a field you cannot infer."
+    if image_count > 1:
+        description = ("Record one consolidated classification of the plot seen in the photos, and a note per "
+                       "photo. Use Unknown for a field you cannot infer.")
+        properties["images"] = {
+            "type": "array",
+            "description": "One entry per photo, in the order given",
+            "minItems": image_count,
+            "maxItems": image_count,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "image": {"type": "integer", "description": f"Photo number, 1-{image_count}"},
+                    "soil_type": {"type": "string", "enum": soil_vocabulary.SOIL_TYPES + [soil_vocabulary.UNKNOWN]},
+                    "usable": {"type": "boolean", "description": "Whether the photo shows enough soil to judge"},
+                    "notes": {"type": "string", "description": "What this photo shows, in one sentence"},
+                },
+                "required": ["image", "soil_type", "usable", "notes"],
+            },
+        }
+    return {
+        "name": SOIL_TOOL,
+        "description": description,
+        "input_schema": {"type": "object", "properties": properties, "required": list(properties)},
+    }
+
+
+@lru_cache(maxsize=1)
+def _crop_schemas():
+    from models.crop_predictions import CropPrediction
+    from models.crop_recommendations import CropRecommendation
+    prediction = _columns(CropPrediction)
+    recommendation = _columns(CropRecommendation)
+    for name in RECOMMENDATION_DATES:
+        recommendation[name] = prediction[name]
+    return prediction, recommendation
+
+
+def crop_tool(shortlist=None):
+    """Crop tool definition; with a shortlist, crop_name is limited to those crops"""
+    prediction, recommendation = _crop_schemas()
+    item = {name: dict(schema) for name, schema in recommendation.items()}
+    if shortlist:
+        item["crop_name"]["enum"] = [crop["crop_name"] for crop in shortlist]
+    properties = {
+        "recommendations": {
+            "type": "array",
+            "items": {"type": "object", "properties": item, "required": list(item)},
+        },
+        **prediction,
+    }
+    return {
+        "name": CROP_TOOL,
+        "description": "Record crop recommendations for the location, best first.",
+        "input_schema": {"type": "object", "properties": properties, "required": list(properties)},
+    }
+
+
+def tool_input(response, name):
+    """Input of the ``name`` tool_use block of a Messages response, or None"""
+    for block in response.content:
+        if getattr(block, 'type', None) == 'tool_use' and block.name == name:
+            return block.input
+    return None
+
+
+def response_text(response):
+    return ''.join(getattr(block, 'text', '') for block in response.content)
+
+
+def soil_fields(values):
+    """Soil tool input as analysis fields (``{"SOIL_TYPE": ..., ...}``)"""
+    return {key: values.get(name) for key, name in SOIL_PROPERTIES.items() if values.get(name) is not None}
+
+
+def image_notes(values, image_count):
+    """Per-photo notes of a multi-image soil tool input, one entry per photo in upload order"""
+    notes = [{"image": i + 1, "soil_type": None, "usable": None, "notes": None} for i in range(image_count)]
+    entries = values.get("images") if isinstance(values, dict) else None
+    for position, entry in enumerate(entries if isinstance(entries, list) else []):
+        if not isinstance(entry, dict):
+            continue
+        index = _coerce({"type": "integer"}, entry.get("image"))
+        index = index - 1 if index is not None and 1 <= index <= image_count else position
+        if index >= image_count:
+            continue
+        notes[index].update(
+            soil_type=soil_vocabulary.soil_type(entry.get("soil_type")),
+            usable=entry.get("usable") if isinstance(entry.get("usable"), bool) else None,
+            notes=entry.get("notes") if isinstance(entry.get("notes"), str) else None,
+        )
+    return notes
+
+
+def _coerce(schema, value):
+    """``value`` as the schema's type, or None when it cannot be"""
+    if value is None:
+        return None
+    kind = schema.get("type")
+    if kind in ("integer", "number"):
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, str):
+            match = _NUMBER.search(value.replace(',', ''))
+            value = float(match.group()) if match else None
+        if not isinstance(value, (int, float)):
+            return None
+        return int(round(value)) if kind == "integer" else value
+    if kind == "array":
+        if isinstance(value, list):
+            return [item if isinstance(item, str) else json.dumps(item) for item in value]
+        if isinstance(value, dict):
+            return [f"{k}: {v}" for k, v in value.items()]
+        return [str(value)]
+    text = value if isinstance(value, str) else json.dumps(value)
+    if schema.get("format") == "date":
+        try:
+            return date.fromisoformat(text[:10]).isoformat()
+        except ValueError:
+            return None
+    if "enum" in schema:
+        return next((option for option in schema["enum"] if option.lower() == text.strip().lower()), None)
+    return text
+
+
+def crop_plan(values, shortlist=None):
+    """Validate crop tool input.
+
+    Returns ``(plan, problems)``: ``plan`` has every schema key with values
+    coerced to their type (None where that was impossible) and only the
+    recommendations that name a crop; ``problems`` lists what was fixed up.
+    """
+    if not isinstance(values, dict):
+        return None, ["not an object"]
+    schema = crop_tool(shortlist)["input_schema"]["properties"]
+    item_schema = schema["recommendations"]["items"]["properties"]
+    problems = []
+
+    def clean(source, schemas, prefix=''):
+        cleaned = {}
+        for name, field_schema in schemas.items():
+            cleaned[name] = _coerce(field_schema, source.get(name))
+            if cleaned[name] is None:
+                problems.append(f"{prefix}{name}:{'missing' if source.get(name) is None else 'invalid'}")
+        return cleaned
+
+    probability = values.get("success_probability")
+    if isinstance(probability, float) and 0 < probability < 1:
+        # A fraction where a percentage was asked for
+        values = dict(values, success_probability=probability * 100)
+    plan = clean(values, {name: s for name, s in schema.items() if name != "recommendations"})
+    recommendations = []
+    for i, rec in enumerate(values.get("recommendations") or []):
+        if not isinstance(rec, dict) or not rec.get("crop_name"):
+            problems.append(f"recommendations[{i}]:dropped")
+            continue
+        rec = clean(rec, item_schema, f"recommendations[{i}].")
+        if rec["crop_name"] is None:
+            problems.append(f"recommendations[{i}]:dropped")
+            continue
+        if rec["suitability_score"] is not None:
+            rec["suitability_score"] = max(0, min(100, rec["suitability_score"]))
+        recommendations.append(rec)
+    if not recommendations:
+        return None, problems + ["recommendations:missing"]
+    plan["recommendations"] = recommendations
+    return plan, problems
@@ -0,0 +1,222 @@
+"""Deterministic crop ranking used before (or instead of) asking Claude.
+
+Each crop in ``CROPS`` is scored against the soil fields of the analysis,
+the soil type's reference row and the 7-day agro features of the location.
+Ranking the whole table takes well under a millisecond, so ``mode=fast``
+can answer immediately and ``mode=shortlist`` only asks Claude to
+elaborate on the top few crops.
+"""
+import json
+import re
+from datetime import date, timedelta
+from app.services import soil_vocabulary
+
+
+class Crop:
+    def __init__(self, name, category, soils, temp, water, drainage, season, fertility, days, places=()):
+        self.name = name
+        self.category = category
+        self.soils = soils          # soil types it does well on
+        self.temp = temp            # optimal mean temperature range, C
+        self.water = water          # water need, mm per week
+        self.drainage = drainage    # 'wet' (tolerates waterlogging), 'well' or 'any'
+        self.season = season        # 'rainy', 'dry' or 'any'
+        self.fertility = fertility  # 'high', 'medium' or 'low' requirement
+        self.days = days            # planting to first harvest
+        self.places = places        # preferred SOIL_LOCATION_TYPE values, empty = no preference
+
+
+CROPS = [
+    Crop("Rice", "Cereal", ("Alluvial Soil", "Grumosol Soil", "Gleysol Soil", "Latosol Soil"), (22, 32), (35, 200), 'wet', 'rainy', 'medium', 110, ("plain", "valley", "riverbank")),
+    Crop("Corn", "Cereal", ("Alluvial Soil", "Latosol Soil", "Grumosol Soil", "Mediterranean Soil", "Rendzina Soil", "Andosol Soil"), (20, 32), (20, 60), 'well', 'any', 'medium', 100),
+    Crop("Soybean", "Legume", ("Alluvial Soil", "Grumosol Soil", "Rendzina Soil", "Latosol Soil"), (22, 32), (15, 50), 'well', 'dry', 'medium', 85, ("plain",)),
+    Crop("Peanut", "Legume", ("Regosol Soil", "Mediterranean Soil", "Rendzina Soil", "Latosol Soil"), (22, 33), (10, 40), 'well', 'dry', 'low', 100),
+    Crop("Mung Bean", "Legume", ("Alluvial Soil", "Regosol Soil", "Grumosol Soil"), (24, 34), (8, 35), 'well', 'dry', 'low', 65, ("plain",)),
+    Crop("Cassava", "Tuber", ("Latosol Soil", "Podzolic Soil", "Regosol Soil", "Lithosol Soil", "Laterite Soil", "Mediterranean Soil", "Rendzina Soil"), (22, 33), (10, 80), 'well', 'any', 'low', 270),
+    Crop("Sweet Potato", "Tuber", ("Regosol Soil", "Latosol Soil", "Alluvial Soil", "Andosol Soil"), (20, 30), (15, 50), 'well', 'any', 'low', 120),
+    Crop("Taro", "Tuber", ("Gleysol Soil", "Alluvial Soil", "Organosol Soil"), (21, 30), (30, 150), 'wet', 'rainy', 'medium', 200, ("valley", "riverbank")),
+    Crop("Potato", "Tuber", ("Andosol Soil",), (15, 22), (20, 50), 'well', 'any', 'high', 100, ("slope", "hill", "plateau")),
+    Crop("Chili", "Vegetable", ("Andosol Soil", "Alluvial Soil", "Latosol Soil", "Regosol Soil"), (18, 30), (15, 45), 'well', 'dry', 'high', 110),
+    Crop("Shallot", "Vegetable", ("Alluvial Soil", "Regosol Soil", "Grumosol Soil"), (24, 32), (10, 35), 'well', 'dry', 'high', 65, ("plain", "coastal")),
+    Crop("Tomato", "Vegetable", ("Andosol Soil", "Latosol Soil", "Alluvial Soil"), (18, 28), (15, 40), 'well', 'dry', 'high', 90),
+    Crop("Cabbage", "Vegetable", ("Andosol Soil",), (15, 24), (20, 50), 'well', 'any', 'high', 90, ("slope", "hill", "plateau")),
+    Crop("Banana", "Fruit", ("Alluvial Soil", "Latosol Soil", "Andosol Soil", "Grumosol Soil"), (24, 32), (25, 80), 'well', 'any', 'medium', 365),
+    Crop("Pineapple", "Fruit", ("Podzolic Soil", "Latosol Soil", "Organosol Soil", "Laterite Soil"), (22, 32), (10, 50), 'well', 'any', 'low', 540),
+    Crop("Sugarcane", "Plantation", ("Grumosol Soil", "Alluvial Soil", "Latosol Soil", "Mediterranean Soil"), (24, 34), (25, 80), 'well', 'rainy', 'medium', 365, ("plain",)),
+    Crop("Coffee", "Plantation", ("Andosol Soil", "Latosol Soil"), (18, 26), (25, 60), 'well', 'any', 'medium', 1095, ("slope", "hill", "plateau")),
+    Crop("Cocoa", "Plantation", ("Latosol Soil", "Alluvial Soil", "Andosol Soil"), (22, 32), (30, 70), 'well', 'any', 'high', 1095),
+    Crop("Oil Palm", "Plantation", ("Podzolic Soil", "Latosol Soil", "Alluvial Soil", "Organosol Soil", "Laterite Soil"), (24, 33), (35, 100), 'any', 'rainy', 'medium', 1095, ("plain",)),
+    Crop("Coconut", "Plantation", ("Regosol Soil", "Alluvial Soil"), (24, 33), (25, 80), 'any', 'any', 'low', 2190, ("coastal", "plain")),
+    Crop("Cashew", "Plantation", ("Lithosol Soil", "Laterite Soil", "Mediterranean Soil", "Regosol Soil"), (24, 35), (5, 40), 'well', 'dry', 'low', 1095),
+    Crop("Tea", "Plantation", ("Andosol Soil", "Latosol Soil"), (14, 25), (30, 80), 'well', 'rainy', 'medium', 1095, ("slope", "hill", "plateau")),
+]
+
+WEIGHTS = {'soil': 25, 'temperature': 20, 'water': 20, 'drainage': 15, 'season': 10, 'fertility': 5, 'location': 5}
+
+_SOIL_LINE = re.compile(r"^\s*([A-Z_]+):\s*(.*?)\s*$")
+
+
+def parse_soil_fields(soil_text):
+    """``SOIL_TYPE: ...`` style analysis text as {'type': ..., 'texture': ..., ...}, values lowercased"""
+    fields = {}
+    for line in (soil_text or '').splitlines():
+        match = _SOIL_LINE.match(line)
+        if match and match.group(2):
+            key = match.group(1).lower()
+            fields[key[5:] if key.startswith('soil_') else key] = match.group(2).strip().lower()
+    if 'type' in fields:
+        fields['type'] = (soil_vocabulary.soil_type(fields['type']) or fields['type']).lower()
+    return fields
+
+
+def _reference_crops(reference):
+    if reference is None or not reference.suitable_crops:
+        return set()
+    return {name.strip().lower() for name in re.split(r"[,;\n]", reference.suitable_crops) if name.strip()}
+
+
+def _range_score(value, low, high, slack):
+    """1 inside [low, high], falling linearly to 0 at ``slack`` outside it"""
+    if value is None:
+        return 0.7
+    if value < low:
+        return max(0.0, 1.0 - (low - value) / slack)
+    if value > high:
+        return max(0.0, 1.0 - (value - high) / slack)
+    return 1.0
+
+
+def _weekly_water(features, soil):
+    rain = features.get('rain_total_mm')
+    if rain is None:
+        return None
+    moisture = soil.get('moisture', '')
+    if 'waterlogged' in moisture or moisture == 'wet':
+        rain += 20
+    elif 'dry' in moisture:
+        rain -= 10
+    return max(rain, 0.0)
+
+
+def _drainage_score(crop, drainage):
+    if not drainage:
+        return 0.7
+    wet = 'poor' in drainage or 'waterlogged' in drainage
+    if crop.drainage == 'wet':
+        return 1.0 if wet else 0.6
+    if crop.drainage == 'well':
+        if wet:
+            return 0.2
+        return 0.8 if 'moderate' in drainage else 1.0
+    return 0.9
+
+
+def _season_score(crop, season):
+    if crop.season == 'any' or not season:
+        return 0.8
+    return 1.0 if crop.season in season.lower() else 0.4
+
+
+def _fertility_score(crop, fertility):
+    if not fertility:
+        return 0.7
+    low = 'low' in fertility
+    very_low = 'very low' in fertility
+    if crop.fertility == 'high':
+        return 0.3 if low else (0.7 if 'medium' in fertility else 1.0)
+    if crop.fertility == 'medium':
+        return 0.6 if very_low else 1.0
+    return 1.0
+
+
+def score_crop(crop, soil, features, season=None, reference_crops=frozenset()):
+    """(score 0-100, reasons) for one crop"""
+    reasons = []
+    soil_type = soil.get('type', '')
+    if crop.name.lower() in reference_crops:
+        parts = {'soil': 1.0}
+        reasons.append(f"listed for {soil_type.title()}")
+    elif soil_type:
+        in_list = any(soil_type == name.lower() for name in crop.soils)
+        parts = {'soil': 1.0 if in_list else 0.2}
+        if in_list:
+            reasons.append(f"suits {soil_type.title()}")
+    else:
+        parts = {'soil': 0.5}
+
+    temp = features.get('temp_mean')
+    parts['temperature'] = _range_score(temp, crop.temp[0], crop.temp[1], 6.0)
+    if temp is not None and features.get('temp_max_48h') is not None and features['temp_max_48h'] > crop.temp[1] + 6:
+        parts['temperature'] *= 0.8
+        reasons.append("heat stress risk")
+    water = _weekly_water(features, soil)
+    parts['water'] = _range_score(water, crop.water[0], crop.water[1], max(crop.water[0], 20.0))
+    if water is not None and water < crop.water[0]:
+        reasons.append("needs irrigation")
+    elif water is not None and water > crop.water[1]:
+        reasons.append("too wet this week")
+    parts['drainage'] = _drainage_score(crop, soil.get('drainage'))
+    parts['season'] = _season_score(crop, season)
+    if parts['season'] == 1.0:
+        reasons.append(f"{crop.season} season crop")
+    parts['fertility'] = _fertility_score(crop, soil.get('fertility'))
+    place = soil.get('location_type')
+    parts['location'] = 1.0 if not crop.places or (place and place in crop.places) else (0.7 if not place else 0.5)
+    score = sum(WEIGHTS[name] * value for name, value in parts.items())
+    return round(score), reasons
+
+
+def _level(score):
+    if score >= 75:
+        return "High"
+    if score >= 55:
+        return "Medium"
+    return "Low"
+
+
+def rank(soil_text, features, season=None, reference=None, limit=None, today=None):
+    """Crops ranked best first as recommendation dicts (name, category, score, level, dates, reasons)"""
+    soil = parse_soil_fields(soil_text)
+    reference_crops = _reference_crops(reference)
+    today = today or date.today()
+    scored = []
+    for crop in CROPS:
+        score, reasons = score_crop(crop, soil, features, season, reference_crops)
+        scored.append((score, crop, reasons))
+    scored.sort(key=lambda item: (-item[0], item[1].name))
+    return [
+        {
+            "crop_name": crop.name,
+            "crop_category": crop.category,
+            "suitability_score": score,
+            "suitability_level": _level(score),
+            "best_planting_date": today.isoformat(),
+            "expected_harvest_date": (today + timedelta(days=crop.days)).isoformat(),
+            "reasons": reasons
+        }
+        for score, crop, reasons in scored[:limit]
+    ]
+
+
+def fast_result(weather_data, ranking, soil_data=None):
+    """The local ranking in the shape ClaudeService.get_crop_recommendations returns"""
+    plan = {"recommendations": ranking}
+    if ranking:
+        plan["best_planting_date"] = ranking[0]["best_planting_date"]
+        plan["expected_harvest_date"] = ranking[0]["expected_harvest_date"]
+    result = {
+        "success": True,
+        "mode": "fast",
+        # Same shapes as ClaudeService._crop_result
+        "recommendations": json.dumps(plan),
+        "structured": plan,
+        "validation_problems": [],
+        "location": weather_data['location'],
+        "weather_summary": weather_data['current'],
+        "forecast_summary": weather_data.get('daily_forecast', [])[:3],
+        "alerts": weather_data.get('alerts', []),
+        "usage": {"input_tokens": 0, "output_tokens": 0}
+    }
+    if soil_data and soil_data.get("success"):
+        result["soil_analysis"] = soil_data['soil_analysis']
+    return result
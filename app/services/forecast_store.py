@@ -0,0 +1,206 @@
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from sqlalchemy import func, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from app.extensions import db
+from models.forecast_points import ForecastPoint
+
+
+def tile_id(lat, lon, degrees=None):
+    """Grid tile holding (lat, lon); plots in the same tile share one forecast"""
+    if degrees is None:
+        degrees = current_app.config.get('FORECAST_TILE_DEGREES', 0.1)
+    row = round(float(lat) / degrees)
+    col = round(float(lon) / degrees)
+    return f"{row * degrees:.2f}:{col * degrees:.2f}"
+
+
+def _utc(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+
+def issued_at(weather_result):
+    """Forecast issue time: the observation hour of the One Call response"""
+    epoch = weather_result.get('issued_at')
+    issued = _utc(epoch) if epoch else datetime.now(timezone.utc).replace(tzinfo=None)
+    return issued.replace(minute=0, second=0, microsecond=0)
+
+
+def _rows(tile, issued, weather_result):
+    rows = []
+    for day in weather_result.get('daily_forecast', []):
+        temperature = day.get('temperature', {})
+        rows.append({
+            "tile_id": tile, "series": 'daily', "issued_at": issued, "forecast_at": _utc(day['date']),
+            "temperature": temperature.get('day'),
+            "temperature_min": temperature.get('min'),
+            "temperature_max": temperature.get('max'),
+            "humidity": day.get('humidity'),
+            "pressure": day.get('pressure'),
+            "wind_speed": day.get('wind_speed'),
+            "clouds": day.get('clouds'),
+            "pop": day.get('pop'),
+            "rain_mm": day.get('rain', 0),
+            "snow_mm": day.get('snow', 0),
+            "weather_main": day.get('weather_main'),
+        })
+    for hour in weather_result.get('hourly_forecast', []):
+        rows.append({
+            "tile_id": tile, "series": 'hourly', "issued_at": issued, "forecast_at": _utc(hour['datetime']),
+            "temperature": hour.get('temperature'),
+            "temperature_min": None,
+            "temperature_max": None,
+            "humidity": hour.get('humidity'),
+            "pressure": hour.get('pressure'),
+            "wind_speed": hour.get('wind_speed'),
+            "clouds": hour.get('clouds'),
+            "pop": hour.get('pop'),
+            "rain_mm": hour.get('rain_1h', 0),
+            "snow_mm": hour.get('snow_1h', 0),
+            "weather_main": hour.get('weather_main'),
+        })
+    return rows
+
+
+def _insert_ignoring_duplicates(rows):
+    dialect = db.session.get_bind(ForecastPoint.__mapper__).dialect.name
+    if dialect == 'postgresql':
+        stmt = postgresql.insert(ForecastPoint).on_conflict_do_nothing()
+    elif dialect == 'sqlite':
+        stmt = sqlite.insert(ForecastPoint).on_conflict_do_nothing()
+    else:
+        stmt = db.insert(ForecastPoint)
+    db.session.execute(stmt, rows)
+
+
+def store(weather_result, lat, lon):
+    """Write the forecast for (lat, lon) once per tile and issue.
+
+    Returns ``(tile_id, issued_at)`` for WeatherData to reference. Nothing is
+    written when this tile already has the issue; a concurrent writer of the
+    same issue is absorbed by the primary key.
+    """
+    tile = tile_id(lat, lon)
+    issued = issued_at(weather_result)
+    exists = db.session.query(ForecastPoint.issued_at).filter_by(
+        tile_id=tile, series='daily', issued_at=issued).first()
+    if exists is None:
+        rows = _rows(tile, issued, weather_result)
+        if rows:
+            _insert_ignoring_duplicates(rows)
+    return tile, issued
+
+
+def _legacy_daily(point):
+    # The shape forecast_7days had when it was stored as a JSON blob
+    return {
+        "date": int(point.forecast_at.replace(tzinfo=timezone.utc).timestamp()),
+        "temperature": {"min": point.temperature_min, "max": point.temperature_max, "day": point.temperature},
+        "humidity": point.humidity,
+        "pressure": point.pressure,
+        "wind_speed": point.wind_speed,
+        "weather_main": point.weather_main,
+        "clouds": point.clouds,
+        "pop": point.pop,
+        "rain": point.rain_mm,
+        "snow": point.snow_mm
+    }
+
+
+def daily_forecasts(keys):
+    """{(tile_id, issued_at): [daily dicts]} for many WeatherData rows in one query"""
+    keys = {key for key in keys if key[0] and key[1]}
+    if not keys:
+        return {}
+    points = ForecastPoint.query.filter(
+        ForecastPoint.series == 'daily',
+        tuple_(ForecastPoint.tile_id, ForecastPoint.issued_at).in_(list(keys))
+    ).order_by(ForecastPoint.tile_id, ForecastPoint.issued_at, ForecastPoint.forecast_at).all()
+    forecasts = {}
+    for point in points:
+        forecasts.setdefault((point.tile_id, point.issued_at), []).append(_legacy_daily(point))
+    return forecasts
+
+
+def _latest_issues(tiles):
+    """Subquery of (tile_id, issued_at) for each tile's most recent forecast issue"""
+    return db.session.query(
+        ForecastPoint.tile_id, func.max(ForecastPoint.issued_at).label('issued_at')
+    ).filter(
+        ForecastPoint.tile_id.in_(tiles), ForecastPoint.series == 'daily'
+    ).group_by(ForecastPoint.tile_id).subquery()
+
+
+def _hourly(point):
+    # The hourly_forecast entry shape of get_weather_data()
+    return {
+        "datetime": int(point.forecast_at.replace(tzinfo=timezone.utc).timestamp()),
+        "temperature": point.temperature,
+        "humidity": point.humidity,
+        "pressure": point.pressure,
+        "wind_speed": point.wind_speed,
+        "weather_main": point.weather_main,
+        "clouds": point.clouds,
+        "pop": point.pop,
+        "rain_1h": point.rain_mm,
+        "snow_1h": point.snow_mm
+    }
+
+
+def latest_series(tiles):
+    """{tile_id: {"issued_at", "daily", "hourly"}} from each tile's latest issue, in one query.
+
+    The daily and hourly entries have the shapes get_weather_data() returns.
+    """
+    tiles = list(set(tiles))
+    if not tiles:
+        return {}
+    latest = _latest_issues(tiles)
+    points = ForecastPoint.query.join(
+        latest, (ForecastPoint.tile_id == latest.c.tile_id) & (ForecastPoint.issued_at == latest.c.issued_at)
+    ).order_by(ForecastPoint.tile_id, ForecastPoint.series, ForecastPoint.forecast_at).all()
+    series = {}
+    for point in points:
+        entry = series.setdefault(point.tile_id, {"issued_at": point.issued_at.isoformat(), "daily": [], "hourly": []})
+        if point.series == 'daily':
+            entry["daily"].append(_legacy_daily(point))
+        else:
+            entry["hourly"].append(_hourly(point))
+    return series
+
+
+def rain_outlook(tiles, days=7, now=None):
+    """Forecast rain per tile over the next ``days`` days from each tile's latest issue.
+
+    Returns ``{tile_id: {"issued_at", "rain_mm", "max_pop", "days"}}``; tiles
+    without a stored forecast are left out.
+    """
+    tiles = list(set(tiles))
+    if not tiles:
+        return {}
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = start + timedelta(days=days)
+    latest = _latest_issues(tiles)
+    totals = db.session.query(
+        ForecastPoint.tile_id,
+        ForecastPoint.issued_at,
+        func.sum(ForecastPoint.rain_mm),
+        func.max(ForecastPoint.pop),
+        func.count()
+    ).join(
+        latest, (ForecastPoint.tile_id == latest.c.tile_id) & (ForecastPoint.issued_at == latest.c.issued_at)
+    ).filter(
+        ForecastPoint.series == 'daily',
+        ForecastPoint.forecast_at >= start,
+        ForecastPoint.forecast_at < end
+    ).group_by(ForecastPoint.tile_id, ForecastPoint.issued_at).all()
+    return {
+        tile: {
+            "issued_at": issued.isoformat(),
+            "rain_mm": round(rain or 0, 2),
+            "max_pop": max_pop,
+            "days": count
+        }
+        for tile, issued, rain, max_pop, count in totals
+    }
@@ -0,0 +1,137 @@
+"""Thumbnail and medium WebP copies of uploaded soil photos.
+
+History screens show a card per analysis, so they should not download the
+original camera photo for each one. Every photo gets two derivatives next to
+the original in the uploads folder, ``<name>.w<size>.webp`` for each size in
+PHOTO_DERIVATIVE_SIZES, and their filenames are recorded on the SoilPhoto
+row through the write-behind queue.
+
+Derivatives are made on a small thread pool: /soil/analyze schedules them
+after saving the photo, and the /user/* endpoints schedule them for older
+photos that have none yet (returning null URLs until they exist), so no
+request thread ever resizes an image.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app import uploads
+from app.metrics import metrics
+
+KINDS = ('thumbnail', 'medium')
+
+generated = metrics.counter('photo_derivatives_total', 'Soil photo derivative jobs by outcome', ['outcome'])
+
+
+def derivative_name(filename, size):
+    base = filename.rsplit('.', 1)[0]
+    return f"{base}.w{size}.webp"
+
+
+def render(source, target_path, size, quality):
+    """Write a WebP no larger than ``size`` px on its longest side; ``source`` is a path or binary file"""
+    # Imported here: Pillow is only needed once a derivative is made
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        # JPEG decodes at a reduced scale directly
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image.thumbnail((size, size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    temp_path = f"{target_path}.{os.getpid()}.tmp"
+    image.save(temp_path, 'WEBP', quality=quality, method=4)
+    os.replace(temp_path, target_path)
+
+
+class PhotoDerivatives:
+    """Background pool that makes and records the derivatives of a SoilPhoto."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._executor = None
+        self._pid = None
+        self._pending = set()
+        self._unavailable = set()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('PHOTO_DERIVATIVES_ENABLED', True)
+        self.workers = app.config.get('PHOTO_DERIVATIVE_WORKERS', 2)
+        self.max_pending = app.config.get('PHOTO_DERIVATIVE_MAX_PENDING', 500)
+        self.sizes = dict(zip(KINDS, app.config.get('PHOTO_DERIVATIVE_SIZES', [160, 800])))
+        self.quality = app.config.get('PHOTO_DERIVATIVE_QUALITY', 75)
+        app.extensions['photo_derivatives'] = self
+
+    def _ensure_executor(self):
+        with self._lock:
+            # A forked worker inherits neither the threads nor the pending set
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pending = set()
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='photo-derivatives')
+        return self._executor
+
+    def schedule(self, photo):
+        """Queue derivatives for a SoilPhoto that is missing any; returns False if it was not queued"""
+        if not self.enabled or not photo.photo_filename or not self.missing(photo):
+            return False
+        if photo.id in self._unavailable:
+            return False
+        executor = self._ensure_executor()
+        with self._lock:
+            if photo.id in self._pending:
+                return True
+            if len(self._pending) >= self.max_pending:
+                # Photos left out now are scheduled again the next time they are listed
+                generated.inc(outcome='dropped')
+                return False
+            self._pending.add(photo.id)
+        executor.submit(self._run, photo.id, photo.photo_filename)
+        return True
+
+    def missing(self, photo):
+        return [kind for kind in KINDS if getattr(photo, f"{kind}_filename") is None]
+
+    def urls(self, photo):
+        """``{"thumbnail_url": ..., "medium_url": ...}``, scheduling whatever is missing"""
+        self.schedule(photo)
+        return {f"{kind}_url": uploads.url(getattr(photo, f"{kind}_filename")) for kind in KINDS}
+
+    def make(self, filename):
+        """Write the derivatives of an uploaded photo; returns ``{kind: filename}``"""
+        names = {}
+        for kind, size in self.sizes.items():
+            name = derivative_name(filename, size)
+            target_path = uploads.path(name)
+            if not os.path.exists(target_path):
+                # The original may be in the archive tier by now
+                with uploads.open_upload(filename) as source:
+                    render(source, target_path, size, self.quality)
+            names[kind] = name
+        return names
+
+    def _run(self, photo_id, filename):
+        from models.soil_photos import SoilPhoto
+        from app.write_behind import write_behind
+        try:
+            with self.app.app_context():
+                names = self.make(filename)
+                write_behind.enqueue(SoilPhoto, photo_id, **{f"{kind}_filename": name for kind, name in names.items()})
+            generated.inc(outcome='created')
+        except FileNotFoundError:
+            # Not retried by this process; the original is gone
+            self._unavailable.add(photo_id)
+            generated.inc(outcome='missing_original')
+        except Exception as e:
+            generated.inc(outcome='error')
+            print(f"Photo derivatives for {filename} failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.discard(photo_id)
+
+
+photo_derivatives = PhotoDerivatives()
@@ -0,0 +1,159 @@
+"""Dense, deterministic text encoding of the crop recommendation context.
+
+The same inputs always give the same text: values are rounded to the
+precision that matters agronomically, dates are rendered in the location's
+own timezone and the daily forecast is a header plus one pipe-separated row
+per day instead of a Python ``repr`` of the service dicts.
+"""
+import re
+from datetime import datetime, timezone
+
+# Claude's tokenizer splits numbers into runs of up to three digits, keeps most
+# short words whole and gives punctuation its own token
+_TOKEN_PATTERN = re.compile(r"\d{1,3}|[A-Za-z]{1,10}|[^\sA-Za-z\d]")
+
+
+def estimate_tokens(text):
+    """Rough input-token estimate for ``text`` without calling the API"""
+    return len(_TOKEN_PATTERN.findall(text or ''))
+
+
+def _num(value, digits=1):
+    if value is None:
+        return '-'
+    text = f"{float(value):.{digits}f}"
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+
+def _local(epoch, offset, fmt):
+    return datetime.fromtimestamp(epoch + offset, timezone.utc).strftime(fmt)
+
+
+def encode_current(current):
+    parts = [
+        f"T{_num(current.get('temperature'))}C",
+        f"feels{_num(current.get('feels_like'))}C",
+        f"RH{_num(current.get('humidity'), 0)}%",
+        f"P{_num(current.get('pressure'), 0)}hPa",
+        f"wind{_num(current.get('wind_speed'))}m/s",
+        f"cloud{_num(current.get('clouds'), 0)}%",
+        f"UV{_num(current.get('uv_index'))}",
+    ]
+    if current.get('rain_1h'):
+        parts.append(f"rain{_num(current['rain_1h'])}mm/h")
+    parts.append(current.get('weather', ''))
+    return ' '.join(parts)
+
+
+def encode_daily(daily, offset=0, days=7):
+    rows = ["date|tmin|tmax|pop%|rain_mm|RH%|wind|sky"]
+    for day in daily[:days]:
+        temperature = day.get('temperature', {})
+        rows.append('|'.join([
+            _local(day['date'], offset, '%m-%d'),
+            _num(temperature.get('min')),
+            _num(temperature.get('max')),
+            _num(day.get('pop'), 0),
+            _num(day.get('rain', 0)),
+            _num(day.get('humidity'), 0),
+            _num(day.get('wind_speed')),
+            day.get('weather_main') or day.get('weather', ''),
+        ]))
+    return '\n'.join(rows)
+
+
+def encode_hourly(hourly, features, offset=0):
+    """One line for the next 48h: temperature range, peak wind, rain total and heavy-rain hours"""
+    if not hourly:
+        return "none"
+    from app.services import agro_features
+    heavy = [_local(int(epoch), offset, '%d %Hh') for epoch in agro_features.heavy_rain_times(hourly)]
+    line = (f"T{_num(features.get('temp_min_48h'))}-{_num(features.get('temp_max_48h'))}C "
+            f"windmax{_num(features.get('wind_max_48h'))}m/s rain{_num(features.get('rain_48h_mm'))}mm "
+            f"heavy_rain_hours={len(heavy)}")
+    if heavy:
+        line += f" first:{','.join(heavy[:3])}"
+    return line
+
+
+def encode_agro(features):
+    """Derived 7-day indicators from agro_features"""
+    parts = [
+        f"gdd={_num(features.get('gdd'), 0)}",
+        f"rain={_num(features.get('rain_total_mm'))}mm",
+        f"rain_days={_num(features.get('rain_days'), 0)}",
+        f"dry_spell={_num(features.get('longest_dry_spell_days'), 0)}d",
+        f"et0={_num(features.get('et0_mm'))}mm",
+        f"balance={_num(features.get('water_balance_mm'))}mm",
+    ]
+    if features.get('heat_stress_hours') is not None:
+        parts.append(f"heat_stress={_num(features['heat_stress_hours'], 0)}h")
+    return ' '.join(parts)
+
+
+def encode_alerts(alerts):
+    return '; '.join(f"{a['event']}: {(a.get('description') or '')[:100]}" for a in alerts) or "none"
+
+
+def encode_history(history):
+    """Same-week history: summary dicts from get_historical_weather, or preformatted text"""
+    if not history:
+        return None
+    if isinstance(history, str):
+        return history.replace('\n', '; ')
+    parts = []
+    for entry in history:
+        if 'error' in entry:
+            parts.append(f"{entry['year']}:n/a")
+        else:
+            parts.append(f"{entry['year']}:{_num(entry.get('temp'))}C,rain{_num(entry.get('rain'))}mm,{entry.get('weather')}")
+    return '; '.join(parts)
+
+
+_SOIL_LINE = re.compile(r"^\s*(?:SOIL_)?([A-Z_]+):\s*(.*?)\s*$")
+
+
+def encode_soil(soil_text):
+    """``KEY: value`` soil analysis lines as ``key=value;...``; free text is passed through"""
+    if not soil_text:
+        return None
+    fields = []
+    for line in soil_text.splitlines():
+        match = _SOIL_LINE.match(line)
+        if match and match.group(2):
+            fields.append(f"{match.group(1).lower()}={match.group(2)}")
+    if not fields:
+        return ' '.join(soil_text.split())
+    return ';'.join(fields)
+
+
+def encode_crop_context(weather_data, soil_text=None, season=None):
+    """Weather, forecast, alerts, history and soil for the crop prompt"""
+    location = weather_data['location']
+    offset = weather_data.get('timezone_offset', 0)
+    name = location['name']
+    if location.get('country') and not name.endswith(location['country']):
+        name = f"{name}, {location['country']}"
+    features = weather_data.get('agro_features')
+    if features is None:
+        # Imported here: NumPy is only needed once a prompt is built
+        from app.services import agro_features
+        features = agro_features.from_weather(weather_data)
+    lines = [
+        f"loc={name} lat={_num(location['lat'], 3)} lon={_num(location['lon'], 3)} "
+        f"tz={weather_data.get('timezone', 'UTC')}" + (f" season={season}" if season else ''),
+        f"now: {encode_current(weather_data['current'])}",
+        f"daily:\n{encode_daily(weather_data.get('daily_forecast', []), offset)}",
+        f"48h: {encode_hourly(weather_data.get('hourly_forecast', []), features, offset)}",
+        f"7d: {encode_agro(features)}",
+        f"alerts: {encode_alerts(weather_data.get('alerts', []))}",
+    ]
+    history = encode_history(weather_data.get('history'))
+    if history:
+        lines.append(f"history(same day, past years): {history}")
+    soil = encode_soil(soil_text)
+    if soil:
+        lines.append(f"soil: {soil}")
+    return '\n'.join(lines)
@@ -0,0 +1,230 @@
+"""CPU-only nearest-neighbour soil pre-classifier.
+
+Each photo is reduced to a small descriptor: HSV histograms (hue 16 bins,
+saturation and value 8 bins each, square-rooted so Euclidean distance is the
+Hellinger distance) plus a few grey-level texture statistics. Descriptors of
+historical photos whose soil type is known are kept in memory, and a new
+photo gets the distance-weighted vote of its k nearest neighbours.
+
+The labels come from SoilPhoto rows: the soil type the user confirmed on
+/soil/submit when the photo is linked to a SoilAnalysis, otherwise the
+SOIL_TYPE of the vision model's analysis. Photos that were themselves
+classified here are only used once a user has confirmed them, so the index
+never learns from its own guesses.
+"""
+import os
+import threading
+import time
+
+from app import uploads
+from app.metrics import metrics
+from app.services import soil_vocabulary
+
+METHOD = "nearest-neighbour"
+
+decisions = metrics.counter('soil_classifier_decisions_total', 'Soil photos by pre-classifier outcome', ['outcome'])
+confidence_summary = metrics.summary('soil_classifier_confidence', 'Pre-classifier confidence of the winning soil type')
+
+_SIZE = (96, 96)
+_BINS = {'h': 16, 's': 8, 'v': 8}
+
+
+def describe(image_path):
+    """Descriptor vector of one photo (float32 NumPy array)"""
+    # Imported here: Pillow and NumPy are only needed once a photo is classified
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    with Image.open(image_path) as image:
+        # JPEG decodes at a reduced scale directly, which is most of the saving
+        image.draft('RGB', (_SIZE[0] * 2, _SIZE[1] * 2))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image = ImageOps.fit(image, _SIZE)
+    hsv = np.asarray(image.convert('HSV'), dtype=np.float32)
+    grey = np.asarray(image.convert('L'), dtype=np.float32) / 255.0
+
+    parts = []
+    for channel, bins in enumerate(_BINS.values()):
+        hist, _ = np.histogram(hsv[..., channel], bins=bins, range=(0, 256))
+        parts.append(np.sqrt(hist / hist.sum()))
+    dx = np.abs(np.diff(grey, axis=1))
+    dy = np.abs(np.diff(grey, axis=0))
+    gradient = np.concatenate([dx.ravel(), dy.ravel()])
+    grey_hist, _ = np.histogram(grey, bins=16, range=(0.0, 1.0))
+    p = grey_hist[grey_hist > 0] / grey.size
+    texture = np.array([
+        grey.mean(),
+        grey.std() * 2.0,
+        gradient.mean() * 4.0,
+        gradient.std() * 4.0,
+        np.mean(gradient > 0.1),                 # edge density: clods, gravel, roots
+        -np.sum(p * np.log2(p)) / 4.0,           # grey-level entropy, 0..1
+    ])
+    return np.concatenate(parts + [texture]).astype(np.float32)
+
+
+class SoilClassifier:
+    """In-memory k-NN index over labelled SoilPhoto descriptors.
+
+    The index is built on a background thread the first time it is needed
+    and rebuilt every SOIL_CLASSIFIER_REFRESH seconds; until it is ready
+    ``classify`` returns None and callers fall back to the vision model.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._vectors = None
+        self._labels = []
+        self._analyses = []
+        self._built_at = None
+        self._building = False
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('SOIL_CLASSIFIER_ENABLED', True)
+        self.k = app.config.get('SOIL_CLASSIFIER_K', 5)
+        self.min_confidence = app.config.get('SOIL_CLASSIFIER_MIN_CONFIDENCE', 0.8)
+        self.max_distance = app.config.get('SOIL_CLASSIFIER_MAX_DISTANCE', 0.35)
+        self.min_photos = app.config.get('SOIL_CLASSIFIER_MIN_PHOTOS', 30)
+        self.max_photos = app.config.get('SOIL_CLASSIFIER_MAX_PHOTOS', 5000)
+        self.refresh = app.config.get('SOIL_CLASSIFIER_REFRESH', 3600)
+        app.extensions['soil_classifier'] = self
+
+    def _labelled_photos(self):
+        from models.soil_photos import SoilPhoto
+        from models.soil_analyses import SoilAnalysis
+        from app.db_routing import replica_reads
+        with replica_reads():
+            rows = SoilPhoto.query.outerjoin(SoilAnalysis, SoilPhoto.soil_analysis_id == SoilAnalysis.id).with_entities(
+                SoilPhoto.photo_filename, SoilPhoto.analysis_result, SoilAnalysis.classified_soil_type
+            ).filter(SoilPhoto.photo_filename.isnot(None), SoilPhoto.analysis_result.isnot(None)).order_by(
+                SoilPhoto.created_at.desc()
+            ).limit(self.max_photos).all()
+        for filename, analysis, confirmed in rows:
+            if not isinstance(analysis, str):
+                continue
+            if confirmed is None and soil_vocabulary.field(analysis, 'CLASSIFICATION_METHOD') == METHOD:
+                continue
+            label = soil_vocabulary.soil_type(confirmed or soil_vocabulary.field(analysis, 'SOIL_TYPE'))
+            if label:
+                yield filename, label, analysis
+
+    def build(self):
+        """Describe every labelled photo still on disk and swap the new index in"""
+        import numpy as np
+        started = time.perf_counter()
+        vectors, labels, analyses = [], [], []
+        for filename, label, analysis in self._labelled_photos():
+            path = uploads.path(filename)
+            if not os.path.exists(path):
+                continue
+            try:
+                vectors.append(describe(path))
+            except Exception as e:
+                print(f"Soil classifier could not read {filename}: {str(e)}")
+                continue
+            labels.append(label)
+            analyses.append(analysis)
+        with self._lock:
+            self._vectors = np.vstack(vectors) if vectors else None
+            self._labels = labels
+            self._analyses = analyses
+            self._built_at = time.monotonic()
+        print(f"Soil classifier index: {len(labels)} photos in {time.perf_counter() - started:.1f}s")
+
+    def _build_in_background(self):
+        app = self.app
+
+        def run():
+            try:
+                with app.app_context():
+                    self.build()
+            except Exception as e:
+                print(f"Soil classifier index build failed: {str(e)}")
+            finally:
+                self._building = False
+
+        threading.Thread(target=run, name='soil-classifier-index', daemon=True).start()
+
+    def _ensure_index(self):
+        stale = self._built_at is None or time.monotonic() - self._built_at > self.refresh
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked worker builds its own index
+                self._pid = os.getpid()
+                self._building = False
+                stale = True
+            if not stale or self._building:
+                return
+            self._building = True
+        self._build_in_background()
+
+    def add(self, image_path, label, analysis):
+        """Add a freshly labelled photo without waiting for the next rebuild"""
+        if not self.enabled or self._vectors is None:
+            return
+        import numpy as np
+        try:
+            vector = describe(image_path)
+        except Exception as e:
+            print(f"Soil classifier could not read {image_path}: {str(e)}")
+            return
+        with self._lock:
+            self._vectors = np.vstack([self._vectors, vector])
+            self._labels = self._labels + [label]
+            self._analyses = self._analyses + [analysis]
+
+    def classify(self, image_path):
+        """Nearest-neighbour guess for a photo.
+
+        Returns ``{"soil_type", "confidence", "neighbours", "soil_analysis"}``
+        or None when the classifier is disabled or its index is not ready.
+        ``confidence`` is the share of the k neighbours' inverse-distance
+        weight that agrees; neighbours further than SOIL_CLASSIFIER_MAX_DISTANCE
+        do not vote, so a photo unlike anything seen before scores near 0.
+        """
+        if not self.enabled:
+            return None
+        self._ensure_index()
+        with self._lock:
+            vectors, labels, analyses = self._vectors, self._labels, self._analyses
+        if vectors is None or len(labels) < self.min_photos:
+            return None
+        import numpy as np
+        query = describe(image_path)
+        distances = np.sqrt(np.sum((vectors - query) ** 2, axis=1))
+        k = min(self.k, len(labels))
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        votes = {}
+        for i in nearest:
+            if distances[i] <= self.max_distance:
+                votes[labels[i]] = votes.get(labels[i], 0.0) + 1.0 / (distances[i] + 1e-3)
+        total = sum(1.0 / (distances[i] + 1e-3) for i in nearest)
+        if not votes:
+            return {"soil_type": labels[nearest[0]], "confidence": 0.0, "neighbours": k, "soil_analysis": None}
+        soil_type = max(votes, key=votes.get)
+        best = next(i for i in nearest if labels[i] == soil_type)
+        confidence = round(float(votes[soil_type] / total), 3)
+        confidence_summary.observe(confidence)
+        return {
+            "soil_type": soil_type,
+            "confidence": confidence,
+            "neighbours": k,
+            "nearest_distance": round(float(distances[best]), 4),
+            # The closest agreeing photo's analysis stands in for the other fields
+            "soil_analysis": soil_vocabulary.with_fields(analyses[best], SOIL_TYPE=soil_type, CONFIDENCE=confidence,
+                                          CLASSIFICATION_METHOD=METHOD),
+        }
+
+    def accept(self, result):
+        """Whether a ``classify`` result is confident enough to skip the vision model"""
+        return result is not None and result['soil_analysis'] is not None and result['confidence'] >= self.min_confidence
+
+
+soil_classifier = SoilClassifier()
@@ -0,0 +1,127 @@
+"""Closed vocabularies of the soil analysis fields.
+
+The soil image prompt, the validation of model output and of user-edited
+analyses, and the crop shortlist all read these lists, so they cannot drift
+apart (the prompt once offered "Grumusol Soil" while the routes only accepted
+"Grumosol Soil").
+"""
+import re
+
+SOIL_TYPES = [
+    "Alluvial Soil", "Andosol Soil", "Regosol Soil", "Latosol Soil", "Podzolic Soil", "Grumosol Soil",
+    "Organosol Soil", "Lithosol Soil", "Mediterranean Soil", "Rendzina Soil", "Laterite Soil", "Gleysol Soil"
+]
+
+# Analysis line key -> allowed values, in prompt order
+FIELDS = {
+    "SOIL_TYPE": SOIL_TYPES,
+    "SOIL_COLOR": ["Brown", "Dark Brown", "Reddish", "Yellowish", "Black", "Gray"],
+    "SOIL_TEXTURE": ["Sandy", "Silty", "Clayey", "Loamy", "Peaty", "Gravelly"],
+    "SOIL_DRAINAGE": ["Well-drained", "Poorly-drained", "Moderately-drained", "Excessively-drained", "Waterlogged"],
+    "SOIL_LOCATION_TYPE": ["Valley", "Slope", "Plain", "Hill", "Riverbank", "Coastal", "Plateau"],
+    "SOIL_FERTILITY": ["High", "Medium", "Low", "Very Low"],
+    "SOIL_MOISTURE": ["Wet", "Moist", "Dry", "Very Dry", "Waterlogged"],
+}
+
+CONFIDENCE_LEVELS = ["High", "Medium", "Low"]
+
+UNKNOWN = "Unknown"
+
+# Other spellings seen in model output and older rows
+ALIASES = {
+    "grumusol soil": "Grumosol Soil",
+    "grumusol": "Grumosol Soil",
+    "grey": "Gray",
+}
+
+_LINE = re.compile(r"^\s*([A-Z_]+):\s*(.*?)\s*$", re.MULTILINE)
+
+
+def canonical(key, value):
+    """The vocabulary spelling of ``value`` for analysis line ``key``, or None if it is not in it"""
+    if value is None:
+        return None
+    text = ' '.join(str(value).strip().strip('[]*').split())
+    allowed = FIELDS.get(key, CONFIDENCE_LEVELS if key == "CONFIDENCE" else [])
+    for option in allowed:
+        if text.lower() == option.lower():
+            return option
+    alias = ALIASES.get(text.lower())
+    if alias in allowed:
+        return alias
+    # "Latosol" for "Latosol Soil"
+    if key == "SOIL_TYPE" and f"{text} soil".lower() in {option.lower() for option in allowed}:
+        return next(option for option in allowed if option.lower() == f"{text} soil".lower())
+    return None
+
+
+def soil_type(value):
+    return canonical("SOIL_TYPE", value)
+
+
+def field(text, key):
+    """Value of the ``KEY: value`` line in an analysis text, or None"""
+    for name, value in _LINE.findall(text or ''):
+        if name == key:
+            return value
+    return None
+
+
+def fields(text):
+    """All ``KEY: value`` lines of an analysis text as a dict"""
+    return {name: value for name, value in _LINE.findall(text or '')}
+
+
+def with_fields(text, **values):
+    """``text`` with the given ``KEY: value`` lines replaced in place or appended"""
+    lines, missing = [], dict(values)
+    for line in (text or '').strip().splitlines():
+        match = _LINE.match(line)
+        if match and match.group(1) in values:
+            line = f"{match.group(1)}: {missing.pop(match.group(1), values[match.group(1)])}"
+        lines.append(line)
+    return '\n'.join(lines + [f"{key}: {value}" for key, value in missing.items()])
+
+
+def review_fields(found, low_confidence=("Low",)):
+    """Check analysis fields (``{"SOIL_TYPE": ..., ...}``) against the vocabularies.
+
+    Returns ``(fields, problems)``: ``fields`` with values in their vocabulary
+    spelling, and a list of ``(key, reason)`` with reason 'missing' (no value,
+    or SOIL_TYPE left Unknown), 'out_of_vocabulary' or 'low_confidence'
+    (CONFIDENCE in ``low_confidence``). Other fields may be Unknown, as the
+    prompt allows.
+    """
+    normalized, problems = dict(found), []
+    for key in FIELDS:
+        value = found.get(key)
+        if not value or (key == "SOIL_TYPE" and value.lower() == UNKNOWN.lower()):
+            problems.append((key, 'missing'))
+        elif value.lower() != UNKNOWN.lower():
+            spelled = canonical(key, value)
+            if spelled is None:
+                problems.append((key, 'out_of_vocabulary'))
+            else:
+                normalized[key] = spelled
+    confidence = canonical("CONFIDENCE", found.get("CONFIDENCE"))
+    if confidence is None:
+        problems.append(("CONFIDENCE", 'missing'))
+    else:
+        normalized["CONFIDENCE"] = confidence
+        if confidence in low_confidence:
+            problems.append(("CONFIDENCE", 'low_confidence'))
+    return normalized, problems
+
+
+def review(text, low_confidence=("Low",)):
+    """``review_fields`` for an analysis text; returns ``(normalized_text, problems)``"""
+    found = fields(text)
+    normalized, problems = review_fields(found, low_confidence)
+    changed = {key: value for key, value in normalized.items() if found.get(key) != value}
+    return (with_fields(text, **changed) if changed else text), problems
+
+
+def render(values):
+    """Analysis fields as the ``KEY: value`` text stored and shown everywhere else"""
+    return '\n'.join(f"{key}: {value}" for key, value in values.items() if value is not None)
+
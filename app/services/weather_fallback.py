@@ -0,0 +1,94 @@
+"""Last known weather for when OpenWeather cannot be reached.
+
+``last_known`` builds a ``get_weather_data()``-shaped result from the most
+recent WeatherData row of the request's forecast tile, or of one of the eight
+tiles around it, that is younger than WEATHER_FALLBACK_MAX_AGE_HOURS. The
+forecast comes from that tile's latest issue in forecast_points, with the
+days and hours already past dropped.
+
+The result carries ``degraded: True``, the reason, ``weather_as_of`` and
+``weather_age_seconds``, plus ``weather_data_id`` so callers reference the
+existing row instead of storing the stale values again as if fresh.
+"""
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from app.services import forecast_store
+from models.weather_data import WeatherData
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def _nearby_tiles(lat, lon):
+    """{tile_id: ring} for the tile of (lat, lon) (ring 0) and its neighbours (ring 1)"""
+    degrees = current_app.config.get('FORECAST_TILE_DEGREES', 0.1)
+    tiles = {}
+    for d_lat in (-1, 0, 1):
+        for d_lon in (-1, 0, 1):
+            tile = forecast_store.tile_id(lat + d_lat * degrees, lon + d_lon * degrees, degrees)
+            tiles[tile] = min(tiles.get(tile, 1), max(abs(d_lat), abs(d_lon)))
+    return tiles
+
+
+def _nearest_row(lat, lon, max_age):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    tiles = _nearby_tiles(lat, lon)
+    rows = WeatherData.query.filter(
+        WeatherData.forecast_tile_id.in_(list(tiles)),
+        WeatherData.fetched_at >= now - max_age,
+        WeatherData.current_temperature.isnot(None)
+    ).order_by(WeatherData.fetched_at.desc()).limit(50).all()
+    if not rows:
+        return None, now
+    # Same tile before a neighbour, then the newest
+    return min(rows, key=lambda row: (tiles[row.forecast_tile_id], now - _naive(row.fetched_at))), now
+
+
+def _naive(moment):
+    return moment.astimezone(timezone.utc).replace(tzinfo=None) if moment.tzinfo else moment
+
+
+def last_known(lat, lon, reason):
+    """Degraded weather result for (lat, lon), or None when nothing recent enough is stored"""
+    max_age = timedelta(hours=current_app.config.get('WEATHER_FALLBACK_MAX_AGE_HOURS', 6))
+    if max_age <= timedelta(0):
+        return None
+    row, now = _nearest_row(lat, lon, max_age)
+    if row is None:
+        return None
+    fetched = _naive(row.fetched_at)
+    series = forecast_store.latest_series([row.forecast_tile_id]).get(row.forecast_tile_id, {})
+    now_epoch = int(now.replace(tzinfo=timezone.utc).timestamp())
+    today_epoch = now_epoch - now_epoch % 86400
+    current = {
+        "temperature": _float(row.current_temperature),
+        "humidity": row.current_humidity,
+        "pressure": _float(row.current_pressure),
+        "wind_speed": _float(row.current_wind_speed),
+        "rain_1h": _float(row.current_rainfall) or 0,
+    }
+    alerts = [{"event": event.strip()} for event in (row.weather_warnings or '').split(';') if event.strip()]
+    return {
+        "success": True,
+        "degraded": True,
+        "degraded_reason": reason,
+        "weather_data_id": str(row.id),
+        "weather_as_of": fetched.isoformat(),
+        "weather_age_seconds": int((now - fetched).total_seconds()),
+        "location": {
+            "name": f"Location ({lat}, {lon})",
+            "country": "Unknown",
+            "state": "Unknown",
+            "city": "Unknown",
+            "lat": lat,
+            "lon": lon
+        },
+        "current": current,
+        "daily_forecast": [day for day in series.get("daily", []) if day["date"] >= today_epoch],
+        "hourly_forecast": [hour for hour in series.get("hourly", []) if hour["datetime"] >= now_epoch],
+        "alerts": alerts,
+        "issued_at": int(row.forecast_issued_at.replace(tzinfo=timezone.utc).timestamp()) if row.forecast_issued_at else None,
+        "timezone": "UTC",
+        "timezone_offset": 0
+    }
@@ -1,21 +1,51 @@
+import os
+from urllib.parse import urlparse
 import requests
 from flask import current_app
+from app import deadline
+from app.cache import service_cache
+from app.circuit_breaker import CircuitOpen, breaker, counts_as_failure
+from app.deadline import DeadlineExceeded
+from app.services import forecast_store
+from app.timing import span
+
+_session = None
+_session_pid = None
+
+def http_session():
+    """Process-wide requests session, so sync calls reuse keep-alive connections"""
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        _session, _session_pid = session, os.getpid()
+    return _session
 
 class WeatherService:
-    def __init__(self):
-        self.base_url = "https://api.openweathermap.org"
+    @property
+    def base_url(self):
+        return current_app.config.get('OPENWEATHER_BASE_URL', "https://api.openweathermap.org")
+
+    @property
+    def ip_services(self):
         # Multiple IP geolocation services for better reliability
-        self.ip_services = [
+        config = current_app.config
+        return [
             {
-                "url": "http://ip-api.com/json",
+                "url": config.get('IP_API_URL', "http://ip-api.com/json"),
+                "ip_in_path": True,
                 "parser": self._parse_ip_api
             },
             {
-                "url": "https://ipapi.co/json/",
+                "url": config.get('IPAPI_CO_URL', "https://ipapi.co/json/"),
+                "ip_in_path": False,
                 "parser": self._parse_ipapi_co
             },
             {
-                "url": "https://freegeoip.app/json/",
+                "url": config.get('FREEGEOIP_URL', "https://freegeoip.app/json/"),
+                "ip_in_path": False,
                 "parser": self._parse_freegeoip
             }
         ]
@@ -106,26 +136,24 @@ class WeatherService:
         # Try each IP geolocation service
         for service in self.ip_services:
             try:
-                if user_ip:
-                    url = f"{service['url']}/{user_ip}" if 'ip-api.com' in service['url'] else service['url']
-                    params = {} if 'ip-api.com' in service['url'] else {'ip': user_ip}
-                else:
-                    url = service['url']
-                    params = {}
-                
-                response = requests.get(url, params=params, timeout=5)
-                response.raise_for_status()
-                data = response.json()
+                url, params = self._ip_service_request(service, user_ip)
+                data = self._get_json(url, params=params, timeout=5, stage='ip_geo', upstream=self._ip_upstream(service),
+                                      cache_key=self._ip_cache_key(service, user_ip), cache_ttl=current_app.config.get('IP_GEO_CACHE_TTL', 3600))
                 
                 result = service['parser'](data)
                 if result:
                     return result
                     
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 print(f"IP service {service['url']} failed: {str(e)}")
                 continue
         
         # If all services fail, return default coordinates (you can customize this)
+        return self._location_unavailable()
+
+    def _location_unavailable(self):
         return {
             "success": False,
             "error": "Unable to determine location from IP",
@@ -140,40 +168,119 @@ class WeatherService:
             raise ValueError("OPENWEATHER_API_KEY not configured")
         return api_key
 
-    def _get_location_name(self, lat, lon):
-        """Get location name using OpenWeather Geocoding API"""
+    def _breaker(self, upstream):
+        """Circuit breaker guarding ``upstream``; raises CircuitOpen while it is open"""
+        if not upstream or not current_app.config.get('CIRCUIT_BREAKER_ENABLED', True):
+            return None
+        guard = breaker(upstream)
+        guard.before_call()
+        return guard
+
+    def _call_failed(self, guard, error, shortened=False):
+        if guard is None:
+            return
+        # A timeout cut short by the request deadline says nothing about the upstream
+        if counts_as_failure(error) and not (shortened and 'Timeout' in type(error).__name__):
+            guard.record_failure()
+        else:
+            guard.release()
+
+    def _get_json(self, url, params=None, timeout=10, stage='http', upstream=None, cache_key=None, cache_ttl=None):
+        """GET a JSON document, raising on HTTP errors (CircuitOpen while ``upstream`` is down).
+
+        ``timeout`` is capped to the request's remaining deadline. With a
+        ``cache_key`` the answer is shared through the service cache (under
+        the ``stage`` namespace) for ``cache_ttl`` seconds.
+        """
+        if cache_key is not None:
+            return service_cache.get_or_compute(stage, cache_key, cache_ttl,
+                                                lambda: self._fetch_json(url, params, timeout, stage, upstream))
+        return self._fetch_json(url, params, timeout, stage, upstream)
+
+    def _fetch_json(self, url, params, timeout, stage, upstream):
+        limit = deadline.timeout(timeout, stage)
+        guard = self._breaker(upstream)
         try:
-            api_key = self._get_api_key()
-            params = {
-                'lat': lat,
-                'lon': lon,
-                'limit': 1,
-                'appid': api_key
-            }
-            
-            response = requests.get(f"{self.base_url}/geo/1.0/reverse", params=params, timeout=5)
-            response.raise_for_status()
-            data = response.json()
-            
-            if data:
-                location = data[0]
-                name_parts = []
-                if location.get('name'):
-                    name_parts.append(location['name'])
-                if location.get('state'):
-                    name_parts.append(location['state'])
-                if location.get('country'):
-                    name_parts.append(location['country'])
-                
-                return {
-                    "name": ", ".join(name_parts) if name_parts else f"Location ({lat}, {lon})",
-                    "country": location.get('country', 'Unknown'),
-                    "state": location.get('state', 'Unknown'),
-                    "city": location.get('name', 'Unknown')
-                }
+            with span(stage):
+                response = http_session().get(url, params=params, timeout=limit)
+                response.raise_for_status()
+                data = response.json()
         except Exception as e:
-            print(f"Geocoding failed: {str(e)}")
-        
+            self._call_failed(guard, e, shortened=limit < timeout)
+            raise
+        except BaseException:
+            # Interrupted mid-call: says nothing about the upstream, but a half-open trial must end
+            if guard is not None:
+                guard.release()
+            raise
+        if guard is not None:
+            guard.record_success()
+        return data
+
+    def _ip_cache_key(self, service, user_ip):
+        # Without an IP the services locate the server itself; not worth caching
+        if not user_ip:
+            return None
+        return f"{urlparse(service['url']).netloc}:{user_ip}"
+
+    def _geocode_cache_key(self, lat, lon):
+        return forecast_store.tile_id(lat, lon, current_app.config.get('GEOCODE_CACHE_DEGREES', 0.01))
+
+    def _history_cache_key(self, params):
+        return f"{forecast_store.tile_id(params['lat'], params['lon'])}:{params['dt']}"
+
+    def _ip_upstream(self, service):
+        return f"ip_geo:{urlparse(service['url']).netloc}"
+
+    def _ip_service_request(self, service, user_ip):
+        """Build the (url, params) pair for an IP geolocation service"""
+        if user_ip:
+            url = f"{service['url']}/{user_ip}" if service['ip_in_path'] else service['url']
+            params = {} if service['ip_in_path'] else {'ip': user_ip}
+        else:
+            url = service['url']
+            params = {}
+        return url, params
+
+    def _geocode_params(self, lat, lon):
+        return {
+            'lat': lat,
+            'lon': lon,
+            'limit': 1,
+            'appid': self._get_api_key()
+        }
+
+    def _onecall_params(self, lat, lon):
+        # One Call API 3.0 parameters
+        return {
+            'lat': lat,
+            'lon': lon,
+            'appid': self._get_api_key(),
+            'units': 'metric',  # Celsius, m/s, etc.
+            'exclude': 'minutely',  # Exclude minutely data to reduce response size
+        }
+
+    def _parse_location_name(self, data, lat, lon):
+        """Turn a reverse geocoding response into a location name"""
+        if data:
+            location = data[0]
+            name_parts = []
+            if location.get('name'):
+                name_parts.append(location['name'])
+            if location.get('state'):
+                name_parts.append(location['state'])
+            if location.get('country'):
+                name_parts.append(location['country'])
+            
+            return {
+                "name": ", ".join(name_parts) if name_parts else f"Location ({lat}, {lon})",
+                "country": location.get('country', 'Unknown'),
+                "state": location.get('state', 'Unknown'),
+                "city": location.get('name', 'Unknown')
+            }
+        return self._unknown_location(lat, lon)
+
+    def _unknown_location(self, lat, lon):
         return {
             "name": f"Location ({lat}, {lon})",
             "country": "Unknown",
@@ -181,171 +288,205 @@ class WeatherService:
             "city": "Unknown"
         }
 
+    def _get_location_name(self, lat, lon):
+        """Get location name using OpenWeather Geocoding API"""
+        try:
+            data = self._get_json(f"{self.base_url}/geo/1.0/reverse", params=self._geocode_params(lat, lon), timeout=5, stage='geocode', upstream='openweather_geocode',
+                                  cache_key=self._geocode_cache_key(lat, lon), cache_ttl=current_app.config.get('GEOCODE_CACHE_TTL', 604800))
+            return self._parse_location_name(data, lat, lon)
+        except Exception as e:
+            print(f"Geocoding failed: {str(e)}")
+        return self._unknown_location(lat, lon)
+
     def get_weather_data(self, lat, lon):
         """Get comprehensive weather data using OpenWeather One Call API 3.0"""
         try:
-            api_key = self._get_api_key()
+            self._get_api_key()
             
             # Get location information
             location_info = self._get_location_name(lat, lon)
             
-            # One Call API 3.0 parameters
-            params = {
-                'lat': lat,
-                'lon': lon,
-                'appid': api_key,
-                'units': 'metric',  # Celsius, m/s, etc.
-                'exclude': 'minutely',  # Exclude minutely data to reduce response size
-            }
-            
-            response = requests.get(f"{self.base_url}/data/3.0/onecall", params=params, timeout=10)
-            response.raise_for_status()
-            weather_data = response.json()
-            
-            # Extract current weather
-            current = weather_data['current']
-            current_weather = {
-                "temperature": current['temp'],
-                "feels_like": current['feels_like'],
-                "humidity": current['humidity'],
-                "pressure": current['pressure'],
-                "uv_index": current.get('uvi', 0),
-                "visibility": current.get('visibility', 0) / 1000,  # Convert to km
-                "wind_speed": current['wind_speed'],
-                "wind_direction": current.get('wind_deg', 0),
-                "weather": current['weather'][0]['description'],
-                "weather_main": current['weather'][0]['main'],
-                "clouds": current['clouds'],
-                "sunrise": current['sunrise'],
-                "sunset": current['sunset']
+            weather_data = self._get_json(f"{self.base_url}/data/3.0/onecall", params=self._onecall_params(lat, lon), timeout=10, stage='onecall', upstream='openweather',
+                                          cache_key=forecast_store.tile_id(lat, lon), cache_ttl=current_app.config.get('WEATHER_CACHE_TTL', 600))
+            return self._build_weather_result(weather_data, location_info, lat, lon)
+        except Exception as e:
+            return self._weather_unavailable(lat, lon, e)
+
+    def _weather_unavailable(self, lat, lon, error):
+        """Last known weather near (lat, lon) flagged as degraded, or the error when there is none"""
+        try:
+            from app.services import weather_fallback
+            fallback = weather_fallback.last_known(lat, lon, str(error))
+            if fallback is not None:
+                return fallback
+        except Exception as e:
+            print(f"Weather fallback failed: {str(e)}")
+        result = {
+            "success": False,
+            "error": str(error)
+        }
+        if isinstance(error, DeadlineExceeded):
+            raise error
+        if isinstance(error, CircuitOpen):
+            result["retry_after"] = error.retry_after
+        return result
+
+    def _build_weather_result(self, weather_data, location_info, lat, lon):
+        """Shape a One Call response into the structure used across the app"""
+        # Extract current weather
+        current = weather_data['current']
+        current_weather = {
+            "temperature": current['temp'],
+            "feels_like": current['feels_like'],
+            "humidity": current['humidity'],
+            "pressure": current['pressure'],
+            "uv_index": current.get('uvi', 0),
+            "visibility": current.get('visibility', 0) / 1000,  # Convert to km
+            "wind_speed": current['wind_speed'],
+            "wind_direction": current.get('wind_deg', 0),
+            "weather": current['weather'][0]['description'],
+            "weather_main": current['weather'][0]['main'],
+            "clouds": current['clouds'],
+            "sunrise": current['sunrise'],
+            "sunset": current['sunset']
+        }
+        
+        # Add optional weather data
+        if 'rain' in current:
+            current_weather['rain_1h'] = current['rain'].get('1h', 0)
+        if 'snow' in current:
+            current_weather['snow_1h'] = current['snow'].get('1h', 0)
+        
+        # Extract daily forecast (7 days)
+        daily_forecast = []
+        for day in weather_data.get('daily', [])[:7]:
+            daily_forecast.append({
+                "date": day['dt'],
+                "temperature": {
+                    "min": day['temp']['min'],
+                    "max": day['temp']['max'],
+                    "morning": day['temp']['morn'],
+                    "day": day['temp']['day'],
+                    "evening": day['temp']['eve'],
+                    "night": day['temp']['night']
+                },
+                "humidity": day['humidity'],
+                "pressure": day['pressure'],
+                "wind_speed": day['wind_speed'],
+                "weather": day['weather'][0]['description'],
+                "weather_main": day['weather'][0]['main'],
+                "clouds": day['clouds'],
+                "uv_index": day.get('uvi', 0),
+                "pop": day.get('pop', 0) * 100,  # Probability of precipitation as percentage
+                "rain": day.get('rain', 0),
+                "snow": day.get('snow', 0)
+            })
+        
+        # Extract hourly forecast (48 hours)
+        hourly_forecast = []
+        for hour in weather_data.get('hourly', [])[:48]:
+            hourly_data = {
+                "datetime": hour['dt'],
+                "temperature": hour['temp'],
+                "feels_like": hour['feels_like'],
+                "humidity": hour['humidity'],
+                "pressure": hour['pressure'],
+                "wind_speed": hour['wind_speed'],
+                "wind_direction": hour.get('wind_deg', 0),
+                "weather": hour['weather'][0]['description'],
+                "weather_main": hour['weather'][0]['main'],
+                "clouds": hour['clouds'],
+                "pop": hour.get('pop', 0) * 100  # Probability of precipitation as percentage
             }
             
-            # Add optional weather data
-            if 'rain' in current:
-                current_weather['rain_1h'] = current['rain'].get('1h', 0)
-            if 'snow' in current:
-                current_weather['snow_1h'] = current['snow'].get('1h', 0)
-            
-            # Extract daily forecast (7 days)
-            daily_forecast = []
-            for day in weather_data.get('daily', [])[:7]:
-                daily_forecast.append({
-                    "date": day['dt'],
-                    "temperature": {
-                        "min": day['temp']['min'],
-                        "max": day['temp']['max'],
-                        "morning": day['temp']['morn'],
-                        "day": day['temp']['day'],
-                        "evening": day['temp']['eve'],
-                        "night": day['temp']['night']
-                    },
-                    "humidity": day['humidity'],
-                    "pressure": day['pressure'],
-                    "wind_speed": day['wind_speed'],
-                    "weather": day['weather'][0]['description'],
-                    "weather_main": day['weather'][0]['main'],
-                    "clouds": day['clouds'],
-                    "uv_index": day.get('uvi', 0),
-                    "pop": day.get('pop', 0) * 100,  # Probability of precipitation as percentage
-                    "rain": day.get('rain', 0),
-                    "snow": day.get('snow', 0)
-                })
-            
-            # Extract hourly forecast (48 hours)
-            hourly_forecast = []
-            for hour in weather_data.get('hourly', [])[:48]:
-                hourly_data = {
-                    "datetime": hour['dt'],
-                    "temperature": hour['temp'],
-                    "feels_like": hour['feels_like'],
-                    "humidity": hour['humidity'],
-                    "pressure": hour['pressure'],
-                    "wind_speed": hour['wind_speed'],
-                    "wind_direction": hour.get('wind_deg', 0),
-                    "weather": hour['weather'][0]['description'],
-                    "weather_main": hour['weather'][0]['main'],
-                    "clouds": hour['clouds'],
-                    "pop": hour.get('pop', 0) * 100  # Probability of precipitation as percentage
-                }
+            if 'rain' in hour:
+                hourly_data['rain_1h'] = hour['rain'].get('1h', 0)
+            if 'snow' in hour:
+                hourly_data['snow_1h'] = hour['snow'].get('1h', 0)
                 
-                if 'rain' in hour:
-                    hourly_data['rain_1h'] = hour['rain'].get('1h', 0)
-                if 'snow' in hour:
-                    hourly_data['snow_1h'] = hour['snow'].get('1h', 0)
-                    
-                hourly_forecast.append(hourly_data)
-            
-            # Extract weather alerts if any
-            alerts = []
-            for alert in weather_data.get('alerts', []):
-                alerts.append({
-                    "sender": alert.get('sender_name', 'Unknown'),
-                    "event": alert.get('event', 'Weather Alert'),
-                    "description": alert.get('description', ''),
-                    "start": alert.get('start', 0),
-                    "end": alert.get('end', 0),
-                    "tags": alert.get('tags', [])
-                })
-            
-            return {
-                "success": True,
-                "location": {
-                    "name": location_info["name"],
-                    "country": location_info["country"],
-                    "state": location_info["state"],
-                    "city": location_info["city"],
-                    "lat": lat,
-                    "lon": lon
-                },
-                "current": current_weather,
-                "daily_forecast": daily_forecast,
-                "hourly_forecast": hourly_forecast,
-                "alerts": alerts,
-                "timezone": weather_data.get('timezone', 'UTC'),
-                "timezone_offset": weather_data.get('timezone_offset', 0)
-            }
-        except Exception as e:
-            return {
-                "success": False,
-                "error": str(e)
-            }
+            hourly_forecast.append(hourly_data)
+        
+        # Extract weather alerts if any
+        alerts = []
+        for alert in weather_data.get('alerts', []):
+            alerts.append({
+                "sender": alert.get('sender_name', 'Unknown'),
+                "event": alert.get('event', 'Weather Alert'),
+                "description": alert.get('description', ''),
+                "start": alert.get('start', 0),
+                "end": alert.get('end', 0),
+                "tags": alert.get('tags', [])
+            })
+        
+        return {
+            "success": True,
+            "location": {
+                "name": location_info["name"],
+                "country": location_info["country"],
+                "state": location_info["state"],
+                "city": location_info["city"],
+                "lat": lat,
+                "lon": lon
+            },
+            "current": current_weather,
+            "daily_forecast": daily_forecast,
+            "hourly_forecast": hourly_forecast,
+            "alerts": alerts,
+            "issued_at": current.get('dt'),
+            "timezone": weather_data.get('timezone', 'UTC'),
+            "timezone_offset": weather_data.get('timezone_offset', 0)
+        }
 
-    def get_historical_weather_summary(self, lat, lon, years=3):
-        """Fetch and summarize historical weather for the same week in previous years using One Call API 3.0 (paid)."""
-        import time, datetime
+    def _historical_requests(self, lat, lon, years):
+        """Timemachine (year, params) pairs for the same day in previous years"""
+        import datetime
         api_key = self._get_api_key()
-        base_url = f"{self.base_url}/data/3.0/onecall/timemachine"
         now = datetime.datetime.utcnow()
-        summaries = []
+        calls = []
         for y in range(1, years+1):
             dt = int((now - datetime.timedelta(days=365*y)).replace(hour=12, minute=0, second=0, microsecond=0).timestamp())
-            params = {
+            calls.append((now.year - y, {
                 'lat': lat,
                 'lon': lon,
                 'dt': dt,
                 'appid': api_key,
                 'units': 'metric',
-            }
-            try:
-                resp = requests.get(base_url, params=params, timeout=10)
-                resp.raise_for_status()
-                data = resp.json()
-                temp = data['data'][0]['temp'] if 'data' in data and data['data'] else None
-                weather = data['data'][0]['weather'][0]['description'] if 'data' in data and data['data'] else None
-                rain = data['data'][0].get('rain', {}).get('1h', 0) if 'data' in data and data['data'] else 0
-                summaries.append({
-                    'year': now.year - y,
-                    'temp': temp,
-                    'weather': weather,
-                    'rain': rain
-                })
-            except Exception as e:
-                summaries.append({'year': now.year - y, 'error': str(e)})
-        # Summarize
+            }))
+        return calls
+
+    def _parse_historical(self, year, data):
+        temp = data['data'][0]['temp'] if 'data' in data and data['data'] else None
+        weather = data['data'][0]['weather'][0]['description'] if 'data' in data and data['data'] else None
+        rain = data['data'][0].get('rain', {}).get('1h', 0) if 'data' in data and data['data'] else 0
+        return {
+            'year': year,
+            'temp': temp,
+            'weather': weather,
+            'rain': rain
+        }
+
+    def _format_historical(self, summaries):
         summary_lines = []
         for s in summaries:
             if 'error' in s:
                 summary_lines.append(f"{s['year']}: Data unavailable ({s['error']})")
             else:
                 summary_lines.append(f"{s['year']}: {s['weather']}, {s['temp']}°C, rain: {s['rain']}mm")
-        return '\n'.join(summary_lines)
\ No newline at end of file
+        return '\n'.join(summary_lines)
+
+    def get_historical_weather(self, lat, lon, years=3):
+        """Weather at midday on this date in each of the previous ``years`` years (One Call 3.0 timemachine, paid)."""
+        base_url = f"{self.base_url}/data/3.0/onecall/timemachine"
+        summaries = []
+        for year, params in self._historical_requests(lat, lon, years):
+            try:
+                data = self._get_json(base_url, params=params, timeout=10, stage='timemachine', upstream='openweather',
+                                      cache_key=self._history_cache_key(params), cache_ttl=current_app.config.get('HISTORY_CACHE_TTL', 604800))
+                summaries.append(self._parse_historical(year, data))
+            except Exception as e:
+                summaries.append({'year': year, 'error': str(e)})
+        return summaries
+
+    def get_historical_weather_summary(self, lat, lon, years=3):
+        """Fetch and summarize historical weather for the same week in previous years using One Call API 3.0 (paid)."""
+        return self._format_historical(self.get_historical_weather(lat, lon, years))
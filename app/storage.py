@@ -0,0 +1,349 @@
+"""Lifecycle of the uploads folder: usage report, orphan sweeper and archive tier.
+
+A sweep does three things, each in batches of STORAGE_SWEEP_BATCH rows:
+
+1. Unlinked SoilPhoto rows older than STORAGE_UNLINKED_RETENTION_HOURS
+   (analyzed but never submitted) are deleted, together with their files
+   unless another row still uses the same content-hashed file.
+2. Files in the uploads folder that no row refers to -- leftovers of failed
+   requests, interrupted writes and deleted rows -- are deleted once they
+   are older than STORAGE_ORPHAN_GRACE_SECONDS, so an upload that is still
+   being processed is never touched.
+3. With STORAGE_ARCHIVE_AFTER_DAYS set, originals of linked photos older
+   than that are gzipped into UPLOAD_ARCHIVE_FOLDER (which can sit on a
+   cheaper volume) and removed from the hot folder. Their derivatives stay,
+   so the history screens never read from the archive.
+
+Sweeps run from ``flask storage sweep`` and, with STORAGE_SWEEP_INTERVAL
+set, on a background thread in every worker. An exclusive lock file in the
+uploads folder lets only one process sweep at a time.
+"""
+import fcntl
+import gzip
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask.cli import AppGroup
+
+from app import uploads
+from app.extensions import db
+from app.metrics import metrics
+
+LOCK_FILE = '.storage-sweep.lock'
+
+_DERIVATIVE = re.compile(r"^(?P<base>.+)\.w\d+\.webp$")
+_TEMPORARY = re.compile(r"^\.upload-|\.tmp$")
+
+swept = metrics.counter('storage_swept_files_total', 'Files removed or archived by the storage sweeper', ['action'])
+swept_bytes = metrics.counter('storage_swept_bytes_total', 'Bytes freed in the uploads folder by the storage sweeper', ['action'])
+sweep_seconds = metrics.summary('storage_sweep_seconds', 'Duration of storage sweeps')
+tier_bytes = metrics.gauge('storage_bytes', 'Bytes in upload storage at the last report', ['tier'])
+
+
+def _utcnow():
+    # created_at is stored naive (UTC) by SQLite and aware by PostgreSQL
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _base(filename):
+    """Name without extension; a derivative is ``<base of its original>.w<size>.webp``"""
+    match = _DERIVATIVE.match(filename)
+    return match.group('base') if match else filename.rsplit('.', 1)[0]
+
+
+def _file_kind(filename):
+    if filename == LOCK_FILE:
+        return None
+    if _TEMPORARY.search(filename):
+        return 'temporary'
+    if _DERIVATIVE.match(filename):
+        return 'derivative'
+    return 'original'
+
+
+def _scan(directory):
+    """(name, size, mtime) of the regular files directly in ``directory``"""
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        if entry.is_file(follow_symlinks=False):
+            stat = entry.stat(follow_symlinks=False)
+            yield entry.name, stat.st_size, stat.st_mtime
+
+
+def _remove(file_path):
+    """Delete a file; returns the bytes freed (0 if it was already gone)"""
+    try:
+        size = os.path.getsize(file_path)
+        os.remove(file_path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+class StorageLifecycle:
+    """Disk report, retention sweeps and archiving for uploaded photos."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.unlinked_retention = timedelta(hours=app.config.get('STORAGE_UNLINKED_RETENTION_HOURS', 48))
+        self.orphan_grace = app.config.get('STORAGE_ORPHAN_GRACE_SECONDS', 3600)
+        archive_days = app.config.get('STORAGE_ARCHIVE_AFTER_DAYS', 0)
+        self.archive_after = timedelta(days=archive_days) if archive_days else None
+        self.batch_size = app.config.get('STORAGE_SWEEP_BATCH', 500)
+        self.interval = app.config.get('STORAGE_SWEEP_INTERVAL', 0)
+        if self.interval:
+            app.before_request(self._ensure_scheduler)
+        app.cli.add_command(storage_cli)
+        app.extensions['storage'] = self
+
+    # Report
+
+    def report(self):
+        """Files and bytes per tier and kind, plus unlinked rows and free disk space"""
+        from models.soil_photos import SoilPhoto
+        hot_folder = uploads.folder()
+        referenced = self._referenced()
+        referenced_bases = {_base(name) for name in referenced}
+        tiers = {'hot': {}, 'archive': {}}
+        now = time.time()
+        for name, size, mtime in _scan(hot_folder):
+            kind = _file_kind(name)
+            if kind is None:
+                continue
+            if kind == 'original' and name not in referenced:
+                kind = 'orphan'
+            elif kind == 'derivative' and _base(name) not in referenced_bases:
+                kind = 'orphan'
+            entry = tiers['hot'].setdefault(kind, {'files': 0, 'bytes': 0, 'oldest_days': 0.0})
+            entry['files'] += 1
+            entry['bytes'] += size
+            entry['oldest_days'] = max(entry['oldest_days'], round((now - mtime) / 86400, 1))
+        for name, size, mtime in _scan(uploads.archive_folder()):
+            entry = tiers['archive'].setdefault('original', {'files': 0, 'bytes': 0, 'oldest_days': 0.0})
+            entry['files'] += 1
+            entry['bytes'] += size
+            entry['oldest_days'] = max(entry['oldest_days'], round((now - mtime) / 86400, 1))
+        cutoff = _utcnow() - self.unlinked_retention
+        unlinked = SoilPhoto.query.filter(SoilPhoto.soil_analysis_id.is_(None))
+        result = {
+            'folders': {'hot': hot_folder, 'archive': uploads.archive_folder()},
+            'tiers': tiers,
+            'rows': {
+                'photos': SoilPhoto.query.count(),
+                'unlinked': unlinked.count(),
+                'unlinked_expired': unlinked.filter(SoilPhoto.created_at < cutoff).count(),
+            },
+        }
+        if os.path.isdir(hot_folder):
+            usage = shutil.disk_usage(hot_folder)
+            result['disk'] = {'total_bytes': usage.total, 'free_bytes': usage.free}
+        for tier, kinds in tiers.items():
+            tier_bytes.set(sum(entry['bytes'] for entry in kinds.values()), tier=tier)
+        return result
+
+    # Sweep
+
+    def _referenced(self):
+        from models.soil_photos import SoilPhoto
+        rows = db.session.query(SoilPhoto.photo_filename).filter(SoilPhoto.photo_filename.isnot(None)).distinct()
+        return {filename for (filename,) in rows}
+
+    def _delete_files(self, filename, dry_run):
+        """Delete an original and its derivatives from both tiers; returns (files, bytes)"""
+        from app.services.photo_derivatives import derivative_name, photo_derivatives
+        files = freed = 0
+        candidates = [uploads.path(filename), uploads.archive_path(filename)]
+        # Derivatives of sizes no longer configured are left to sweep_orphans
+        candidates += [uploads.path(derivative_name(filename, size)) for size in photo_derivatives.sizes.values()]
+        for file_path in candidates:
+            if os.path.exists(file_path):
+                files += 1
+                freed += os.path.getsize(file_path) if dry_run else _remove(file_path)
+        return files, freed
+
+    def sweep_unlinked(self, dry_run=False):
+        """Delete unlinked photo rows past retention, and their files once no row uses them"""
+        from models.soil_photos import SoilPhoto
+        cutoff = _utcnow() - self.unlinked_retention
+        rows = files = freed = 0
+        last_created, last_id = None, None
+        while True:
+            query = SoilPhoto.query.filter(SoilPhoto.soil_analysis_id.is_(None), SoilPhoto.created_at < cutoff)
+            if dry_run and last_created is not None:
+                # Nothing is deleted, so page past what was already counted
+                query = query.filter(db.or_(SoilPhoto.created_at > last_created,
+                                            db.and_(SoilPhoto.created_at == last_created, SoilPhoto.id > last_id)))
+            batch = query.order_by(SoilPhoto.created_at, SoilPhoto.id).limit(self.batch_size).all()
+            if not batch:
+                break
+            last_created, last_id = batch[-1].created_at, batch[-1].id
+            filenames = {photo.photo_filename for photo in batch if photo.photo_filename}
+            rows += len(batch)
+            if not dry_run:
+                # Guarded again on soil_analysis_id in case a submit linked one meanwhile
+                SoilPhoto.query.filter(SoilPhoto.id.in_([photo.id for photo in batch]),
+                                       SoilPhoto.soil_analysis_id.is_(None)).delete(synchronize_session=False)
+                db.session.commit()
+            still_used = {
+                filename for (filename,) in db.session.query(SoilPhoto.photo_filename).filter(
+                    SoilPhoto.photo_filename.in_(filenames),
+                    SoilPhoto.id.notin_([photo.id for photo in batch])).distinct()
+            }
+            for filename in filenames - still_used:
+                removed, size = self._delete_files(filename, dry_run)
+                files += removed
+                freed += size
+            if len(batch) < self.batch_size:
+                break
+        if not dry_run:
+            swept.inc(files, action='unlinked')
+            swept_bytes.inc(freed, action='unlinked')
+        return {'rows': rows, 'files': files, 'bytes': freed}
+
+    def sweep_orphans(self, dry_run=False):
+        """Delete files in the uploads folder that no row refers to, once past the grace period"""
+        referenced = self._referenced()
+        referenced_bases = {_base(name) for name in referenced}
+        cutoff = time.time() - self.orphan_grace
+        files = freed = 0
+        for name, size, mtime in _scan(uploads.folder()):
+            kind = _file_kind(name)
+            if kind is None or mtime > cutoff:
+                continue
+            if kind == 'original' and name in referenced:
+                continue
+            if kind == 'derivative' and _base(name) in referenced_bases:
+                continue
+            files += 1
+            freed += size if dry_run else _remove(uploads.path(name))
+        if not dry_run:
+            swept.inc(files, action='orphan')
+            swept_bytes.inc(freed, action='orphan')
+        return {'files': files, 'bytes': freed}
+
+    def archive(self, dry_run=False):
+        """Gzip originals of linked photos older than STORAGE_ARCHIVE_AFTER_DAYS into the archive tier"""
+        from models.soil_photos import SoilPhoto
+        if self.archive_after is None:
+            return {'files': 0, 'bytes': 0, 'archived_bytes': 0}
+        cutoff = _utcnow() - self.archive_after
+        files = freed = stored = 0
+        last_created, last_id = None, None
+        os.makedirs(uploads.archive_folder(), exist_ok=True)
+        while True:
+            query = db.session.query(SoilPhoto.created_at, SoilPhoto.id, SoilPhoto.photo_filename).filter(
+                SoilPhoto.soil_analysis_id.isnot(None), SoilPhoto.photo_filename.isnot(None),
+                SoilPhoto.created_at < cutoff)
+            if last_created is not None:
+                query = query.filter(db.or_(SoilPhoto.created_at > last_created,
+                                            db.and_(SoilPhoto.created_at == last_created, SoilPhoto.id > last_id)))
+            batch = query.order_by(SoilPhoto.created_at, SoilPhoto.id).limit(self.batch_size).all()
+            if not batch:
+                break
+            last_created, last_id = batch[-1].created_at, batch[-1].id
+            for _, _, filename in batch:
+                source = uploads.path(filename)
+                if not os.path.exists(source):
+                    continue
+                files += 1
+                if dry_run:
+                    freed += os.path.getsize(source)
+                    continue
+                target = uploads.archive_path(filename)
+                temp_path = f"{target}.{os.getpid()}.tmp"
+                with open(source, 'rb') as src, gzip.open(temp_path, 'wb', compresslevel=6) as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                os.replace(temp_path, target)
+                stored += os.path.getsize(target)
+                freed += _remove(source)
+            if len(batch) < self.batch_size:
+                break
+        if not dry_run:
+            swept.inc(files, action='archive')
+            swept_bytes.inc(freed, action='archive')
+        return {'files': files, 'bytes': freed, 'archived_bytes': stored}
+
+    def sweep(self, dry_run=False, archive=True):
+        """One full sweep under the lock file; returns None if another process holds it"""
+        os.makedirs(uploads.folder(), exist_ok=True)
+        with open(os.path.join(uploads.folder(), LOCK_FILE), 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            started = time.perf_counter()
+            try:
+                result = {
+                    'dry_run': dry_run,
+                    'unlinked': self.sweep_unlinked(dry_run),
+                    'orphans': self.sweep_orphans(dry_run),
+                    'archive': self.archive(dry_run) if archive else None,
+                }
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+            result['seconds'] = round(time.perf_counter() - started, 3)
+            if not dry_run:
+                sweep_seconds.observe(result['seconds'])
+            return result
+
+    # Periodic job
+
+    def _ensure_scheduler(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            # A forked worker inherits no thread
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='storage-sweeper', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    result = self.sweep()
+                if result is not None:
+                    print(f"Storage sweep: {json.dumps(result)}")
+            except Exception as e:
+                print(f"Storage sweep failed: {str(e)}")
+
+
+storage = StorageLifecycle()
+
+storage_cli = AppGroup('storage', help='Uploaded photo storage: usage report and sweeps.')
+
+
+@storage_cli.command('report')
+def report_command():
+    """Print disk usage of the uploads and archive tiers as JSON."""
+    click.echo(json.dumps(storage.report(), indent=2))
+
+
+@storage_cli.command('sweep')
+@click.option('--dry-run', is_flag=True, help='Only count what would be removed or archived.')
+@click.option('--archive/--no-archive', default=True, help='Also move old originals to the archive tier.')
+def sweep_command(dry_run, archive):
+    """Delete expired unlinked photos and orphaned files, then archive old originals."""
+    result = storage.sweep(dry_run=dry_run, archive=archive)
+    if result is None:
+        raise click.ClickException('Another process is sweeping; try again later.')
+    click.echo(json.dumps(result, indent=2))
@@ -0,0 +1,120 @@
+import functools
+import inspect
+import json
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app.metrics import metrics
+
+logger = logging.getLogger('foranger.timing')
+
+stage_seconds = metrics.summary('stage_duration_seconds', 'Duration of pipeline stages', ['stage'])
+request_seconds = metrics.summary('http_request_duration_seconds', 'Request duration by endpoint', ['endpoint'])
+request_queries = metrics.summary('db_queries_per_request', 'SQL statements executed per request', ['endpoint'])
+
+
+def record(stage, seconds):
+    """Record one stage duration for the metrics and, inside a request, the Server-Timing header"""
+    stage_seconds.observe(seconds, stage=stage)
+    if has_request_context():
+        timings = g.get('_timings')
+        if timings is None:
+            timings = g._timings = []
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as ``stage``"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+def timed(stage):
+    """Decorator form of span(); works for both plain and async functions"""
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    # Statements issued by background threads (write-behind) are not attributed to a request
+    if has_request_context():
+        g._query_count = g.get('_query_count', 0) + 1
+
+
+def init_app(app):
+    """Emit Server-Timing headers and one structured timing log line per request"""
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(logging.INFO if app.config.get('TIMING_LOG_ENABLED', True) else logging.WARNING)
+    skip = set(app.config.get('TIMING_SKIP_ENDPOINTS', ['metrics.metrics_endpoint', 'health.liveness', 'health.readiness']))
+    query_header = app.config.get('QUERY_COUNT_HEADER', False)
+    if not event.contains(Engine, 'before_cursor_execute', _count_query):
+        event.listen(Engine, 'before_cursor_execute', _count_query)
+
+    @app.before_request
+    def _start_request_timer():
+        g._request_started = time.perf_counter()
+
+    @app.after_request
+    def _emit_timings(response):
+        started = g.get('_request_started')
+        if started is None or request.endpoint in skip:
+            return response
+        total = time.perf_counter() - started
+        queries = g.get('_query_count', 0)
+        request_seconds.observe(total, endpoint=request.endpoint or 'unmatched')
+        request_queries.observe(queries, endpoint=request.endpoint or 'unmatched')
+        if query_header:
+            response.headers['X-DB-Queries'] = str(queries)
+
+        # Repeated stages (e.g. the yearly timemachine calls) are summed
+        stages = {}
+        for stage, seconds in g.get('_timings') or []:
+            total_s, count = stages.get(stage, (0.0, 0))
+            stages[stage] = (total_s + seconds, count + 1)
+        entries = []
+        for stage, (seconds, count) in stages.items():
+            entry = f"{stage};dur={seconds * 1000:.1f}"
+            if count > 1:
+                entry += f';desc="x{count}"'
+            entries.append(entry)
+        entries.append(f"total;dur={total * 1000:.1f}")
+        response.headers['Server-Timing'] = ', '.join(entries)
+
+        logger.info(json.dumps({
+            "event": "request_timing",
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "total_ms": round(total * 1000, 1),
+            "db_queries": queries,
+            "stages": {
+                stage: {"ms": round(seconds * 1000, 1), "count": count}
+                for stage, (seconds, count) in stages.items()
+            }
+        }))
+        return response
@@ -0,0 +1,142 @@
+"""Storage and serving of uploaded soil photos.
+
+Photos are stored under a content-hashed name (``<name>-<sha256[:16]>.<ext>``),
+so a URL always refers to the same bytes and can be cached for a year as
+``immutable``; two users uploading ``soil.jpg`` no longer overwrite each
+other, and uploading the same photo twice stores it once.
+
+``/uploads/<filename>`` is served according to UPLOADS_SERVE_MODE:
+
+- ``direct``: the worker sends the file itself with ``send_file``, which
+  answers conditional and Range requests and hands whole files to the
+  server's ``wsgi.file_wrapper`` (gunicorn uses ``sendfile(2)`` for those).
+- ``x-accel-redirect``: an empty response with ``X-Accel-Redirect`` pointing
+  at UPLOADS_ACCEL_PREFIX, for an nginx ``internal`` location that serves
+  the uploads directory. nginx then does the transfer, Range included, and
+  the worker is free as soon as the headers are written.
+- ``x-sendfile``: the same through an ``X-Sendfile`` header with the
+  absolute path (Apache mod_xsendfile, lighttpd).
+
+Originals that app/storage.py moved to the archive tier (gzip files in
+UPLOAD_ARCHIVE_FOLDER) are still found by ``open_upload`` and ``serve``; they are
+decompressed by the worker, since they are rarely asked for.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from urllib.parse import quote
+
+from flask import Response, abort, current_app, send_file
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+SERVE_MODES = ('direct', 'x-accel-redirect', 'x-sendfile')
+
+# Also matches the ``.w<size>.webp`` derivatives of a hashed photo
+_HASHED = re.compile(r"-[0-9a-f]{16}(?:\.w\d+)?\.[A-Za-z0-9]+$")
+_CHUNK = 64 * 1024
+
+
+def folder():
+    return current_app.config.get('UPLOAD_FOLDER') or os.path.join(os.getcwd(), 'uploads')
+
+
+def path(filename):
+    return os.path.join(folder(), filename)
+
+
+def archive_folder():
+    return current_app.config.get('UPLOAD_ARCHIVE_FOLDER') or os.path.join(os.getcwd(), 'uploads-archive')
+
+
+def archive_path(filename):
+    return os.path.join(archive_folder(), f"{filename}.gz")
+
+
+def open_upload(filename):
+    """Binary file object of an upload from the hot or the archive tier"""
+    try:
+        return open(path(filename), 'rb')
+    except FileNotFoundError:
+        return gzip.open(archive_path(filename), 'rb')
+
+
+def url(filename):
+    return f"/uploads/{quote(filename)}" if filename else None
+
+
+def is_hashed(filename):
+    return bool(_HASHED.search(filename or ''))
+
+
+def save(file):
+    """Store an uploaded FileStorage under its content-hashed name.
+
+    Returns ``(filename, created)``; ``created`` is False when the same bytes
+    were already stored, in which case the caller must not delete the file on
+    failure because another photo row uses it.
+    """
+    directory = folder()
+    os.makedirs(directory, exist_ok=True)
+    stem, _, extension = secure_filename(file.filename).rpartition('.')
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(_CHUNK), b''):
+                digest.update(chunk)
+                out.write(chunk)
+        # mkstemp creates 0600; the reverse proxy has to be able to read it
+        os.chmod(temp_path, 0o644)
+        filename = f"{stem or 'photo'}-{digest.hexdigest()[:16]}.{extension.lower()}"
+        target = os.path.join(directory, filename)
+        if os.path.exists(target):
+            os.remove(temp_path)
+            # Fresh mtime, so the orphan sweep's grace period covers it until its row exists
+            os.utime(target)
+            return filename, False
+        os.replace(temp_path, target)
+        return filename, True
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def serve(filename):
+    full_path = safe_join(folder(), filename)
+    if full_path is None:
+        abort(404)
+    config = current_app.config
+    mode = config.get('UPLOADS_SERVE_MODE', 'direct')
+    if not os.path.isfile(full_path):
+        archived = safe_join(archive_folder(), f"{filename}.gz")
+        if archived is None or not os.path.isfile(archived):
+            abort(404)
+        response = send_file(gzip.open(archived, 'rb'), mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    elif mode == 'x-accel-redirect':
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = config.get('UPLOADS_ACCEL_PREFIX', '/protected-uploads/') + quote(filename)
+    elif mode == 'x-sendfile':
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Sendfile'] = os.path.abspath(full_path)
+    else:
+        response = send_file(full_path, conditional=True, etag=True)
+    if is_hashed(filename):
+        response.headers['Cache-Control'] = IMMUTABLE
+    else:
+        # Names from before content hashing can still be overwritten
+        response.headers['Cache-Control'] = f"public, max-age={config.get('UPLOADS_MAX_AGE', 3600)}"
+    return response
+
+
+def init_app(app):
+    mode = app.config.get('UPLOADS_SERVE_MODE', 'direct')
+    if mode not in SERVE_MODES:
+        raise ValueError(f"UPLOADS_SERVE_MODE must be one of {', '.join(SERVE_MODES)}, not {mode!r}")
+    app.add_url_rule('/uploads/<path:filename>', 'uploaded_file', serve)
@@ -0,0 +1,88 @@
+import importlib
+import os
+import threading
+import time
+from sqlalchemy import text
+from app.extensions import db
+from app.event_loops import ssl_context
+
+# Imported lazily by the services; preloading them in the gunicorn master
+# leaves one copy in pages shared copy-on-write with every worker.
+HEAVY_MODULES = ('anthropic', 'httpx', 'numpy', 'PIL.Image')
+
+_retry_lock = threading.Lock()
+
+
+def preload_modules():
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+
+
+def warm_up(app, retry_seconds=None):
+    """Get a worker ready before it accepts traffic.
+
+    Imports the lazily loaded SDKs, opens WARMUP_DB_CONNECTIONS pooled
+    database connections and loads the TLS context the upstream clients
+    share. /health/ready reports 503 until this has run.
+
+    A failing database check is retried with backoff for ``retry_seconds``
+    (WARMUP_RETRY_SECONDS); after that /health/ready retries it (see
+    retry_warm_up), so a worker started during a database blip still
+    becomes ready once the database is back.
+    """
+    state = app.extensions.setdefault('warmup', {'ready': False})
+    if retry_seconds is None:
+        retry_seconds = app.config.get('WARMUP_RETRY_SECONDS', 10)
+    started = time.perf_counter()
+    preload_modules()
+    with app.app_context():
+        if state.get('pid') != os.getpid():
+            # Connections opened by the master before the fork must not be reused here
+            db.engine.dispose(close=False)
+            state['pid'] = os.getpid()
+        give_up = time.monotonic() + retry_seconds
+        delay = 0.5
+        while True:
+            try:
+                _check_database(app)
+                break
+            except Exception as e:
+                print(f"Warm-up database check failed: {str(e)}")
+                state.update(ready=False, error=str(e))
+                if time.monotonic() + delay > give_up:
+                    return False
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+        # The clients themselves belong to the request threads' loops (see event_loops)
+        ssl_context()
+    state.update(ready=True, error=None, duration_ms=round((time.perf_counter() - started) * 1000, 1))
+    return True
+
+
+def _check_database(app):
+    connections = []
+    try:
+        for _ in range(app.config.get('WARMUP_DB_CONNECTIONS', 2)):
+            connections.append(db.engine.connect())
+        for connection in connections:
+            connection.execute(text('SELECT 1'))
+    finally:
+        for connection in connections:
+            connection.close()
+
+
+def retry_warm_up(app):
+    """Run warm-up again for a worker that is not ready, at most every WARMUP_RETRY_INTERVAL seconds"""
+    state = app.extensions.setdefault('warmup', {'ready': False})
+    if not _retry_lock.acquire(blocking=False):
+        return False
+    try:
+        if state.get('ready'):
+            return True
+        now = time.monotonic()
+        if now - state.get('last_retry', float('-inf')) < app.config.get('WARMUP_RETRY_INTERVAL', 5):
+            return False
+        state['last_retry'] = now
+        return warm_up(app, retry_seconds=0)
+    finally:
+        _retry_lock.release()
@@ -0,0 +1,162 @@
+import atexit
+import os
+import queue
+import threading
+import time
+
+import sqlalchemy as sa
+
+from app.extensions import db
+
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """Bounded, coalescing queue for non-critical column updates.
+
+    Updates are keyed by (table, primary key) and merged column by column, so
+    the last write to a row wins. A background thread drains the queue and
+    applies pending rows in batched ``UPDATE ... FROM (VALUES ...)`` statements
+    (one statement per table and column set). The queue is flushed at shutdown.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = False
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('WRITE_BEHIND_ENABLED', True)
+        self.max_queue = app.config.get('WRITE_BEHIND_MAX_QUEUE', 10000)
+        self.flush_interval = app.config.get('WRITE_BEHIND_FLUSH_INTERVAL', 2.0)
+        self.batch_size = app.config.get('WRITE_BEHIND_BATCH_SIZE', 500)
+        app.extensions['write_behind'] = self
+        atexit.register(self.shutdown)
+
+    def enqueue(self, model, pk, **values):
+        """Schedule ``UPDATE model SET **values WHERE pk = pk``."""
+        table = model.__table__
+        if not self.enabled:
+            self._apply(table, tuple(sorted(values)), [(pk, values)])
+            return
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((table, pk, values))
+        except queue.Full:
+            # Backpressure: write inline rather than dropping the update
+            self._apply(table, tuple(sorted(values)), [(pk, values)])
+
+    def flush(self, timeout=10):
+        """Block until everything enqueued so far has been applied."""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        done = threading.Event()
+        self._queue.put(done, timeout=timeout)
+        done.wait(timeout)
+
+    def shutdown(self, timeout=10):
+        with self._lock:
+            thread = self._thread
+            if thread is None or self._pid != os.getpid() or not thread.is_alive():
+                return
+            try:
+                self._queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            thread.join(timeout)
+            self._thread = None
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            # A forked worker inherits neither the thread nor a usable queue
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        pending = {}
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is _STOP or isinstance(item, threading.Event):
+                # Drain whatever is already queued, then flush everything
+                while True:
+                    try:
+                        extra = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(extra, tuple):
+                        table, pk, values = extra
+                        pending.setdefault((table, pk), {}).update(values)
+                self._flush(pending)
+                pending = {}
+                deadline = time.monotonic() + self.flush_interval
+                if item is _STOP:
+                    return
+                item.set()
+                continue
+
+            if item is not None:
+                table, pk, values = item
+                pending.setdefault((table, pk), {}).update(values)
+
+            if len(pending) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(pending)
+                pending = {}
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, pending):
+        if not pending:
+            return
+        groups = {}
+        for (table, pk), values in pending.items():
+            groups.setdefault((table, tuple(sorted(values))), []).append((pk, values))
+        with self.app.app_context():
+            for (table, columns), rows in groups.items():
+                for i in range(0, len(rows), self.batch_size):
+                    self._apply(table, columns, rows[i:i + self.batch_size])
+
+    def _apply(self, table, columns, rows):
+        pk_col = list(table.primary_key.columns)[0]
+        try:
+            with db.engine.begin() as conn:
+                if conn.dialect.name == 'postgresql':
+                    v = sa.values(
+                        sa.column(pk_col.name, pk_col.type),
+                        *[sa.column(c, table.c[c].type) for c in columns],
+                        name='v'
+                    ).data([(pk, *[values[c] for c in columns]) for pk, values in rows])
+                    stmt = (
+                        table.update()
+                        .where(pk_col == sa.cast(v.c[pk_col.name], pk_col.type))
+                        .values({c: sa.cast(v.c[c], table.c[c].type) for c in columns})
+                    )
+                    conn.execute(stmt)
+                else:
+                    stmt = (
+                        table.update()
+                        .where(pk_col == sa.bindparam('_pk'))
+                        .values({c: sa.bindparam(f'_{c}') for c in columns})
+                    )
+                    conn.execute(stmt, [
+                        {'_pk': pk, **{f'_{c}': values[c] for c in columns}} for pk, values in rows
+                    ])
+        except Exception as e:
+            print(f"Write-behind flush of {len(rows)} row(s) to {table.name} failed: {str(e)}")
+
+
+write_behind = WriteBehindQueue()
@@ -0,0 +1,67 @@
+"""Compare two bench.run result files.
+
+    python -m bench.compare baseline.json candidate.json [--threshold 10]
+
+Prints rps, p95, queries per request and service cache hit ratio side by side for every
+(scenario, concurrency) present in both files, and exits with status 1 when
+the candidate's rps drops, or its p95 rises, by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def _load(path):
+    with open(path) as f:
+        report = json.load(f)
+    return {(r['scenario'], r['concurrency']): r for r in report['results']}
+
+
+def _delta(old, new):
+    if not old or new is None:
+        return None
+    return 100.0 * (new - old) / old
+
+
+def _fmt_delta(value):
+    return '     n/a' if value is None else f"{value:+7.1f}%"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args(argv)
+
+    baseline = _load(args.baseline)
+    candidate = _load(args.candidate)
+    regressions = []
+    print(f"{'scenario':16} {'c':>4} {'rps':>18} {'Δrps':>8} {'p95 ms':>20} {'Δp95':>8} {'queries/req':>14} {'cache hits':>16}")
+    for key in sorted(baseline.keys() & candidate.keys()):
+        old, new = baseline[key], candidate[key]
+        rps_delta = _delta(old['rps'], new['rps'])
+        p95_delta = _delta(old['latency_ms']['p95'], new['latency_ms']['p95'])
+        old_q = old['db_queries_per_request']['mean']
+        new_q = new['db_queries_per_request']['mean']
+        # Results from before the service cache have no cache section
+        old_c = old.get('cache', {}).get('hit_ratio')
+        new_c = new.get('cache', {}).get('hit_ratio')
+        print(f"{key[0]:16} {key[1]:>4} {old['rps']:>8} -> {new['rps']:<8} {_fmt_delta(rps_delta)} "
+              f"{old['latency_ms']['p95']!s:>9} -> {new['latency_ms']['p95']!s:<9} {_fmt_delta(p95_delta)} "
+              f"{old_q!s:>5} -> {new_q!s:<5} {old_c!s:>6} -> {new_c!s:<6}")
+        if rps_delta is not None and rps_delta < -args.threshold:
+            regressions.append(f"{key[0]} c={key[1]}: rps {rps_delta:+.1f}%")
+        if p95_delta is not None and p95_delta > args.threshold:
+            regressions.append(f"{key[0]} c={key[1]}: p95 {p95_delta:+.1f}%")
+
+    if regressions:
+        print("\nRegressions beyond threshold:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
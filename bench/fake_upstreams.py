@@ -0,0 +1,303 @@
+"""Local stand-ins for the Anthropic Messages API and OpenWeather / IP geolocation.
+
+Both servers answer with payloads shaped like the real services, after a
+lognormal delay, and fail a configurable fraction of requests. They can be
+started in-process (``start_anthropic`` / ``start_weather``) or standalone::
+
+    python -m bench.fake_upstreams --anthropic-port 8101 --weather-port 8102
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SOIL_TYPES = [
+    "Alluvial Soil", "Andosol Soil", "Regosol Soil", "Latosol Soil", "Podzolic Soil", "Grumosol Soil",
+    "Organosol Soil", "Lithosol Soil", "Mediterranean Soil", "Rendzina Soil", "Laterite Soil", "Gleysol Soil"
+]
+
+CROPS = [
+    ("Rice", "Cereal"), ("Corn", "Cereal"), ("Soybean", "Legume"), ("Peanut", "Legume"),
+    ("Cassava", "Tuber"), ("Sweet Potato", "Tuber"), ("Chili", "Vegetable"), ("Shallot", "Vegetable"),
+    ("Tomato", "Vegetable"), ("Banana", "Fruit"), ("Coffee", "Plantation"), ("Cocoa", "Plantation")
+]
+
+
+class LatencyProfile:
+    """Lognormal latency with a given median and spread, plus an error rate."""
+
+    def __init__(self, median_ms, sigma=0.5, error_rate=0.0):
+        self.median_ms = median_ms
+        self.sigma = sigma
+        self.error_rate = error_rate
+
+    def sleep(self, scale=1.0):
+        if self.median_ms > 0:
+            time.sleep(scale * random.lognormvariate(math.log(self.median_ms / 1000.0), self.sigma))
+
+    def should_fail(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def to_dict(self):
+        return {"median_ms": self.median_ms, "sigma": self.sigma, "error_rate": self.error_rate}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    profile = LatencyProfile(0)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+
+class FakeAnthropicHandler(_Handler):
+    """POST /v1/messages: a forced tool call answers with the soil fields
+    (image requests) or the crop plan; otherwise soil text, crop JSON for the
+    recommendation prompt or a short reply.
+
+    Haiku models answer in a third of the latency, and that fraction of their
+    soil answers given by ``small_model_low_confidence`` says CONFIDENCE: Low.
+    """
+    crops_per_response = 5
+    small_model_low_confidence = 0.2
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/v1/messages':
+            return self._send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": "Not found"}})
+        request = self._read_json()
+        small = 'haiku' in request.get('model', '')
+        self.profile.sleep(1 / 3 if small else 1.0)
+        if self.profile.should_fail():
+            return self._send_json(529, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}})
+
+        content = request.get('messages', [{}])[-1].get('content', '')
+        if isinstance(content, list):
+            images = sum(1 for block in content if block.get('type') == 'image')
+            prompt = ' '.join(block.get('text', '') for block in content if block.get('type') == 'text')
+        else:
+            images = 0
+            prompt = content
+        has_image = images > 0
+
+        tool = request.get('tool_choice', {}).get('name')
+        if tool:
+            # Forced tool call: answer with the tool's input instead of text
+            payload = self._soil_fields(small, images) if has_image else self._crop_payload(request['tools'][0])
+            block = {"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:24]}", "name": tool, "input": payload}
+            text, stop_reason = json.dumps(payload), "tool_use"
+        else:
+            if has_image:
+                text = self._soil_text(small)
+            elif 'recommendations' in prompt and 'JSON' in prompt:
+                text = json.dumps(self._crop_payload())
+            else:
+                text = "Tanah latosol cocok untuk padi dan jagung pada musim hujan."
+            block, stop_reason = {"type": "text", "text": text}, "end_turn"
+
+        self._send_json(200, {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": request.get('model', 'claude-3-5-sonnet-20241022'),
+            "content": [block],
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": {"input_tokens": max(1, len(json.dumps(request)) // 4), "output_tokens": max(1, len(text) // 4)}
+        })
+
+    def _soil_fields(self, small=False, images=1):
+        low = small and random.random() < self.small_model_low_confidence
+        soil_type = random.choice(SOIL_TYPES)
+        fields = {
+            "soil_type": soil_type,
+            "soil_color": "Reddish",
+            "soil_texture": "Clayey",
+            "soil_drainage": "Moderately-drained",
+            "soil_location_type": "Plain",
+            "soil_fertility": "Medium",
+            "soil_moisture": "Moist",
+            "confidence": "Low" if low else "High"
+        }
+        if images > 1:
+            fields["images"] = [
+                {"image": i + 1, "soil_type": soil_type, "usable": True, "notes": "Bare topsoil, close up."}
+                for i in range(images)
+            ]
+        return fields
+
+    def _soil_text(self, small=False):
+        return '\n'.join(f"{key.upper()}: {value}" for key, value in self._soil_fields(small).items())
+
+    def _crop_payload(self, tool=None):
+        today = time.strftime('%Y-%m-%d')
+        crops = CROPS
+        # A shortlisted request limits crop_name to the shortlist
+        allowed = (tool or {}).get('input_schema', {}).get('properties', {}).get('recommendations', {}) \
+            .get('items', {}).get('properties', {}).get('crop_name', {}).get('enum')
+        if allowed:
+            categories = dict(CROPS)
+            crops = [(name, categories.get(name, "Other")) for name in allowed]
+        recommendations = []
+        for name, category in random.sample(crops, min(self.crops_per_response, len(crops))):
+            recommendations.append({
+                "crop_name": name,
+                "crop_category": category,
+                "suitability_score": random.randint(55, 95),
+                "suitability_level": "High",
+                "planting_method": "Direct seeding",
+                "spacing_recommendation": "25 x 25 cm",
+                "seed_variety_suggestions": f"{name} Unggul 1, {name} Unggul 2",
+                "expected_yield_per_hectare": 5.5,
+                "fertilizer_schedule": ["Basal: NPK 200 kg/ha", "Top dressing: Urea 100 kg/ha at 30 DAP"],
+                "watering_schedule": "Every 3 days in dry spells",
+                "pest_control_measures": ["Integrated pest management", "Crop rotation"],
+                "harvesting_indicators": "Yellowing leaves, hard grains",
+                "estimated_cost_per_hectare": 12000000,
+                "estimated_revenue_per_hectare": 30000000,
+                "market_demand_level": "High",
+                "best_planting_date": today,
+                "expected_harvest_date": today,
+                "planting_window_start": today,
+                "planting_window_end": today
+            })
+        return {
+            "recommendations": recommendations,
+            "seasonal_advice": "Plant early in the rainy season and keep drainage channels open.",
+            "weather_warnings": "Heavy rain expected later this week.",
+            "soil_treatments": ["Add organic matter", "Apply dolomite lime"],
+            "risk_factors": ["Waterlogging", "Fungal disease"],
+            "success_probability": 78,
+            "best_planting_date": today,
+            "expected_harvest_date": today,
+            "planting_window_start": today,
+            "planting_window_end": today
+        }
+
+
+class FakeWeatherHandler(_Handler):
+    """OpenWeather One Call 3.0, timemachine and reverse geocoding, plus the
+    three IP geolocation providers under /ip-api, /ipapi-co and /freegeoip."""
+    hourly_points = 48
+    daily_points = 8
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        self.profile.sleep()
+        if self.profile.should_fail():
+            return self._send_json(503, {"cod": 503, "message": "Service unavailable"})
+
+        path = url.path
+        if path == '/geo/1.0/reverse':
+            return self._send_json(200, [{"name": "Bogor", "state": "West Java", "country": "ID",
+                                          "lat": float(params.get('lat', 0)), "lon": float(params.get('lon', 0))}])
+        if path == '/data/3.0/onecall/timemachine':
+            return self._send_json(200, {"data": [{"dt": int(params.get('dt', time.time())), "temp": round(random.uniform(23, 31), 1),
+                                                   "weather": [{"description": "light rain"}], "rain": {"1h": round(random.uniform(0, 5), 1)}}]})
+        if path == '/data/3.0/onecall':
+            return self._send_json(200, self._onecall())
+        if path.startswith('/ip-api'):
+            return self._send_json(200, {"status": "success", "lat": -6.595, "lon": 106.816, "city": "Bogor",
+                                         "country": "Indonesia", "regionName": "West Java"})
+        if path.startswith('/ipapi-co') or path.startswith('/freegeoip'):
+            return self._send_json(200, {"latitude": -6.595, "longitude": 106.816, "city": "Bogor",
+                                         "country_name": "Indonesia", "region": "West Java", "region_name": "West Java"})
+        return self._send_json(404, {"cod": 404, "message": "Not found"})
+
+    def _onecall(self):
+        now = int(time.time())
+        weather = [{"id": 500, "main": "Rain", "description": "light rain", "icon": "10d"}]
+        return {
+            "lat": -6.595, "lon": 106.816, "timezone": "Asia/Jakarta", "timezone_offset": 25200,
+            "current": {"dt": now, "sunrise": now - 20000, "sunset": now + 20000, "temp": 27.4, "feels_like": 30.1,
+                        "pressure": 1008, "humidity": 81, "dew_point": 23.8, "uvi": 6.2, "clouds": 40,
+                        "visibility": 10000, "wind_speed": 2.1, "wind_deg": 230, "weather": weather, "rain": {"1h": 0.4}},
+            "hourly": [{"dt": now + 3600 * i, "temp": round(24 + 6 * random.random(), 2), "feels_like": 28.0,
+                        "pressure": 1008, "humidity": 80, "clouds": 50, "wind_speed": round(1 + 3 * random.random(), 2),
+                        "weather": weather, "pop": round(random.random(), 2), "rain": {"1h": round(2 * random.random(), 2)}}
+                       for i in range(self.hourly_points)],
+            "daily": [{"dt": now + 86400 * i, "sunrise": now, "sunset": now + 43200, "summary": "Expect light rain",
+                       "temp": {"day": 30.2, "min": 22.5, "max": 31.4, "night": 24.0, "eve": 27.3, "morn": 23.1},
+                       "feels_like": {"day": 33.0, "night": 25.0, "eve": 29.0, "morn": 24.0},
+                       "pressure": 1008, "humidity": 78, "wind_speed": 3.2, "weather": weather, "clouds": 55,
+                       "pop": round(random.random(), 2), "rain": round(10 * random.random(), 2), "uvi": 9.1}
+                      for i in range(self.daily_points)],
+            "alerts": []
+        }
+
+
+def _serve(handler_cls, profile, host, port, **attrs):
+    handler = type(handler_cls.__name__, (handler_cls,), {"profile": profile, **attrs})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=handler_cls.__name__, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def start_anthropic(profile, host='127.0.0.1', port=0, crops_per_response=5, small_model_low_confidence=0.2):
+    """Start the fake Messages API; returns (server, base_url)."""
+    return _serve(FakeAnthropicHandler, profile, host, port, crops_per_response=crops_per_response,
+                  small_model_low_confidence=small_model_low_confidence)
+
+
+def start_weather(profile, host='127.0.0.1', port=0, hourly_points=48, daily_points=8):
+    """Start the fake OpenWeather / IP geolocation server; returns (server, base_url)."""
+    return _serve(FakeWeatherHandler, profile, host, port, hourly_points=hourly_points, daily_points=daily_points)
+
+
+def upstream_env(anthropic_url, weather_url):
+    """Environment pointing the app's Config at the stand-ins."""
+    return {
+        "CLAUDE_API_KEY": "bench",
+        "CLAUDE_API_BASE_URL": anthropic_url,
+        "OPENWEATHER_API_KEY": "bench",
+        "OPENWEATHER_BASE_URL": weather_url,
+        "IP_API_URL": f"{weather_url}/ip-api/json",
+        "IPAPI_CO_URL": f"{weather_url}/ipapi-co/json/",
+        "FREEGEOIP_URL": f"{weather_url}/freegeoip/json/",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--anthropic-port', type=int, default=8101)
+    parser.add_argument('--weather-port', type=int, default=8102)
+    parser.add_argument('--claude-latency-ms', type=float, default=1500)
+    parser.add_argument('--weather-latency-ms', type=float, default=150)
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    _, anthropic_url = start_anthropic(LatencyProfile(args.claude_latency_ms, args.latency_sigma, args.error_rate),
+                                       args.host, args.anthropic_port)
+    _, weather_url = start_weather(LatencyProfile(args.weather_latency_ms, args.latency_sigma, args.error_rate),
+                                   args.host, args.weather_port)
+    for key, value in upstream_env(anthropic_url, weather_url).items():
+        print(f"export {key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
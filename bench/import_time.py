@@ -0,0 +1,109 @@
+"""Import-time benchmark for the WSGI entry point.
+
+Runs ``python -X importtime -c "import run"`` in fresh interpreters and
+reports the median total and the slowest top-level packages as JSON::
+
+    python -m bench.import_time --runs 5
+    python -m bench.import_time --baseline bench/results/import-time-before.json --threshold 15
+
+Exits with status 1 when the total exceeds --max-ms, or regresses by more
+than --threshold percent against --baseline.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(target, env):
+    """One interpreter run; returns {module: cumulative_us} for every import."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {target}"],
+                            cwd=ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace('import time:', '|', 1).split('|')]
+        # Only the first import of a module is listed, so its cumulative time is its full cost
+        modules.setdefault(name, int(cumulative_us))
+    return modules
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', default='run', help="module to import (default: run)")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--max-ms', type=float)
+    parser.add_argument('--baseline')
+    parser.add_argument('--threshold', type=float, default=15.0)
+    parser.add_argument('--output', help="defaults to bench/results/import-time-<timestamp>.json")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    # Importing run builds the app; it must not need a reachable database
+    env.setdefault('DATABASE_URL', 'sqlite://')
+    env['PYTHONPATH'] = os.pathsep.join(p for p in [ROOT, env.get('PYTHONPATH')] if p)
+
+    runs = [measure(args.target, env) for _ in range(args.runs)]
+    totals = [run.get(args.target, 0) / 1000 for run in runs]
+    packages = {}
+    for name in runs[0]:
+        top = name.split('.')[0]
+        if name == top:
+            packages[top] = statistics.median(run.get(top, 0) for run in runs) / 1000
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "target": args.target,
+            "runs": args.runs,
+        },
+        "total_ms": {
+            "median": round(statistics.median(totals), 1),
+            "min": round(min(totals), 1),
+            "max": round(max(totals), 1),
+        },
+        "slowest_packages_ms": {
+            name: round(ms, 1)
+            for name, ms in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]
+            if name != args.target
+        }
+    }
+
+    output = args.output or os.path.join(ROOT, 'bench', 'results',
+                                          f"import-time-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"import {args.target}: median {report['total_ms']['median']} ms over {args.runs} runs")
+    for name, ms in report['slowest_packages_ms'].items():
+        print(f"  {name:30} {ms:8.1f} ms")
+    print(f"Results written to {output}")
+
+    status = 0
+    median = report['total_ms']['median']
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"Import time {median} ms exceeds --max-ms {args.max_ms}")
+        status = 1
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['total_ms']['median']
+        change = 100.0 * (median - baseline) / baseline if baseline else 0.0
+        print(f"Baseline {baseline} ms -> {median} ms ({change:+.1f}%)")
+        if change > args.threshold:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
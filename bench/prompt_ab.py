@@ -0,0 +1,233 @@
+"""A/B comparison of crop recommendation prompt encodings.
+
+Fetches the weather for a set of Indonesian locations once, then asks for
+crop recommendations with every prompt encoding on the same inputs
+(alternating the order per sample) and compares input tokens, latency and
+output quality: whether the reply parses as JSON, how many of the requested
+keys each recommendation carries, whether the dates are ISO 8601, and how
+much the recommended crops overlap between encodings::
+
+    python -m bench.prompt_ab --samples 5                       # fake upstreams
+    python -m bench.prompt_ab --upstream live --samples 10      # real APIs from the environment
+
+With the fake upstreams latency and quality do not depend on the prompt; only
+the token figures are meaningful there. Exits with status 1 when an encoding's
+parse rate or key coverage drops more than --max-quality-drop below the
+baseline (the first variant).
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import date, datetime, timezone
+
+from bench.fake_upstreams import LatencyProfile, start_anthropic, start_weather, upstream_env
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOCATIONS = [
+    (-6.595, 106.816),   # Bogor
+    (-7.797, 110.370),   # Yogyakarta
+    (-0.947, 100.417),   # Padang
+    (-8.650, 115.216),   # Denpasar
+    (-5.147, 119.432),   # Makassar
+    (3.595, 98.672),     # Medan
+    (-3.316, 114.590),   # Banjarmasin
+]
+
+SOIL_ANALYSIS = (
+    "SOIL_TYPE: Latosol Soil\nSOIL_COLOR: Reddish\nSOIL_TEXTURE: Clayey\nSOIL_DRAINAGE: Well-drained\n"
+    "SOIL_LOCATION_TYPE: Slope\nSOIL_FERTILITY: Medium\nSOIL_MOISTURE: Moist"
+)
+
+RECOMMENDATION_KEYS = [
+    "crop_name", "crop_category", "suitability_score", "suitability_level", "planting_method",
+    "spacing_recommendation", "seed_variety_suggestions", "expected_yield_per_hectare", "fertilizer_schedule",
+    "watering_schedule", "pest_control_measures", "harvesting_indicators", "estimated_cost_per_hectare",
+    "estimated_revenue_per_hectare", "market_demand_level", "best_planting_date", "expected_harvest_date",
+    "planting_window_start", "planting_window_end"
+]
+DATE_KEYS = ["best_planting_date", "expected_harvest_date", "planting_window_start", "planting_window_end"]
+
+
+def _parse(text):
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", (text or '').strip())
+    try:
+        parsed = json.loads(text)
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def _is_iso_date(value):
+    try:
+        date.fromisoformat(str(value))
+        return True
+    except ValueError:
+        return False
+
+
+def score(text):
+    """Quality figures for one reply"""
+    parsed = _parse(text)
+    if parsed is None:
+        return {"parsed": False, "recommendations": 0, "key_coverage": 0.0, "dates_valid": 0.0, "crops": []}
+    recs = [r for r in parsed.get('recommendations') or [] if isinstance(r, dict)]
+    coverage = [sum(key in r for key in RECOMMENDATION_KEYS) / len(RECOMMENDATION_KEYS) for r in recs]
+    dates = [_is_iso_date(r[key]) for r in recs for key in DATE_KEYS if r.get(key)]
+    return {
+        "parsed": True,
+        "recommendations": len(recs),
+        "key_coverage": statistics.mean(coverage) if coverage else 0.0,
+        "dates_valid": statistics.mean(dates) if dates else 0.0,
+        "crops": sorted({str(r.get('crop_name', '')).strip().lower() for r in recs if r.get('crop_name')}),
+    }
+
+
+def _jaccard(a, b):
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a | b else 1.0
+
+
+def _summarize(runs):
+    ok = [r for r in runs if r['success']]
+    latencies = sorted(r['latency_ms'] for r in ok)
+    return {
+        "samples": len(runs),
+        "errors": len(runs) - len(ok),
+        "latency_ms_p50": round(statistics.median(latencies), 1) if latencies else None,
+        "latency_ms_max": round(latencies[-1], 1) if latencies else None,
+        "estimated_tokens_mean": round(statistics.mean(r['estimated_tokens'] for r in runs), 1),
+        "input_tokens_mean": round(statistics.mean(r['input_tokens'] for r in ok), 1) if ok else None,
+        "output_tokens_mean": round(statistics.mean(r['output_tokens'] for r in ok), 1) if ok else None,
+        "parse_rate": round(statistics.mean(r['quality']['parsed'] for r in ok), 3) if ok else 0.0,
+        "key_coverage": round(statistics.mean(r['quality']['key_coverage'] for r in ok), 3) if ok else 0.0,
+        "dates_valid": round(statistics.mean(r['quality']['dates_valid'] for r in ok), 3) if ok else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--variants', default='legacy,compact', help="encodings to compare; the first is the baseline")
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--upstream', choices=['fake', 'live'], default='fake')
+    parser.add_argument('--model', default='claude-3-5-sonnet-20241022')
+    parser.add_argument('--max-tokens', type=int, default=1500)
+    parser.add_argument('--history-years', type=int, default=0, help="include same-day history in the prompt")
+    parser.add_argument('--no-soil', action='store_true', help="leave the soil analysis out of the prompt")
+    parser.add_argument('--claude-latency-ms', type=float, default=50, help="fake upstream only")
+    parser.add_argument('--max-quality-drop', type=float, default=0.05)
+    parser.add_argument('--output', help="defaults to bench/results/prompt-ab-<timestamp>.json")
+    args = parser.parse_args(argv)
+    variants = [v for v in args.variants.split(',') if v]
+
+    if args.upstream == 'fake':
+        _, anthropic_url = start_anthropic(LatencyProfile(args.claude_latency_ms))
+        _, weather_url = start_weather(LatencyProfile(0))
+        os.environ.update(upstream_env(anthropic_url, weather_url))
+    # Config is read at import time, so the environment has to be final first
+    os.environ.setdefault('DATABASE_URL', 'sqlite://')
+    from app import create_app
+    from app.services import prompt_encoder
+    from app.services.claude_service import ClaudeService
+    from app.services.weather_service import WeatherService
+
+    app = create_app()
+    soil_data = None if args.no_soil else {"success": True, "soil_analysis": SOIL_ANALYSIS}
+    runs = {variant: [] for variant in variants}
+    overlap = []
+    with app.app_context():
+        weather_service = WeatherService()
+        claude = ClaudeService()
+        for i in range(args.samples):
+            lat, lon = LOCATIONS[i % len(LOCATIONS)]
+            weather_data = weather_service.get_weather_data(lat, lon)
+            if not weather_data['success']:
+                print(f"sample {i}: weather failed: {weather_data['error']}")
+                continue
+            if args.history_years:
+                weather_data['history'] = weather_service.get_historical_weather(lat, lon, args.history_years)
+            # Alternate the order so warm connections and upstream caching favour no one
+            order = variants if i % 2 == 0 else list(reversed(variants))
+            crops = {}
+            for variant in order:
+                prompt = claude._crop_prompt(weather_data, soil_data, variant)
+                started = time.perf_counter()
+                result = claude.get_crop_recommendations(weather_data, soil_data, args.model, args.max_tokens, encoding=variant)
+                latency_ms = (time.perf_counter() - started) * 1000
+                run = {
+                    "sample": i,
+                    "success": result['success'],
+                    "latency_ms": latency_ms,
+                    "estimated_tokens": prompt_encoder.estimate_tokens(prompt),
+                    "chars": len(prompt),
+                }
+                if result['success']:
+                    run["input_tokens"] = result['usage']['input_tokens']
+                    run["output_tokens"] = result['usage']['output_tokens']
+                    run["quality"] = score(result['recommendations'])
+                    crops[variant] = run["quality"]["crops"]
+                else:
+                    run["error"] = result['error']
+                runs[variant].append(run)
+            baseline = variants[0]
+            for variant in variants[1:]:
+                if baseline in crops and variant in crops:
+                    overlap.append({"sample": i, "variant": variant, "crop_jaccard": _jaccard(crops[baseline], crops[variant])})
+
+    summary = {variant: _summarize(variant_runs) for variant, variant_runs in runs.items() if variant_runs}
+    baseline = variants[0]
+    for variant in variants[1:]:
+        if variant in summary and baseline in summary:
+            base, other = summary[baseline], summary[variant]
+            other["vs_baseline"] = {
+                "input_tokens_pct": round(100.0 * (other['input_tokens_mean'] - base['input_tokens_mean']) / base['input_tokens_mean'], 1)
+                if base['input_tokens_mean'] and other['input_tokens_mean'] else None,
+                "estimated_tokens_pct": round(100.0 * (other['estimated_tokens_mean'] - base['estimated_tokens_mean']) / base['estimated_tokens_mean'], 1),
+                "crop_jaccard_mean": round(statistics.mean(o['crop_jaccard'] for o in overlap if o['variant'] == variant), 3)
+                if any(o['variant'] == variant for o in overlap) else None,
+            }
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "upstream": args.upstream,
+            "model": args.model,
+            "samples": args.samples,
+            "history_years": args.history_years,
+            "soil": not args.no_soil,
+        },
+        "summary": summary,
+        "runs": runs,
+        "overlap": overlap,
+    }
+    output = args.output or os.path.join(ROOT, 'bench', 'results',
+                                          f"prompt-ab-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for variant, s in summary.items():
+        line = (f"{variant:10} est_tokens={s['estimated_tokens_mean']:<8} input_tokens={s['input_tokens_mean']} "
+                f"p50={s['latency_ms_p50']}ms parse={s['parse_rate']} keys={s['key_coverage']} dates={s['dates_valid']} "
+                f"errors={s['errors']}")
+        if 'vs_baseline' in s:
+            line += f" vs {baseline}: {s['vs_baseline']}"
+        print(line)
+    print(f"Results written to {output}")
+
+    status = 0
+    for variant in variants[1:]:
+        if variant in summary and baseline in summary:
+            for key in ('parse_rate', 'key_coverage'):
+                if summary[variant][key] < summary[baseline][key] - args.max_quality_drop:
+                    print(f"{variant}: {key} {summary[variant][key]} is below {baseline} {summary[baseline][key]}")
+                    status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,392 @@
+"""Offline load test for the API.
+
+Starts the fake Anthropic and OpenWeather servers, a throwaway SQLite
+database (or the one given with --database-url) and the app under gunicorn,
+then drives each scenario at each concurrency level with a closed loop of
+client threads, one user per thread. Results are written as JSON::
+
+    python -m bench.run --concurrency 1,8,32 --duration 20
+    python -m bench.compare bench/results/before.json bench/results/after.json
+
+Query counts come from the X-DB-Queries header (QUERY_COUNT_HEADER), service
+cache hits and misses from X-Cache-Hits / X-Cache-Misses. To compare the
+shared cache with a per-worker one, spread the weather scenarios over a few
+forecast tiles and run once per backend::
+
+    python -m bench.run --scenarios crops_recommend_fast --locations 8 --cache-backend memory
+    python -m bench.run --scenarios crops_recommend_fast --locations 8 --cache-backend sqlite
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import requests
+
+from bench.fake_upstreams import LatencyProfile, SOIL_TYPES, start_anthropic, start_weather, upstream_env
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'bench-password'
+LAT, LON = -6.595, 106.816
+# Spacing of the --locations points: one forecast tile apart at the default FORECAST_TILE_DEGREES
+LOCATION_STEP = 0.1
+
+
+# --- scenarios -------------------------------------------------------------
+
+def scenario_login(client):
+    return client.session.post(f"{client.base_url}/authentication/login",
+                               json={"email": client.email, "password": PASSWORD})
+
+
+USER_READS = ['/user/soil-analyses', '/user/crop-predictions', '/user/crop-recommendations', '/user/weather-data']
+
+def scenario_user_reads(client):
+    path = USER_READS[client.iteration % len(USER_READS)]
+    return client.session.get(f"{client.base_url}{path}", headers=client.auth)
+
+
+def scenario_soil_analyze(client):
+    files = {'image': ('soil.jpg', client.image, 'image/jpeg')}
+    return client.session.post(f"{client.base_url}/soil/analyze", headers=client.auth, files=files)
+
+
+def scenario_soil_analyze_multi(client):
+    # Three different photos of one plot in one request
+    files = [('image', (f'soil{i}.jpg', client.image + bytes([i]), 'image/jpeg')) for i in range(3)]
+    return client.session.post(f"{client.base_url}/soil/analyze", headers=client.auth, files=files)
+
+
+def scenario_soil_submit(client):
+    return client.session.post(f"{client.base_url}/soil/submit", headers=client.auth, json={
+        "classified_soil_type": random.choice(SOIL_TYPES),
+        "soil_color": "Dark reddish brown",
+        "soil_texture": "Clay loam",
+        "soil_drainage": "Moderate",
+        "soil_location_type": "Lowland",
+        "soil_fertility": "Medium",
+        "soil_moisture": "Moist",
+        "classification_confidence": "0.8",
+        "classification_method": "Visual analysis",
+        **client.location()
+    })
+
+
+def scenario_crops_recommend(client):
+    return client.session.post(f"{client.base_url}/crops/recommend", headers=client.auth,
+                               json=client.location())
+
+
+def scenario_crops_recommend_fast(client):
+    return client.session.post(f"{client.base_url}/crops/recommend", headers=client.auth,
+                               json=dict(client.location(), mode="fast"))
+
+
+SCENARIOS = {
+    'login': scenario_login,
+    'user_reads': scenario_user_reads,
+    'soil_analyze': scenario_soil_analyze,
+    'soil_analyze_multi': scenario_soil_analyze_multi,
+    'soil_submit': scenario_soil_submit,
+    'crops_recommend': scenario_crops_recommend,
+    'crops_recommend_fast': scenario_crops_recommend_fast,
+}
+
+
+class Client:
+    """One simulated user with its own connection pool and token."""
+
+    def __init__(self, base_url, email, image, locations=1):
+        self.base_url = base_url
+        self.email = email
+        self.image = image
+        self.locations = locations
+        self.iteration = 0
+        self.session = requests.Session()
+        response = scenario_login(self)
+        response.raise_for_status()
+        self.auth = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    def location(self):
+        """One of the --locations points, picked at random for each request"""
+        i = random.randrange(self.locations)
+        return {"lat": round(LAT + i * LOCATION_STEP, 3), "lon": LON}
+
+
+# --- environment -----------------------------------------------------------
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _seed_database(env, users):
+    """Create the schema and seed soil types and bench users (one password hash for all)."""
+    code = (
+        "import os, sys, uuid\n"
+        f"sys.path.insert(0, {ROOT!r})\n"
+        "from app import create_app\n"
+        "from app.extensions import db\n"
+        "from models.users import User\n"
+        "from models.soil_type_reference import SoilTypeReference\n"
+        "from werkzeug.security import generate_password_hash\n"
+        "from bench.fake_upstreams import SOIL_TYPES\n"
+        "app = create_app()\n"
+        "with app.app_context():\n"
+        "    if db.engine.dialect.name == 'sqlite':\n"
+        "        with db.engine.connect() as conn:\n"
+        "            conn.exec_driver_sql('PRAGMA journal_mode=WAL')\n"
+        "    db.create_all()\n"
+        "    for name in SOIL_TYPES:\n"
+        "        if not SoilTypeReference.query.filter_by(soil_type_name=name).first():\n"
+        "            db.session.add(SoilTypeReference(soil_type_name=name, description=name))\n"
+        f"    password_hash = generate_password_hash({PASSWORD!r})\n"
+        "    existing = {u.email for u in User.query.with_entities(User.email)}\n"
+        f"    for i in range({users}):\n"
+        "        email = f'bench{i}@example.com'\n"
+        "        if email not in existing:\n"
+        "            db.session.add(User(email=email, password_hash=password_hash, full_name=f'Bench {i}'))\n"
+        "    db.session.commit()\n"
+    )
+    subprocess.run([sys.executable, '-c', code], env=env, cwd=ROOT, check=True)
+
+
+def _start_app(env, workdir, port, workers, threads):
+    server_env = dict(env, GUNICORN_BIND=f"127.0.0.1:{port}", GUNICORN_WORKERS=str(workers),
+                      GUNICORN_THREADS=str(threads))
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'ab')
+    # Run from the scratch directory so uploads land there, not in the checkout
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+         '--pythonpath', ROOT, 'run:app'],
+        env=server_env, cwd=workdir, stdout=log, stderr=subprocess.STDOUT
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {proc.returncode}, see {log.name}")
+        try:
+            if requests.get(f"{base_url}/health/ready", timeout=1).status_code == 200:
+                return proc, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"gunicorn did not become ready, see {log.name}")
+
+
+# --- measurement -----------------------------------------------------------
+
+def _percentile(ordered, q):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+
+def run_level(clients, scenario, duration, warmup):
+    """Closed loop: every client issues its next request as soon as the previous one returns."""
+    fn = SCENARIOS[scenario]
+    samples = []
+    lock = threading.Lock()
+    start_at = time.monotonic() + warmup
+    stop_at = start_at + duration
+
+    def worker(client):
+        local = []
+        while True:
+            started = time.monotonic()
+            if started >= stop_at:
+                break
+            try:
+                response = fn(client)
+                status = response.status_code
+                queries = response.headers.get('X-DB-Queries')
+                cache = (int(response.headers.get('X-Cache-Hits', 0)), int(response.headers.get('X-Cache-Misses', 0)))
+                response.close()
+            except requests.RequestException:
+                status, queries, cache = 0, None, (0, 0)
+            finished = time.monotonic()
+            client.iteration += 1
+            if started >= start_at:
+                local.append((finished - started, status, int(queries) if queries is not None else None, cache))
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(c,)) for c in clients]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    latencies = sorted(s[0] for s in samples)
+    ok = [s for s in samples if 200 <= s[1] < 400]
+    queries = sorted(s[2] for s in samples if s[2] is not None)
+    statuses = {}
+    for _, status, _, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    hits = sum(s[3][0] for s in samples)
+    misses = sum(s[3][1] for s in samples)
+    return {
+        "scenario": scenario,
+        "concurrency": len(clients),
+        "duration_s": duration,
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": len(samples) - len(ok),
+        "status_counts": statuses,
+        "rps": round(len(samples) / duration, 2),
+        "ok_rps": round(len(ok) / duration, 2),
+        "latency_ms": {
+            "mean": round(1000 * sum(latencies) / len(latencies), 2) if latencies else None,
+            "p50": round(1000 * _percentile(latencies, 0.50), 2) if latencies else None,
+            "p95": round(1000 * _percentile(latencies, 0.95), 2) if latencies else None,
+            "p99": round(1000 * _percentile(latencies, 0.99), 2) if latencies else None,
+            "max": round(1000 * latencies[-1], 2) if latencies else None,
+        },
+        "db_queries_per_request": {
+            "mean": round(sum(queries) / len(queries), 2) if queries else None,
+            "p50": _percentile(queries, 0.50),
+            "max": queries[-1] if queries else None,
+        },
+        "cache": {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / (hits + misses), 4) if hits + misses else None,
+        }
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--concurrency', default='1,8,32', help="comma-separated client counts")
+    parser.add_argument('--duration', type=float, default=15, help="measured seconds per level")
+    parser.add_argument('--warmup', type=float, default=2, help="unmeasured seconds per level")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=64)
+    parser.add_argument('--database-url', help="defaults to a throwaway SQLite file")
+    parser.add_argument('--claude-latency-ms', type=float, default=1500)
+    parser.add_argument('--weather-latency-ms', type=float, default=150)
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--crops-per-response', type=int, default=5)
+    parser.add_argument('--soil-low-confidence', type=float, default=0.2,
+                        help="share of small-tier soil answers with CONFIDENCE: Low (escalated)")
+    parser.add_argument('--hourly-points', type=int, default=48)
+    parser.add_argument('--image-kb', type=int, default=200)
+    parser.add_argument('--no-admission', action='store_true', help="disable admission control in the app")
+    parser.add_argument('--cache-backend', choices=['sqlite', 'memory', 'none'],
+                        help="service cache backend of the app (default: its CACHE_BACKEND)")
+    parser.add_argument('--locations', type=int, default=1,
+                        help="forecast tiles the weather scenarios spread their requests over")
+    parser.add_argument('--output', help="defaults to bench/results/<timestamp>.json")
+    parser.add_argument('--keep', action='store_true', help="keep the scratch directory")
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    levels = [int(c) for c in args.concurrency.split(',')]
+
+    claude_profile = LatencyProfile(args.claude_latency_ms, args.latency_sigma, args.error_rate)
+    weather_profile = LatencyProfile(args.weather_latency_ms, args.latency_sigma, args.error_rate)
+    anthropic_server, anthropic_url = start_anthropic(claude_profile, crops_per_response=args.crops_per_response,
+                                                       small_model_low_confidence=args.soil_low_confidence)
+    weather_server, weather_url = start_weather(weather_profile, hourly_points=args.hourly_points)
+
+    workdir = tempfile.mkdtemp(prefix='foranger-bench-')
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}?timeout=30"
+    env = dict(os.environ)
+    env.update(upstream_env(anthropic_url, weather_url))
+    env.update({
+        "DATABASE_URL": database_url,
+        "QUERY_COUNT_HEADER": "true",
+        "TIMING_LOG_ENABLED": "false",
+        "ADMISSION_ENABLED": "false" if args.no_admission else env.get("ADMISSION_ENABLED", "true"),
+        "PYTHONPATH": os.pathsep.join(p for p in [ROOT, env.get("PYTHONPATH")] if p),
+    })
+    if args.cache_backend:
+        env["CACHE_BACKEND"] = args.cache_backend
+
+    proc = None
+    results = []
+    try:
+        _seed_database(env, max(levels))
+        proc, base_url = _start_app(env, workdir, _free_port(), args.workers, args.threads)
+        image = os.urandom(args.image_kb * 1024)
+        clients = [Client(base_url, f"bench{i}@example.com", image, args.locations) for i in range(max(levels))]
+        for scenario in scenarios:
+            for level in levels:
+                result = run_level(clients[:level], scenario, args.duration, args.warmup)
+                results.append(result)
+                lat = result['latency_ms']
+                print(f"{scenario:16} c={level:<4} rps={result['rps']:<8} p50={lat['p50']}ms p95={lat['p95']}ms "
+                      f"p99={lat['p99']}ms errors={result['errors']} queries/req={result['db_queries_per_request']['mean']} "
+                      f"cache_hits={result['cache']['hit_ratio']}",
+                      flush=True)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        anthropic_server.shutdown()
+        weather_server.shutdown()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "database": "sqlite" if args.database_url is None else args.database_url.split(':', 1)[0],
+            "workers": args.workers,
+            "threads": args.threads,
+            "admission_enabled": not args.no_admission,
+            "cache_backend": env.get("CACHE_BACKEND", "sqlite"),
+            "locations": args.locations,
+            "upstreams": {
+                "anthropic": claude_profile.to_dict(),
+                "openweather": weather_profile.to_dict(),
+                "crops_per_response": args.crops_per_response,
+                "soil_low_confidence": args.soil_low_confidence,
+                "hourly_points": args.hourly_points,
+                "image_kb": args.image_kb,
+            },
+        },
+        "results": results
+    }
+    output = args.output or os.path.join(ROOT, 'bench', 'results',
+                                          datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,12 @@ class Config:
     CLAUDE_API_KEY = os.getenv('CLAUDE_API_KEY')
     CLAUDE_API_BASE_URL = os.getenv('CLAUDE_API_BASE_URL', 'https://api.anthropic.com')
     OPENWEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY')
+    OPENWEATHER_BASE_URL = os.getenv('OPENWEATHER_BASE_URL', 'https://api.openweathermap.org')
+
+    # IP geolocation providers, tried in order
+    IP_API_URL = os.getenv('IP_API_URL', 'http://ip-api.com/json')
+    IPAPI_CO_URL = os.getenv('IPAPI_CO_URL', 'https://ipapi.co/json/')
+    FREEGEOIP_URL = os.getenv('FREEGEOIP_URL', 'https://freegeoip.app/json/')
     
     # Flask
     SECRET_KEY = os.environ.get("SECRET_KEY", "your-secret-key-change-this-in-production")
@@ -21,18 +27,243 @@ class Config:
     if SQLALCHEMY_DATABASE_URI and SQLALCHEMY_DATABASE_URI.startswith("postgres://"):
         SQLALCHEMY_DATABASE_URI = SQLALCHEMY_DATABASE_URI.replace("postgres://", "postgresql://", 1)
     
+    # Optional read replica for the read-only endpoints (app/db_routing.py). Locally,
+    # point it at a copy of the primary SQLite file to exercise the routing.
+    DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL")
+    if DATABASE_REPLICA_URL and DATABASE_REPLICA_URL.startswith("postgres://"):
+        DATABASE_REPLICA_URL = DATABASE_REPLICA_URL.replace("postgres://", "postgresql://", 1)
+    SQLALCHEMY_BINDS = {"replica": DATABASE_REPLICA_URL} if DATABASE_REPLICA_URL else {}
+    # How long a user's reads stay on the primary after they write (covers replica
+    # lag and the write-behind flush interval)
+    REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", 10))
+
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SQLALCHEMY_ENGINE_OPTIONS = {
-        'pool_pre_ping': True,
-        'pool_recycle': 300,
+    # Extra engine options; anything set here wins over the DB_POOL_* settings
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+    # Connection pool, per worker process (see app/db_pool.py). Keep
+    # workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW) under the server's connection limit.
+    # DB_POOL_MODE=external is for a transaction-mode pooler in front of the
+    # database (PgBouncer, Supabase pooler on :6543): the app then keeps no pool
+    # of its own (NullPool) and prepared statements are disabled.
+    DB_POOL_MODE = os.getenv("DB_POOL_MODE", "queue").lower()
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 300))
+    DB_POOL_USE_LIFO = os.getenv("DB_POOL_USE_LIFO", "True").lower() in ["true", "1", "yes"]
+    # Pre-ping costs a round trip per checkout; recycle and LIFO keep connections fresh instead
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "False").lower() in ["true", "1", "yes"]
+
+    # Write-behind queue for non-critical updates (last_login_at, photo links, counters)
+    WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "True").lower() in ["true", "1", "yes"]
+    WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", 10000))
+    WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", 2.0))
+    WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 500))
+
+    # Admission control for upstream-bound endpoints (limits are per worker process).
+    # Keep concurrency + queue depth across classes below GUNICORN_THREADS so login
+    # and the cheap read endpoints always find a free thread.
+    ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "True").lower() in ["true", "1", "yes"]
+    ADMISSION_CLASSES = {
+        "recommend": {
+            "endpoints": [
+                "main.submit_soil_analysis",
+                "main.get_crop_recommendations",
+                "main.get_crop_recommendations_with_soil",
+                "main.get_crop_recommendations_with_soil_file",
+            ],
+            "concurrency": int(os.getenv("ADMISSION_RECOMMEND_CONCURRENCY", 16)),
+            "queue_depth": int(os.getenv("ADMISSION_RECOMMEND_QUEUE", 8)),
+            "queue_timeout": float(os.getenv("ADMISSION_RECOMMEND_QUEUE_TIMEOUT", 10)),
+            "per_user": int(os.getenv("ADMISSION_RECOMMEND_PER_USER", 2)),
+        },
+        "vision": {
+            "endpoints": ["main.analyze_soil"],
+            "concurrency": int(os.getenv("ADMISSION_VISION_CONCURRENCY", 8)),
+            "queue_depth": int(os.getenv("ADMISSION_VISION_QUEUE", 4)),
+            "queue_timeout": float(os.getenv("ADMISSION_VISION_QUEUE_TIMEOUT", 10)),
+            "per_user": int(os.getenv("ADMISSION_VISION_PER_USER", 2)),
+        },
+        "chat": {
+            "endpoints": ["main.claude_chat"],
+            "concurrency": int(os.getenv("ADMISSION_CHAT_CONCURRENCY", 8)),
+            "queue_depth": int(os.getenv("ADMISSION_CHAT_QUEUE", 4)),
+            "queue_timeout": float(os.getenv("ADMISSION_CHAT_QUEUE_TIMEOUT", 5)),
+            "per_user": int(os.getenv("ADMISSION_CHAT_PER_USER", 1)),
+        },
+    }
+
+    # Time budget per request in seconds (app/deadline.py); upstream calls get what is left
+    # of it instead of their fixed timeouts. A client can shorten it with the
+    # REQUEST_DEADLINE_HEADER header (seconds), up to REQUEST_DEADLINE_MAX_SECONDS on
+    # endpoints not listed here. Same-day history, soil tier escalation and Claude's
+    # shortlist elaboration are skipped when less than their *_MIN_SECONDS is left
+    REQUEST_DEADLINES_ENABLED = os.getenv("REQUEST_DEADLINES_ENABLED", "True").lower() in ["true", "1", "yes"]
+    REQUEST_DEADLINES = {
+        "main.submit_soil_analysis": float(os.getenv("DEADLINE_RECOMMEND_SECONDS", 30)),
+        "main.get_crop_recommendations": float(os.getenv("DEADLINE_RECOMMEND_SECONDS", 30)),
+        "main.get_crop_recommendations_with_soil": float(os.getenv("DEADLINE_RECOMMEND_WITH_SOIL_SECONDS", 45)),
+        "main.get_crop_recommendations_with_soil_file": float(os.getenv("DEADLINE_RECOMMEND_WITH_SOIL_SECONDS", 45)),
+        "main.analyze_soil": float(os.getenv("DEADLINE_VISION_SECONDS", 30)),
+        "main.claude_chat": float(os.getenv("DEADLINE_CHAT_SECONDS", 30)),
+        "main.get_current_weather": float(os.getenv("DEADLINE_WEATHER_SECONDS", 10)),
+        "main.detect_location": float(os.getenv("DEADLINE_WEATHER_SECONDS", 10)),
+    }
+    REQUEST_DEADLINE_HEADER = os.getenv("REQUEST_DEADLINE_HEADER", "X-Request-Timeout")
+    REQUEST_DEADLINE_MAX_SECONDS = float(os.getenv("REQUEST_DEADLINE_MAX_SECONDS", 60))
+    DEADLINE_MIN_STAGE_SECONDS = float(os.getenv("DEADLINE_MIN_STAGE_SECONDS", 0.5))
+    DEADLINE_HISTORY_MIN_SECONDS = float(os.getenv("DEADLINE_HISTORY_MIN_SECONDS", 15))
+    DEADLINE_ESCALATION_MIN_SECONDS = float(os.getenv("DEADLINE_ESCALATION_MIN_SECONDS", 10))
+    DEADLINE_SHORTLIST_MIN_SECONDS = float(os.getenv("DEADLINE_SHORTLIST_MIN_SECONDS", 8))
+
+    # Idempotency-Key header on /soil/submit and the /crops/recommend* endpoints
+    # (app/idempotency.py): the response of the first request with a key is stored and
+    # replayed to retries for IDEMPOTENCY_TTL_HOURS; a retry arriving while the first is
+    # still running waits up to IDEMPOTENCY_WAIT_SECONDS. IDEMPOTENCY_LOCK_SECONDS bounds
+    # how long a claim by a crashed worker blocks its key (keep it above REQUEST_DEADLINES)
+    IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "True").lower() in ["true", "1", "yes"]
+    IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", 24))
+    IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", 30))
+    IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", 120))
+    IDEMPOTENCY_PURGE_INTERVAL = int(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", 300))
+
+    # Structured per-request timing log lines (stderr)
+    TIMING_LOG_ENABLED = os.getenv("TIMING_LOG_ENABLED", "True").lower() in ["true", "1", "yes"]
+
+    # Optional bearer token required by /metrics
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+    # On-demand request profiling: admins send X-Profile: 1, or endpoints are
+    # sampled at random, e.g. PROFILE_SAMPLE_RATES="main.submit_soil_analysis=0.01"
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "True").lower() in ["true", "1", "yes"]
+    PROFILE_DIR = os.getenv("PROFILE_DIR")
+    PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+    PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 200))
+    PROFILE_SAMPLE_RATES = {
+        endpoint.strip(): float(rate)
+        for endpoint, rate in (
+            item.split("=", 1) for item in os.getenv("PROFILE_SAMPLE_RATES", "").split(",") if "=" in item
+        )
     }
 
     # Flask settings
     DEBUG = os.environ.get("FLASK_DEBUG", "False").lower() in ["true", "1", "yes"]
+
+    # Reverse proxies in front of the app that append to X-Forwarded-For (1 behind the
+    # single nginx that gunicorn's 127.0.0.1 bind expects). request.remote_addr -- used
+    # for the admission and idempotency keys of anonymous clients -- is taken from that
+    # many hops back; 0 ignores the header (only when clients connect directly)
+    PROXY_FIX_X_FOR = int(os.getenv("PROXY_FIX_X_FOR", 1))
     
     # Optional: Add SSL requirement for production
     SQLALCHEMY_ENGINE_OPTIONS.update({
         'connect_args': {
             'sslmode': 'require'
         }
-    }) if not DEBUG else None
\ No newline at end of file
+    }) if not DEBUG and SQLALCHEMY_DATABASE_URI.startswith("postgresql") else None
+
+    # Worker warm-up (gunicorn post_worker_init): pooled DB connections to open
+    WARMUP_DB_CONNECTIONS = int(os.getenv("WARMUP_DB_CONNECTIONS", 2))
+    # A failing warm-up database check is retried for WARMUP_RETRY_SECONDS at worker start,
+    # then again by /health/ready at most every WARMUP_RETRY_INTERVAL seconds
+    WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", 10))
+    WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", 5))
+
+    # Adds an X-DB-Queries response header (used by the benchmark suite)
+    QUERY_COUNT_HEADER = os.getenv("QUERY_COUNT_HEADER", "False").lower() in ["true", "1", "yes"]
+    # Forecasts are stored once per grid tile and forecast issue (forecast_points);
+    # plots within the same tile share one series
+    FORECAST_TILE_DEGREES = float(os.getenv("FORECAST_TILE_DEGREES", 0.1))
+
+    # Circuit breakers on the weather and IP geolocation upstreams (app/circuit_breaker.py):
+    # CIRCUIT_BREAKER_FAILURES consecutive failures open one for CIRCUIT_BREAKER_RESET_SECONDS.
+    # Meanwhile get_weather_data serves the newest WeatherData of the same or a neighbouring
+    # tile no older than WEATHER_FALLBACK_MAX_AGE_HOURS, flagged as degraded (0 disables this)
+    CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "True").lower() in ["true", "1", "yes"]
+    CIRCUIT_BREAKER_FAILURES = int(os.getenv("CIRCUIT_BREAKER_FAILURES", 5))
+    CIRCUIT_BREAKER_RESET_SECONDS = float(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", 30))
+    CIRCUIT_BREAKER_HALF_OPEN_CALLS = int(os.getenv("CIRCUIT_BREAKER_HALF_OPEN_CALLS", 1))
+    WEATHER_FALLBACK_MAX_AGE_HOURS = float(os.getenv("WEATHER_FALLBACK_MAX_AGE_HOURS", 6))
+
+    # Cache of upstream answers shared by the workers (app/cache.py, `flask cache stats|clear`):
+    # 'sqlite' (a WAL-mode file at CACHE_PATH, kept across restarts), 'memory' (per worker)
+    # or 'none'. A missing key is fetched by one caller while the others wait for it up to
+    # CACHE_LOCK_WAIT_SECONDS. One Call answers are shared per forecast tile, reverse geocoding
+    # per GEOCODE_CACHE_DEGREES cell; TTLs are in seconds (0 disables caching that call)
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite")
+    CACHE_PATH = os.getenv("CACHE_PATH", os.path.join(os.getcwd(), "cache", "services.sqlite3"))
+    CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 256 * 1024 * 1024))
+    CACHE_EVICT_EVERY = int(os.getenv("CACHE_EVICT_EVERY", 200))
+    CACHE_LOCK_SECONDS = float(os.getenv("CACHE_LOCK_SECONDS", 30))
+    CACHE_LOCK_WAIT_SECONDS = float(os.getenv("CACHE_LOCK_WAIT_SECONDS", 10))
+    WEATHER_CACHE_TTL = int(os.getenv("WEATHER_CACHE_TTL", 600))
+    GEOCODE_CACHE_TTL = int(os.getenv("GEOCODE_CACHE_TTL", 7 * 86400))
+    GEOCODE_CACHE_DEGREES = float(os.getenv("GEOCODE_CACHE_DEGREES", 0.01))
+    HISTORY_CACHE_TTL = int(os.getenv("HISTORY_CACHE_TTL", 7 * 86400))
+    IP_GEO_CACHE_TTL = int(os.getenv("IP_GEO_CACHE_TTL", 3600))
+
+    # Crop recommendation prompt: 'compact' (app/services/prompt_encoder.py) or the
+    # original 'legacy' repr-based prompt, plus how many years of same-day history
+    # to fetch alongside the weather and include (0 disables the extra calls)
+    CROP_PROMPT_ENCODING = os.getenv("CROP_PROMPT_ENCODING", "compact")
+    CROP_PROMPT_HISTORY_YEARS = int(os.getenv("CROP_PROMPT_HISTORY_YEARS", 0))
+
+    # Crop recommendation mode when a request does not pass one: 'fast' (local
+    # ranking only, no Claude call), 'shortlist' (Claude elaborates on the top
+    # CROP_SHORTLIST_SIZE local picks) or 'open' (Claude chooses freely)
+    CROP_RECOMMEND_MODE = os.getenv("CROP_RECOMMEND_MODE", "shortlist")
+    CROP_SHORTLIST_SIZE = int(os.getenv("CROP_SHORTLIST_SIZE", 3))
+
+    # Uploaded soil photos: where /soil/analyze stores them and how /uploads/ serves
+    # them -- 'direct' (send_file, Range and sendfile(2) in the worker),
+    # 'x-accel-redirect' (nginx internal location at UPLOADS_ACCEL_PREFIX) or
+    # 'x-sendfile'. UPLOADS_MAX_AGE is for names from before content hashing;
+    # hashed names are cached as immutable
+    UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER", os.path.join(os.getcwd(), "uploads"))
+    UPLOADS_SERVE_MODE = os.getenv("UPLOADS_SERVE_MODE", "direct")
+    UPLOADS_ACCEL_PREFIX = os.getenv("UPLOADS_ACCEL_PREFIX", "/protected-uploads/")
+    UPLOADS_MAX_AGE = int(os.getenv("UPLOADS_MAX_AGE", 3600))
+    UPLOAD_ARCHIVE_FOLDER = os.getenv("UPLOAD_ARCHIVE_FOLDER", os.path.join(os.getcwd(), "uploads-archive"))
+
+    # Upload storage lifecycle (app/storage.py, `flask storage report|sweep`): unlinked
+    # photos (analyzed, never submitted) are deleted after STORAGE_UNLINKED_RETENTION_HOURS,
+    # files no row refers to after STORAGE_ORPHAN_GRACE_SECONDS, and with
+    # STORAGE_ARCHIVE_AFTER_DAYS > 0 older originals are gzipped into UPLOAD_ARCHIVE_FOLDER.
+    # STORAGE_SWEEP_INTERVAL > 0 also sweeps from a background thread every that many seconds
+    STORAGE_UNLINKED_RETENTION_HOURS = float(os.getenv("STORAGE_UNLINKED_RETENTION_HOURS", 48))
+    STORAGE_ORPHAN_GRACE_SECONDS = int(os.getenv("STORAGE_ORPHAN_GRACE_SECONDS", 3600))
+    STORAGE_ARCHIVE_AFTER_DAYS = int(os.getenv("STORAGE_ARCHIVE_AFTER_DAYS", 0))
+    STORAGE_SWEEP_BATCH = int(os.getenv("STORAGE_SWEEP_BATCH", 500))
+    STORAGE_SWEEP_INTERVAL = int(os.getenv("STORAGE_SWEEP_INTERVAL", 0))
+
+    # Thumbnail and medium WebP copies of soil photos for the history screens
+    # (app/services/photo_derivatives.py), longest side in px, made on
+    # PHOTO_DERIVATIVE_WORKERS background threads
+    PHOTO_DERIVATIVES_ENABLED = os.getenv("PHOTO_DERIVATIVES_ENABLED", "True").lower() in ["true", "1", "yes"]
+    PHOTO_DERIVATIVE_SIZES = [int(s) for s in os.getenv("PHOTO_DERIVATIVE_SIZES", "160,800").split(",")]
+    PHOTO_DERIVATIVE_QUALITY = int(os.getenv("PHOTO_DERIVATIVE_QUALITY", 75))
+    PHOTO_DERIVATIVE_WORKERS = int(os.getenv("PHOTO_DERIVATIVE_WORKERS", 2))
+    PHOTO_DERIVATIVE_MAX_PENDING = int(os.getenv("PHOTO_DERIVATIVE_MAX_PENDING", 500))
+
+    # Soil photo pre-classifier (app/services/soil_classifier.py): /soil/analyze
+    # skips the vision model when the k nearest labelled photos agree with at least
+    # SOIL_CLASSIFIER_MIN_CONFIDENCE. Needs SOIL_CLASSIFIER_MIN_PHOTOS labelled photos
+    # in uploads/ before it answers at all; the index is rebuilt every
+    # SOIL_CLASSIFIER_REFRESH seconds
+    SOIL_CLASSIFIER_ENABLED = os.getenv("SOIL_CLASSIFIER_ENABLED", "True").lower() in ["true", "1", "yes"]
+    SOIL_CLASSIFIER_K = int(os.getenv("SOIL_CLASSIFIER_K", 5))
+    SOIL_CLASSIFIER_MIN_CONFIDENCE = float(os.getenv("SOIL_CLASSIFIER_MIN_CONFIDENCE", 0.8))
+    SOIL_CLASSIFIER_MAX_DISTANCE = float(os.getenv("SOIL_CLASSIFIER_MAX_DISTANCE", 0.35))
+    SOIL_CLASSIFIER_MIN_PHOTOS = int(os.getenv("SOIL_CLASSIFIER_MIN_PHOTOS", 30))
+    SOIL_CLASSIFIER_MAX_PHOTOS = int(os.getenv("SOIL_CLASSIFIER_MAX_PHOTOS", 5000))
+    SOIL_CLASSIFIER_REFRESH = int(os.getenv("SOIL_CLASSIFIER_REFRESH", 3600))
+
+    # Soil image analysis asks these models in order (cheapest first) and only moves
+    # on when an answer has a missing or out-of-vocabulary field or a CONFIDENCE in
+    # SOIL_TIER_LOW_CONFIDENCE; a request that names a model uses only that model
+    SOIL_MODEL_TIERS = [m.strip() for m in os.getenv(
+        "SOIL_MODEL_TIERS", "claude-3-5-haiku-20241022,claude-3-5-sonnet-20241022").split(",") if m.strip()]
+    # Photos of one plot that /soil/analyze sends to the vision model in a single call
+    SOIL_MAX_IMAGES = int(os.getenv("SOIL_MAX_IMAGES", 5))
+    SOIL_TIER_LOW_CONFIDENCE = [c.strip() for c in os.getenv("SOIL_TIER_LOW_CONFIDENCE", "Low").split(",") if c.strip()]
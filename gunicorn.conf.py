@@ -0,0 +1,34 @@
+import os
+
+# Gunicorn settings, overridable from the environment.
+#
+# Upstream-bound views (Claude, OpenWeather) are async and run their independent
+# upstream calls concurrently. With the threaded worker each thread holds one
+# request, so a single process keeps WORKERS x THREADS requests -- and several
+# times that many upstream calls -- in flight while only waiting on I/O.
+bind = os.getenv("GUNICORN_BIND", "127.0.0.1:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", 2))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", 64))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 300))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+# Whole files from /uploads/ go out through sendfile(2) (UPLOADS_SERVE_MODE=direct)
+sendfile = os.getenv("GUNICORN_SENDFILE", "True").lower() in ["true", "1", "yes"]
+
+# Load the app once in the master and fork workers from it, so imported code is
+# shared copy-on-write instead of being imported again by every worker.
+preload_app = os.getenv("GUNICORN_PRELOAD", "True").lower() in ["true", "1", "yes"]
+
+
+def when_ready(server):
+    # Runs in the master before the first fork
+    if preload_app:
+        from app.warmup import preload_modules
+        preload_modules()
+
+
+def post_worker_init(worker):
+    # Runs in each worker before it accepts connections
+    from app.warmup import warm_up
+    warm_up(worker.wsgi)
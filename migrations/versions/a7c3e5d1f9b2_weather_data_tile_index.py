@@ -0,0 +1,26 @@
+"""weather_data tile index
+
+Revision ID: a7c3e5d1f9b2
+Revises: f2d9a4c6b8e1
+Create Date: 2026-10-19 21:14:37.208391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e5d1f9b2'
+down_revision = 'f2d9a4c6b8e1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('weather_data', schema=None) as batch_op:
+        batch_op.create_index('ix_weather_data_tile_fetched', ['forecast_tile_id', 'fetched_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('weather_data', schema=None) as batch_op:
+        batch_op.drop_index('ix_weather_data_tile_fetched')
@@ -5,7 +5,9 @@ from .soil_analyses import SoilAnalysis
 from .soil_photos import SoilPhoto
 from .soil_type_reference import SoilTypeReference
 from .weather_data import WeatherData
+from .forecast_points import ForecastPoint
 from .blacklisted_token import BlacklistedToken
+from .idempotency_keys import IdempotencyKey
 
 __all__ = [
     'User',
@@ -14,5 +16,7 @@ __all__ = [
     'SoilAnalysis',
     'SoilPhoto',
     'SoilTypeReference',
-    'WeatherData'
+    'WeatherData',
+    'ForecastPoint',
+    'IdempotencyKey'
 ]
\ No newline at end of file
@@ -0,0 +1,45 @@
+from app.extensions import db
+
+class ForecastPoint(db.Model):
+    """One forecast value set per (tile, series, issue, forecast time).
+
+    ``series`` is 'daily' or 'hourly'. The primary key is ordered so both
+    "latest issue for a tile" and "time range within an issue" are index
+    range scans; there is no surrogate id to keep rows small.
+    """
+    __tablename__ = "forecast_points"
+
+    tile_id = db.Column(db.String(24), primary_key=True)
+    series = db.Column(db.String(8), primary_key=True)
+    issued_at = db.Column(db.DateTime, primary_key=True)
+    forecast_at = db.Column(db.DateTime, primary_key=True)
+    temperature = db.Column(db.Float, nullable=True)
+    temperature_min = db.Column(db.Float, nullable=True)
+    temperature_max = db.Column(db.Float, nullable=True)
+    humidity = db.Column(db.SmallInteger, nullable=True)
+    pressure = db.Column(db.SmallInteger, nullable=True)
+    wind_speed = db.Column(db.Float, nullable=True)
+    clouds = db.Column(db.SmallInteger, nullable=True)
+    pop = db.Column(db.Float, nullable=True)
+    rain_mm = db.Column(db.Float, nullable=True)
+    snow_mm = db.Column(db.Float, nullable=True)
+    weather_main = db.Column(db.String(16), nullable=True)
+
+    def __repr__(self):
+        return f"<ForecastPoint {self.tile_id} {self.series} {self.forecast_at}>"
+
+    def to_dict(self):
+        return {
+            "forecast_at": self.forecast_at.isoformat() if self.forecast_at else None,
+            "temperature": self.temperature,
+            "temperature_min": self.temperature_min,
+            "temperature_max": self.temperature_max,
+            "humidity": self.humidity,
+            "pressure": self.pressure,
+            "wind_speed": self.wind_speed,
+            "clouds": self.clouds,
+            "pop": self.pop,
+            "rain_mm": self.rain_mm,
+            "snow_mm": self.snow_mm,
+            "weather_main": self.weather_main
+        }
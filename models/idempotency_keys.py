@@ -0,0 +1,26 @@
+from app.extensions import db
+
+class IdempotencyKey(db.Model):
+    """A client's Idempotency-Key and the response it got (see app/idempotency.py).
+
+    ``scope`` is the user (or client IP) that sent the key, so two users
+    cannot collide or read each other's responses. A row is 'in_flight' while
+    the first request runs, leased until ``locked_until``, then 'completed'
+    with the response until ``expires_at``.
+    """
+    __tablename__ = "idempotency_keys"
+
+    scope = db.Column(db.String(80), primary_key=True)
+    key = db.Column(db.String(255), primary_key=True)
+    endpoint = db.Column(db.String(80), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)
+    state = db.Column(db.String(16), nullable=False)
+    response_status = db.Column(db.SmallInteger, nullable=True)
+    response_mimetype = db.Column(db.String(80), nullable=True)
+    response_body = db.Column(db.LargeBinary, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<IdempotencyKey {self.scope} {self.key} {self.state}>"
@@ -8,11 +8,21 @@ class SoilPhoto(db.Model):
 
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     soil_analysis_id = db.Column(UUID(as_uuid=True), db.ForeignKey('soil_analyses.id'), nullable=True)
+    user_id = db.Column(UUID(as_uuid=True), db.ForeignKey('users.id'), nullable=True)
     photo_url = db.Column(db.String, nullable=True)
     photo_filename = db.Column(db.String, nullable=True)
+    # Derivatives next to photo_filename, made in the background (app/services/photo_derivatives.py)
+    thumbnail_filename = db.Column(db.String, nullable=True)
+    medium_filename = db.Column(db.String, nullable=True)
     analysis_result = db.Column(db.JSON, nullable=True)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
+    # Only photos waiting for /soil/submit are looked up by user, so only those are indexed
+    __table_args__ = (
+        db.Index('ix_soil_photos_unlinked_user', user_id, created_at,
+                 postgresql_where=soil_analysis_id.is_(None), sqlite_where=soil_analysis_id.is_(None)),
+    )
+
     # Relationships
     soil_analysis = db.relationship('SoilAnalysis', backref=db.backref('soil_photos', lazy=True))
 
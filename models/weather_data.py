@@ -16,16 +16,26 @@ class WeatherData(db.Model):
     current_pressure = db.Column(db.Numeric(precision=7, scale=2), nullable=True)
     forecast_7days = db.Column(db.JSON, nullable=True)
     forecast_14days = db.Column(db.JSON, nullable=True)
+    # The forecast itself lives in forecast_points under (tile, issue)
+    forecast_tile_id = db.Column(db.String(24), nullable=True)
+    forecast_issued_at = db.Column(db.DateTime, nullable=True)
     season = db.Column(db.String, nullable=True)
     weather_warnings = db.Column(db.Text, nullable=True)
     data_source = db.Column(db.String, nullable=True)
     fetched_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     expires_at = db.Column(db.DateTime, nullable=True)
 
+    # The stale-weather fallback looks up the newest rows of a few tiles
+    __table_args__ = (
+        db.Index('ix_weather_data_tile_fetched', forecast_tile_id, fetched_at),
+    )
+
     def __repr__(self):
         return f"<WeatherData {self.id} - {self.latitude},{self.longitude}>"
 
-    def to_dict(self):
+    def to_dict(self, forecast=None):
+        """``forecast`` is the daily series from forecast_points; rows written
+        before the table existed still carry it in ``forecast_7days``"""
         return {
             "id": str(self.id),
             "latitude": self.latitude,
@@ -35,11 +45,13 @@ class WeatherData(db.Model):
             "current_rainfall": self.current_rainfall,
             "current_wind_speed": self.current_wind_speed,
             "current_pressure": self.current_pressure,
-            "forecast_7days": self.forecast_7days,
+            "forecast_7days": forecast if forecast is not None else self.forecast_7days,
+            "forecast_tile_id": self.forecast_tile_id,
+            "forecast_issued_at": self.forecast_issued_at.isoformat() if self.forecast_issued_at else None,
             "season": self.season,
             "weather_warnings": self.weather_warnings,
             "data_source": self.data_source,
-            "created_at": self.created_at.isoformat() if self.created_at else None
+            "created_at": self.fetched_at.isoformat() if self.fetched_at else None
         }
 
    
\ No newline at end of file
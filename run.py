@@ -5,4 +5,6 @@ load_dotenv()
 app = create_app()
 
 if __name__ == "__main__":
+    from app.warmup import warm_up
+    warm_up(app)
     app.run(debug=True)
@@ -0,0 +1,32 @@
+import os
+import tempfile
+
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/test.db")
+os.environ.setdefault("CLAUDE_API_KEY", "test")
+os.environ.setdefault("OPENWEATHER_API_KEY", "test")
+
+import pytest
+from app import create_app
+from app.admission import request_user_key
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.add_url_rule('/_test/key', 'test_key', lambda: request_user_key())
+    return app.test_client()
+
+
+def test_forwarded_clients_get_their_own_keys(client):
+    proxy = {'REMOTE_ADDR': '127.0.0.1'}
+    first = client.get('/_test/key', environ_base=proxy, headers={'X-Forwarded-For': '203.0.113.7'})
+    second = client.get('/_test/key', environ_base=proxy, headers={'X-Forwarded-For': '198.51.100.23'})
+    assert first.get_data(as_text=True) == 'ip:203.0.113.7'
+    assert second.get_data(as_text=True) == 'ip:198.51.100.23'
+
+
+def test_only_the_trusted_hop_is_used(client):
+    # A client-supplied X-Forwarded-For entry ahead of the proxy's own is ignored
+    response = client.get('/_test/key', environ_base={'REMOTE_ADDR': '127.0.0.1'},
+                          headers={'X-Forwarded-For': '10.9.9.9, 203.0.113.7'})
+    assert response.get_data(as_text=True) == 'ip:203.0.113.7'